@@ -0,0 +1,71 @@
+"""Measure the request concurrency achieved by the OpenAI client against the local mock server.
+
+Usage:
+    uv run python -m benchmarks.client_concurrency --num-requests 1000 --latency 0.5 --max-concurrency 256
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import time
+
+from src.llm_jp_judge.client.remote import OpenAI
+from src.llm_jp_judge.dataset import DatasetItem
+from src.llm_jp_judge.mock_server import MockServer
+
+
+async def serve(latency: float, conn):
+    # The server runs in a separate process so that it does not compete with the client for the GIL
+    server = MockServer(latency_mean=latency)
+    async with await server.start() as s:
+        conn.send(s.sockets[0].getsockname()[1])
+
+        # Report the statistics when the parent asks for them
+        await asyncio.to_thread(conn.recv)
+        conn.send(dict(server.stats))
+
+
+def run_server(latency: float, conn):
+    asyncio.run(serve(latency, conn))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-requests", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.5, help="Mock server latency per request (seconds)")
+    parser.add_argument("--max-concurrency", type=int, default=256)
+    args = parser.parse_args()
+
+    conn, child_conn = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=run_server, args=(args.latency, child_conn), daemon=True)
+    server.start()
+    base_url = f"http://127.0.0.1:{conn.recv()}/v1"
+
+    client = OpenAI(
+        model_name="mock",
+        api_key="mock",
+        base_url=base_url,
+        async_request_interval=0,
+        max_concurrency=args.max_concurrency,
+    )
+    data = [DatasetItem(ID=i, prompt=["ping"]) for i in range(args.num_requests)]
+
+    start = time.perf_counter()
+    client(data)
+    elapsed = time.perf_counter() - start
+    client.close()
+
+    conn.send("stats")
+    stats = conn.recv()
+    server.join()
+
+    ideal = args.latency * -(-args.num_requests // args.max_concurrency)
+    print(f"requests:           {stats['requests']}")
+    print(f"connections:        {stats['connections']}")
+    print(f"peak concurrency:   {stats['peak_concurrency']} / {args.max_concurrency}")
+    print(f"elapsed:            {elapsed:.2f}s (ideal {ideal:.2f}s)")
+    print(f"throughput:         {stats['requests'] / elapsed:.1f} req/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""Measure the throughput and peak memory of the hot paths of evaluation on synthetic data.
+
+For each benchmark and size, the following stages are run on synthetic generation outputs:
+    load_raw_output  pydantic construction in `load_*_raw_output`
+    build_requests   judge prompt rendering and evaluation item construction in the evaluator
+    dispatch         the async dispatch loop of the OpenAI client, with a stub that answers immediately
+    aggregate        score aggregation, `calc_error_rate` and `log_raw_outputs` table building
+    save_json        `BaseDashboard.save_json`
+
+With memory tracing, the memory still held at the end of each stage (i.e. its output) is also reported in
+bytes per item. Results can be saved as a baseline and compared against it. Stages whose throughput drops, or
+whose peak memory grows, by more than the tolerance are reported as regressions and the exit status is 1.
+
+Usage:
+    uv run python -m benchmarks.hot_paths --sizes 10000 100000 --save-baseline
+    uv run python -m benchmarks.hot_paths --sizes 10000 100000 --baseline benchmarks/baselines/hot_paths.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable, MutableMapping
+from typing import Any
+
+from omegaconf import OmegaConf
+
+from src.llm_jp_judge.client.base import BaseClient
+from src.llm_jp_judge.client.remote import OpenAI
+from src.llm_jp_judge.dashboard.base import BaseDashboard
+from src.llm_jp_judge.dataset.utils import load_raw_output
+from src.llm_jp_judge.evaluator import load_evaluator
+from src.llm_jp_judge.evaluator.base import BaseScoreExtractor
+
+
+PROMPT_DIR = "src/llm_jp_judge/config/benchmark/prompt/evaluate"
+DEFAULT_BASELINE = "benchmarks/baselines/hot_paths.json"
+
+BENCHMARKS: dict[str, dict[str, Any]] = {
+    "quality_ja": {
+        "metric": "quality",
+        "prompt_template": "quality_ja.yaml",
+        "judge_response": "正確性: [[3]]\n流暢性: [[3]]\n詳細性: [[3]]\n関連性: [[3]]\n総合評価: [[3]]",
+        "item": lambda i: {"prompt": [f"質問{i}です。" * 10], "text": [f"質問{i}です。" * 10]},
+    },
+    "safety_ja": {
+        "metric": "safety",
+        "prompt_template": "safety_ja.yaml",
+        "judge_response": "評価理由: 安全です。\n[[4]]",
+        "use_reference": True,
+        "item": lambda i: {
+            "prompt": [f"質問{i}です。" * 10],
+            "text": [f"質問{i}です。" * 10],
+            "reference": [f"参考回答{i}です。" * 20],
+        },
+    },
+    "mt_bench_ja": {
+        "metric": "mt_bench",
+        "prompt_template": "mt_bench_ja_prompt_v1.yaml",
+        "judge_response": "評価: [[5]]",
+        "item": lambda i: {"prompt": [f"質問{i}です。" * 10, f"続きの質問{i}です。" * 10], "category": "writing"},
+    },
+}
+
+
+class StubClient(OpenAI):
+    """OpenAI client whose requests return a canned response immediately, to measure the dispatch loop."""
+
+    def __init__(self, response: str):
+        BaseClient.__init__(self, model_name="stub", async_request_interval=0)
+        self.response = response
+
+    async def async_request(
+        self,
+        prompt: list[str],
+        response: list[str | None],
+        system_prompt: str | None = None,
+        sampling_params: MutableMapping | None = None,
+        score_extractor: BaseScoreExtractor | None = None,
+        on_first_token: Callable[[float], Any] | None = None,
+        prompt_prefix: str | None = None,
+    ) -> str | None:
+        return self.response
+
+    async def aclose(self):
+        pass
+
+
+def write_raw_output(path: str, benchmark: dict[str, Any], size: int):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(size):
+            item = benchmark["item"](i)
+            num_turns = len(item["prompt"])
+            d = {
+                "ID": i,
+                "response": [f"回答{i}です。" * 30] * num_turns,
+                "error_messages": [[]] * num_turns,
+                "pattern": [None] * num_turns,
+                **item,
+            }
+            f.write(json.dumps(d, ensure_ascii=False) + "\n")
+
+
+def measure(stage: Callable[[], Any], size: int, trace_memory: bool) -> tuple[Any, dict[str, float]]:
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = stage()
+    elapsed = time.perf_counter() - start
+
+    stats = {"seconds": elapsed, "items_per_second": size / elapsed if elapsed > 0 else float("inf")}
+    if trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        stats["peak_memory_mb"] = peak / 1024**2
+        # 段階の終了後も残っているメモリ (段階の出力) の1件あたりの大きさ
+        stats["bytes_per_item"] = current / size
+        tracemalloc.stop()
+    return result, stats
+
+
+def run(name: str, size: int, trace_memory: bool, work_dir: str) -> dict[str, dict[str, float]]:
+    benchmark = BENCHMARKS[name]
+    raw_output_path = os.path.join(work_dir, f"{name}.{size}.jsonl")
+    write_raw_output(raw_output_path, benchmark, size)
+
+    client = StubClient(benchmark["judge_response"])
+    dashboard = BaseDashboard()
+    evaluator = load_evaluator(
+        client,
+        dashboard,
+        metric=benchmark["metric"],
+        name=name,
+        prompt_template=OmegaConf.load(os.path.join(PROMPT_DIR, benchmark["prompt_template"])),
+        use_reference=benchmark.get("use_reference", False),
+    )
+
+    results = {}
+    data, results["load_raw_output"] = measure(
+        lambda: list(load_raw_output(name, raw_output_path)), size, trace_memory
+    )
+    requests, results["build_requests"] = measure(lambda: evaluator.build_requests(data), size, trace_memory)
+
+    async def dispatch():
+        results = await asyncio.gather(*(evaluator.send(request) for request in requests))
+        return [raw_output for raw_outputs in results for raw_output in raw_outputs]
+
+    raw_outputs, results["dispatch"] = measure(lambda: client.run_until_complete(dispatch()), size, trace_memory)
+    _, results["aggregate"] = measure(lambda: evaluator.aggregate(raw_outputs), size, trace_memory)
+    _, results["save_json"] = measure(
+        lambda: dashboard.save_json(os.path.join(work_dir, f"{name}.{size}")), size, trace_memory
+    )
+
+    client.close()
+    return results
+
+
+def compare(
+    results: dict[str, dict[str, float]], baseline: dict[str, dict[str, float]], tolerance: float
+) -> list[str]:
+    regressions = []
+    for key, stats in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if stats["items_per_second"] < base["items_per_second"] * (1 - tolerance):
+            regressions.append(
+                f"{key}: throughput {stats['items_per_second']:.0f} < baseline {base['items_per_second']:.0f} items/s"
+            )
+        if "peak_memory_mb" in stats and "peak_memory_mb" in base:
+            if stats["peak_memory_mb"] > base["peak_memory_mb"] * (1 + tolerance):
+                regressions.append(
+                    f"{key}: peak memory {stats['peak_memory_mb']:.1f} > baseline {base['peak_memory_mb']:.1f} MB"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--benchmarks", nargs="+", default=list(BENCHMARKS), choices=list(BENCHMARKS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10000], help="Numbers of synthetic items")
+    parser.add_argument(
+        "--no-trace-memory",
+        action="store_true",
+        help="Do not trace the peak memory (tracing slows down the stages)",
+    )
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline to compare with or to save to")
+    parser.add_argument("--save-baseline", action="store_true", help="Save the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    results: dict[str, dict[str, float]] = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name in args.benchmarks:
+            for size in args.sizes:
+                for stage, stats in run(name, size, not args.no_trace_memory, work_dir).items():
+                    results[f"{name}/{size}/{stage}"] = stats
+
+    print(f"{'stage':<40} {'seconds':>10} {'items/s':>12} {'peak MB':>10} {'bytes/item':>12}")
+    for key, stats in results.items():
+        peak = f"{stats['peak_memory_mb']:.1f}" if "peak_memory_mb" in stats else "-"
+        per_item = f"{stats['bytes_per_item']:.0f}" if "bytes_per_item" in stats else "-"
+        print(f"{key:<40} {stats['seconds']:>10.3f} {stats['items_per_second']:>12.0f} {peak:>10} {per_item:>12}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+        print(f"Saved baseline to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        return
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if len(regressions) > 0:
+        sys.exit(1)
+    print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
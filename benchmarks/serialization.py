@@ -0,0 +1,107 @@
+"""Measure the throughput of saving and loading generation outputs with each installed JSON codec.
+
+For each codec and size, the following stages are run on synthetic generation outputs:
+    save_jsonl_dict   `save_jsonl` of dicts, as produced by `model_dump`
+    save_jsonl_model  `save_jsonl` of pydantic models, serialized without building dicts
+    iter_jsonl        `iter_jsonl` of the saved file
+    save_json         `save_json` of the records as a JSON array
+    load_json         `load_json` of the saved array
+
+Usage:
+    uv run python -m benchmarks.serialization --sizes 10000 100000
+    uv run python -m benchmarks.serialization --codecs json orjson
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from collections.abc import Callable
+from typing import Any
+
+from src.llm_jp_judge.dataset import DatasetItem
+from src.llm_jp_judge.utils.data import CODECS, JSONCodec, iter_jsonl, load_json, save_json, save_jsonl
+
+
+EXCLUDE = {"original_index", "sampling_params"}
+
+
+def make_items(size: int) -> list[DatasetItem]:
+    return [
+        DatasetItem(
+            ID=i,
+            prompt=[f"質問{i}です。" * 10],
+            response=[f"回答{i}です。" * 30],
+            error_messages=[[]],
+            pattern=[None],
+            usage=[{"input_tokens": 40, "output_tokens": 120}],
+        )
+        for i in range(size)
+    ]
+
+
+def available_codecs() -> dict[str, JSONCodec]:
+    codecs = {}
+    for name, codec_class in CODECS.items():
+        try:
+            codecs[name] = codec_class()
+        except ImportError:
+            continue
+    return codecs
+
+
+def measure(stage: Callable[[], Any], size: int, path: str) -> dict[str, float]:
+    start = time.perf_counter()
+    stage()
+    elapsed = time.perf_counter() - start
+    return {
+        "seconds": elapsed,
+        "items_per_second": size / elapsed if elapsed > 0 else float("inf"),
+        "mb_per_second": os.path.getsize(path) / 1024**2 / elapsed if elapsed > 0 else float("inf"),
+    }
+
+
+def run(codec: JSONCodec, size: int, work_dir: str) -> dict[str, dict[str, float]]:
+    items = make_items(size)
+    records = [d.model_dump(exclude=EXCLUDE) for d in items]
+    jsonl_path = os.path.join(work_dir, f"{codec.name}.{size}.jsonl")
+    json_path = os.path.join(work_dir, f"{codec.name}.{size}.json")
+
+    results = {}
+    results["save_jsonl_dict"] = measure(lambda: save_jsonl(jsonl_path, records, codec=codec), size, jsonl_path)
+    results["save_jsonl_model"] = measure(
+        lambda: save_jsonl(jsonl_path, items, exclude=EXCLUDE, codec=codec), size, jsonl_path
+    )
+    results["iter_jsonl"] = measure(lambda: sum(1 for _ in iter_jsonl(jsonl_path, codec=codec)), size, jsonl_path)
+    results["save_json"] = measure(lambda: save_json(json_path, records, codec=codec), size, json_path)
+    results["load_json"] = measure(lambda: load_json(json_path, codec=codec), size, json_path)
+    return results
+
+
+def main():
+    codecs = available_codecs()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--codecs", nargs="+", default=list(codecs), choices=list(CODECS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10000], help="Numbers of synthetic items")
+    args = parser.parse_args()
+
+    results: dict[str, dict[str, float]] = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name in args.codecs:
+            if name not in codecs:
+                print(f"Skipping {name}: not installed")
+                continue
+            for size in args.sizes:
+                for stage, stats in run(codecs[name], size, work_dir).items():
+                    results[f"{name}/{size}/{stage}"] = stats
+
+    print(f"{'stage':<40} {'seconds':>10} {'items/s':>12} {'MB/s':>10}")
+    for key, stats in results.items():
+        print(
+            f"{key:<40} {stats['seconds']:>10.3f} {stats['items_per_second']:>12.0f} {stats['mb_per_second']:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
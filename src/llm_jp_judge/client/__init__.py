@@ -1,4 +1,7 @@
 from .base import BaseClient
+from .batch import AzureOpenAIBatch, LocalBatch, OpenAIBatch
+from .offline import VLLM
+from .pool import PooledClient
 from .remote import AzureOpenAI, BedrockAnthropic, OpenAI
 
 
@@ -9,4 +12,14 @@ def load_client(name: str = "azure", **kwargs) -> BaseClient:
         return AzureOpenAI(**kwargs)
     elif name == "bedrock":
         return BedrockAnthropic(**kwargs)
+    elif name == "pool":
+        return PooledClient(**kwargs)
+    elif name == "openai_batch":
+        return OpenAIBatch(**kwargs)
+    elif name == "azure_batch":
+        return AzureOpenAIBatch(**kwargs)
+    elif name == "local_batch":
+        return LocalBatch(**kwargs)
+    elif name == "vllm":
+        return VLLM(**kwargs)
     raise ValueError(f"Invalid client name: {name}")
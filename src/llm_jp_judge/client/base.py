@@ -1,13 +1,27 @@
-from collections.abc import MutableMapping, Sequence
-from typing import TYPE_CHECKING, TypeVar, Union
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from collections.abc import Callable, Coroutine, Iterable, MutableMapping, Sequence
+from typing import TYPE_CHECKING, Any, TypeVar, Union
 
 from ..dataset import DatasetItem
+from .cache import ResponseCache
+from .scheduler import RateLimiter, current_flow
+from .telemetry import REQUEST_EVENTS, RequestRecord, RequestTelemetry, current_request
+from .tokenizer import ContextLengthExceededError, load_token_counter
 
 
 if TYPE_CHECKING:
     from ..evaluator.base import BaseScoreExtractor
 
 T = TypeVar("T", bound=DatasetItem)
+R = TypeVar("R")
+
+
+def get_adaptive_config(adaptive_concurrency: MutableMapping | None) -> dict[str, Any] | None:
+    if adaptive_concurrency is None or not adaptive_concurrency.get("enabled", False):
+        return None
+    return {k: v for k, v in adaptive_concurrency.items() if k != "enabled"}
 
 
 class BaseClient:
@@ -17,17 +31,203 @@ class BaseClient:
         max_retries: int = 1,
         async_request_interval: float = 1.0,
         disable_system_prompt: bool = False,
+        max_concurrency: int | None = None,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        cache: MutableMapping | None = None,
+        adaptive_concurrency: MutableMapping | None = None,
+        stream: bool = False,
+        prompt_cache: bool = False,
+        preflight: MutableMapping | None = None,
     ):
         self.model_name = model_name
         self.max_retries = max_retries
         self.async_request_interval = async_request_interval
         self.disable_system_prompt = disable_system_prompt
+        self.stream = stream
+        self.prompt_cache = prompt_cache
 
-    def __call__(
+        # RPM・TPMが指定されていない場合は制限せず、同時実行数のみで負荷を制御する
+        self.rate_limiter = RateLimiter(
+            max_concurrency=max_concurrency,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            adaptive=get_adaptive_config(adaptive_concurrency),
+        )
+
+        self.cache: ResponseCache | None = None
+        if cache is not None and cache.get("path") is not None:
+            self.cache = ResponseCache(**cache)
+        self._pending_requests: dict[str, asyncio.Future] = {}
+
+        # Tokens per flow (benchmark). Input tokens include those read from and written to the prompt cache
+        self.usage: defaultdict[str | None, Counter[str]] = defaultdict(Counter)
+
+        if preflight is None:
+            preflight = {}
+        self.token_counter = load_token_counter(preflight.get("tokenizer"))
+        self.max_context_length: int | None = preflight.get("max_context_length")
+        self.truncate_prompt: bool = preflight.get("truncate", False)
+
+        # Callbacks called with the `RequestRecord` when a request starts, is retried and completes
+        self.telemetry = RequestTelemetry()
+        self.request_hooks: dict[str, list[Callable[[RequestRecord], Any]]] = {event: [] for event in REQUEST_EVENTS}
+        self.add_request_hook("complete", self.telemetry.record)
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def run_until_complete(self, coro: Coroutine[Any, Any, R]) -> R:
+        # HTTP接続プールを呼び出し間で再利用するため、イベントループはクライアントごとに保持する
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(coro)
+
+    def count_tokens(
         self,
-        data: Sequence[T],
+        prompt: list[str],
+        response: list[str | None],
+        system_prompt: str | None = None,
+        sampling_params: MutableMapping | None = None,
+    ) -> int:
+        """Count the tokens a request consumes from the TPM quota, including the requested `max_tokens`."""
+        if sampling_params is None:
+            sampling_params = {}
+
+        max_tokens = sampling_params.get("max_tokens", sampling_params.get("max_completion_tokens")) or 0
+        texts = [text for text in [system_prompt, *prompt, *response] if text is not None]
+        return sum(self.token_counter.count(text) for text in texts) + max_tokens
+
+    def preflight(
+        self,
+        prompt: list[str],
+        response: list[str | None],
+        system_prompt: str | None = None,
+        sampling_params: MutableMapping | None = None,
+    ) -> tuple[list[str], int]:
+        """Count the tokens of a request and fit it into the context length before it is sent.
+
+        Returns the prompts, whose last one is truncated in the middle if needed and allowed, and the number of
+        tokens of the request. Raises `ContextLengthExceededError` if the request does not fit, as sending it
+        would only fail.
+        """
+        tokens = self.count_tokens(prompt, response, system_prompt=system_prompt, sampling_params=sampling_params)
+        if self.max_context_length is None or tokens <= self.max_context_length:
+            return prompt, tokens
+
+        # 最後のユーザー入力 (評価時は評価対象の応答を含む) 以外のトークン数
+        context_tokens = tokens - self.token_counter.count(prompt[-1])
+        if self.truncate_prompt and self.max_context_length > context_tokens:
+            truncated = self.token_counter.truncate(prompt[-1], self.max_context_length - context_tokens)
+            truncated_tokens = context_tokens + self.token_counter.count(truncated)
+            if truncated_tokens <= self.max_context_length:
+                logging.warning(f"Truncated a prompt to fit the context length: {tokens} -> {truncated_tokens} tokens")
+                return [*prompt[:-1], truncated], truncated_tokens
+
+        raise ContextLengthExceededError(
+            f"Request exceeds the context length ({tokens} > {self.max_context_length} tokens)"
+        )
+
+    def get_concurrency_history(self) -> dict[str, list[tuple[float, int]]]:
+        """Return the changes of the adaptive concurrency limit as (elapsed seconds, limit) per endpoint."""
+        if self.rate_limiter.adaptive is None:
+            return {}
+        return {self.model_name: self.rate_limiter.adaptive.history}
+
+    def add_request_hook(self, event: str, hook: Callable[[RequestRecord], Any]):
+        if event not in self.request_hooks:
+            raise ValueError(f"Invalid request event: {event}")
+        self.request_hooks[event].append(hook)
+
+    def emit_request_event(self, event: str, record: RequestRecord):
+        for hook in self.request_hooks[event]:
+            hook(record)
+
+    def start_request(self, d: DatasetItem, turn: int) -> RequestRecord:
+        record = RequestRecord(flow=current_flow.get(), item_id=d.ID, turn=turn)
+        self.emit_request_event("start", record)
+        return record
+
+    def complete_request(self, record: RequestRecord, d: DatasetItem, extract_score: bool = False):
+        response = d.response[record.turn]
+        record.success = response is not None and (not extract_score or d.pattern[record.turn] is not None)
+        d.usage[record.turn] = dict(record.usage) if len(record.usage) > 0 else None
+        self.emit_request_event("complete", record)
+
+    def record_usage(
+        self,
+        input_tokens: int,
+        output_tokens: int = 0,
+        reasoning_tokens: int = 0,
+        cached_tokens: int = 0,
+        cache_creation_tokens: int = 0,
+        estimated: bool = False,
+    ) -> Counter[str]:
+        """Add the usage of a response to its flow and to the request being processed, and return it.
+
+        Usage that was estimated rather than reported by the API (e.g. for a stream stopped early) is counted
+        in `estimated_requests`.
+        """
+        usage = Counter(
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            reasoning_tokens=reasoning_tokens,
+            cached_tokens=cached_tokens,
+            cache_creation_tokens=cache_creation_tokens,
+        )
+        if estimated:
+            usage["estimated_requests"] = 1
+        self.usage[current_flow.get()].update(usage)
+        record = current_request.get()
+        if record is not None:
+            record.usage.update(usage)
+        return usage
+
+    def get_usage(self) -> dict[str | None, Counter[str]]:
+        """Return the token usage per flow (benchmark)."""
+        return dict(self.usage)
+
+    async def aclose(self):
+        pass
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+
+        if self._loop is None or self._loop.is_closed():
+            return
+        self._loop.run_until_complete(self.aclose())
+        self._loop.close()
+
+    async def acall(
+        self,
+        data: Iterable[T],
         score_extractor: Union["BaseScoreExtractor", None] = None,
         system_prompt: str | None = None,
         sampling_params: MutableMapping | None = None,
+        callback: Callable[[T], Any] | None = None,
+        turn_callback: Callable[[T, int], Any] | None = None,
+        prompt_prefix: str | None = None,
     ) -> Sequence[T]:
         raise NotImplementedError
+
+    def __call__(
+        self,
+        data: Iterable[T],
+        score_extractor: Union["BaseScoreExtractor", None] = None,
+        system_prompt: str | None = None,
+        sampling_params: MutableMapping | None = None,
+        callback: Callable[[T], Any] | None = None,
+        turn_callback: Callable[[T, int], Any] | None = None,
+        prompt_prefix: str | None = None,
+    ) -> Sequence[T]:
+        return self.run_until_complete(
+            self.acall(
+                data,
+                score_extractor,
+                system_prompt,
+                sampling_params=sampling_params,
+                callback=callback,
+                turn_callback=turn_callback,
+                prompt_prefix=prompt_prefix,
+            )
+        )
@@ -0,0 +1,466 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import Counter
+from collections.abc import Callable, Iterable, MutableMapping, Sequence
+from typing import Any, TypeVar
+
+import hydra
+import openai
+from openai.types import CompletionUsage
+
+from ..dataset import DatasetItem
+from ..evaluator.base import BaseScoreExtractor
+from .base import BaseClient
+from .cache import CacheMissError
+from .remote import AzureOpenAI, OpenAI
+from .tokenizer import ContextLengthExceededError
+
+
+T = TypeVar("T", bound=DatasetItem)
+
+TERMINAL_STATUSES = ["completed", "failed", "expired", "cancelled"]
+
+# Response text, error message and token usage of a request in a batch
+BatchOutput = tuple[str | None, str | None, Counter[str] | None]
+
+
+class BatchService:
+    url = "/v1/chat/completions"
+
+    async def submit(self, path: str) -> str:
+        raise NotImplementedError
+
+    async def status(self, batch_id: str) -> str:
+        raise NotImplementedError
+
+    async def results(self, batch_id: str) -> list[dict[str, Any]]:
+        raise NotImplementedError
+
+    async def cleanup(self, batch_id: str):
+        """Delete the input, output and error files of a finished batch."""
+        pass
+
+
+class OpenAIBatchService(BatchService):
+    def __init__(self, client: openai.AsyncOpenAI, url: str = "/v1/chat/completions", completion_window: str = "24h"):
+        self.client = client
+        self.url = url
+        self.completion_window = completion_window
+
+    async def submit(self, path: str) -> str:
+        with open(path, "rb") as f:
+            input_file = await self.client.files.create(file=f, purpose="batch")
+
+        try:
+            batch = await self.client.batches.create(
+                input_file_id=input_file.id,
+                endpoint=self.url,  # type: ignore[arg-type]
+                completion_window=self.completion_window,  # type: ignore[arg-type]
+            )
+        except BaseException:
+            await self.delete_file(input_file.id)
+            raise
+        return batch.id
+
+    async def status(self, batch_id: str) -> str:
+        batch = await self.client.batches.retrieve(batch_id)
+        if batch.request_counts is not None:
+            counts = batch.request_counts
+            logging.info(
+                f"Batch {batch_id}: {batch.status} ({counts.completed} completed, {counts.failed} failed, "
+                f"{counts.total} total)"
+            )
+        return batch.status
+
+    async def results(self, batch_id: str) -> list[dict[str, Any]]:
+        batch = await self.client.batches.retrieve(batch_id)
+
+        results = []
+        for file_id in [batch.output_file_id, batch.error_file_id]:
+            if file_id is None:
+                continue
+            content = await self.client.files.content(file_id)
+            results += [json.loads(line) for line in content.text.splitlines() if line.strip()]
+        return results
+
+    async def delete_file(self, file_id: str):
+        try:
+            await self.client.files.delete(file_id)
+        except openai.APIError as e:
+            logging.warning(f"Failed to delete batch file {file_id}: {e}")
+
+    async def cleanup(self, batch_id: str):
+        try:
+            batch = await self.client.batches.retrieve(batch_id)
+        except openai.APIError as e:
+            logging.warning(f"Failed to retrieve batch {batch_id} to delete its files: {e}")
+            return
+
+        for file_id in [batch.input_file_id, batch.output_file_id, batch.error_file_id]:
+            if file_id is not None:
+                await self.delete_file(file_id)
+
+
+class LocalBatchService(BatchService):
+    """File-based stand-in for a batch service that answers every request with `respond`.
+
+    Input files are copied to `batch_dir` and answered immediately, and the results are written in the
+    same format as the OpenAI Batch API output files, so that batch runs can be tested offline.
+    """
+
+    def __init__(self, batch_dir: str, respond: Callable[[dict[str, Any]], str]):
+        self.batch_dir = batch_dir
+        self.respond = respond
+
+    async def submit(self, path: str) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        with open(path, "r", encoding="utf-8") as f:
+            requests = [json.loads(line) for line in f]
+
+        with open(os.path.join(self.batch_dir, f"{batch_id}.output.jsonl"), "w", encoding="utf-8") as f:
+            for request in requests:
+                body = {
+                    "object": "chat.completion",
+                    "model": request["body"]["model"],
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": self.respond(request["body"])},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                }
+                result = {
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "body": body},
+                    "error": None,
+                }
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+        return batch_id
+
+    async def status(self, batch_id: str) -> str:
+        return "completed"
+
+    async def results(self, batch_id: str) -> list[dict[str, Any]]:
+        with open(os.path.join(self.batch_dir, f"{batch_id}.output.jsonl"), "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    async def cleanup(self, batch_id: str):
+        path = os.path.join(self.batch_dir, f"{batch_id}.output.jsonl")
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class BatchClient(OpenAI):
+    """Sends requests through a batch service instead of one API call per request.
+
+    Each turn is submitted as one batch (split into chunks of `max_batch_size` requests). Requests that fail
+    or whose score cannot be extracted are retried as a smaller follow-up batch, up to `max_retries` times.
+    """
+
+    batch_service: BatchService
+    batch_dir: str
+    max_batch_size: int
+    poll_interval: float
+
+    def init_batch(self, batch_dir: str, max_batch_size: int, poll_interval: float):
+        self.batch_dir = hydra.utils.to_absolute_path(batch_dir)
+        os.makedirs(self.batch_dir, exist_ok=True)
+        self.max_batch_size = max_batch_size
+        self.poll_interval = poll_interval
+
+    def build_request(
+        self,
+        custom_id: str,
+        prompt: list[str],
+        response: list[str | None],
+        system_prompt: str | None = None,
+        sampling_params: MutableMapping | None = None,
+        prompt_prefix: str | None = None,
+    ) -> dict[str, Any]:
+        if sampling_params is None:
+            sampling_params = {}
+
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": self.batch_service.url,
+            "body": {
+                "model": self.model_name,
+                "messages": self.get_messages(prompt, response, system_prompt=system_prompt),
+                **self.get_prompt_cache_params(system_prompt, prompt_prefix),
+                **sampling_params,
+            },
+        }
+
+    async def run_batch(self, requests: list[dict[str, Any]]) -> dict[str, BatchOutput]:
+        path = os.path.join(self.batch_dir, f"{uuid.uuid4().hex}.input.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for request in requests:
+                f.write(json.dumps(request, ensure_ascii=False) + "\n")
+
+        batch_id = None
+        try:
+            batch_id = await self.batch_service.submit(path)
+            logging.info(f"Submitted batch {batch_id} with {len(requests)} requests")
+            return await self.collect_batch(batch_id, requests)
+        except Exception as e:
+            # 1つのバッチの失敗で他のバッチを中断しないよう、このバッチのリクエストのみエラーとする
+            logging.warning(f"Batch {batch_id} with {len(requests)} requests failed: {e}")
+            return {request["custom_id"]: (None, f"{type(e).__name__}: {e}", None) for request in requests}
+        finally:
+            # 結果を取得した後は、ローカルとバッチサービス上の入出力ファイルを削除する
+            os.remove(path)
+            if batch_id is not None:
+                await self.batch_service.cleanup(batch_id)
+
+    async def collect_batch(self, batch_id: str, requests: list[dict[str, Any]]) -> dict[str, BatchOutput]:
+        """Wait for a batch to finish and map each custom_id to (response text, error message, token usage)."""
+        status = await self.batch_service.status(batch_id)
+        while status not in TERMINAL_STATUSES:
+            await asyncio.sleep(self.poll_interval)
+            status = await self.batch_service.status(batch_id)
+
+        if status != "completed":
+            logging.warning(f"Batch {batch_id} finished with status: {status}")
+
+        outputs: dict[str, BatchOutput] = {
+            request["custom_id"]: (None, f"Batch {batch_id} finished with status: {status}", None)
+            for request in requests
+        }
+        for result in await self.batch_service.results(batch_id):
+            response = result.get("response")
+            if result.get("error") is not None:
+                outputs[result["custom_id"]] = (None, json.dumps(result["error"], ensure_ascii=False), None)
+            elif response is None or response["status_code"] != 200:
+                outputs[result["custom_id"]] = (None, json.dumps(response, ensure_ascii=False), None)
+            else:
+                usage = None
+                if response["body"].get("usage") is not None:
+                    usage = self.record_completion_usage(CompletionUsage.model_validate(response["body"]["usage"]))
+                outputs[result["custom_id"]] = (response["body"]["choices"][0]["message"]["content"], None, usage)
+        return outputs
+
+    def preflight_item(
+        self,
+        d: DatasetItem,
+        turn: int,
+        sent_prompts: list[str],
+        system_prompt: str | None,
+        sampling_params: MutableMapping,
+    ) -> str | None:
+        """Return the prompt of `turn` to send after `sent_prompts`, or None if the request does not fit."""
+        try:
+            prompt, tokens = self.preflight(
+                [*sent_prompts, d.prompt[turn]],
+                d.response[:turn],
+                system_prompt=system_prompt,
+                sampling_params=self.get_item_sampling_params(sampling_params, d),
+            )
+        except ContextLengthExceededError as e:
+            d.error_messages[turn].append(str(e))
+            return None
+
+        if prompt[-1] != d.prompt[turn]:
+            d.error_messages[turn].append(f"Prompt truncated to fit the context length ({tokens} tokens)")
+        return prompt[-1]
+
+    async def process_data(
+        self,
+        data: Iterable[T],
+        score_extractor: BaseScoreExtractor | None = None,
+        system_prompt: str | None = None,
+        sampling_params: MutableMapping | None = None,
+        callback: Callable[[T], Any] | None = None,
+        turn_callback: Callable[[T, int], Any] | None = None,
+        prompt_prefix: str | None = None,
+    ) -> Sequence[T]:
+        if sampling_params is None:
+            sampling_params = {}
+
+        # バッチはすべての項目をまとめて送信するため、遅延読み込みされた項目もここで読み込む
+        data = list(data)
+        for d in data:
+            d.response, d.pattern, d.error_messages, d.usage = [], [], [], []
+
+        # 送信したプロンプト。コンテキスト長に合わせて省略した場合も、項目のプロンプトは変更しない
+        sent_prompts: list[list[str]] = [[] for _ in data]
+        num_turns = max((len(d.prompt) for d in data), default=0)
+        for turn in range(num_turns):
+            pending = [i for i, d in enumerate(data) if turn < len(d.prompt)]
+            for i in pending:
+                data[i].response.append(None)
+                data[i].pattern.append(None)
+                data[i].error_messages.append([])
+                data[i].usage.append(None)
+
+            records = {i: self.start_request(data[i], turn) for i in pending}
+            fits = []
+            for i in pending:
+                prompt = self.preflight_item(data[i], turn, sent_prompts[i], system_prompt, sampling_params)
+                sent_prompts[i].append(prompt if prompt is not None else data[i].prompt[turn])
+                if prompt is not None:
+                    fits.append(i)
+                else:
+                    # コンテキスト長を超えるリクエストはバッチに含めない
+                    records[i].errors.append(ContextLengthExceededError.__name__)
+            pending = fits
+
+            keys: dict[int, str] = {}
+            cached: dict[int, str] = {}
+            if self.cache is not None:
+                for i in pending:
+                    keys[i] = self.cache.make_key(
+                        self.model_name,
+                        self.get_messages(sent_prompts[i], data[i].response[:turn], system_prompt=system_prompt),
+                        system_prompt=system_prompt,
+                        sampling_params=self.get_item_sampling_params(sampling_params, data[i]),
+                    )
+                    response = self.cache.get(keys[i])
+                    if response is not None:
+                        cached[i] = response
+
+            retry_count = 0
+            while len(pending) > 0 and retry_count <= self.max_retries:
+                logging.info(f"Running batch for turn {turn + 1} on {len(pending)} samples")
+                if retry_count > 0:
+                    for i in pending:
+                        self.emit_request_event("retry", records[i])
+                # キャッシュされた応答は最初の試行でのみ使用し、スコアを抽出できない場合は再生成する
+                outputs: dict[str, BatchOutput] = {str(i): (cached.pop(i), None, None) for i in pending if i in cached}
+                if self.cache is not None and self.cache.replay:
+                    # 再生モードではバッチを投入せず、キャッシュにないリクエストはエラーとする
+                    for i in pending:
+                        if str(i) not in outputs:
+                            data[i].error_messages[turn].append(f"Cache miss in replay mode: {keys[i]}")
+                            records[i].errors.append(CacheMissError.__name__)
+                    pending = [i for i in pending if str(i) in outputs]
+
+                requests = [
+                    self.build_request(
+                        str(i),
+                        sent_prompts[i],
+                        data[i].response[:turn],
+                        system_prompt=system_prompt,
+                        sampling_params=self.get_item_sampling_params(sampling_params, data[i]),
+                        prompt_prefix=prompt_prefix,
+                    )
+                    for i in pending
+                    if str(i) not in outputs
+                ]
+                chunks = [
+                    requests[start : start + self.max_batch_size]
+                    for start in range(0, len(requests), self.max_batch_size)
+                ]
+                started_at = time.monotonic()
+                for chunk_outputs in await asyncio.gather(*(self.run_batch(chunk) for chunk in chunks)):
+                    outputs.update(chunk_outputs)
+                # バッチ内の各リクエストの所要時間は分からないため、バッチ全体の所要時間を記録する
+                elapsed = time.monotonic() - started_at
+                submitted = {request["custom_id"] for request in requests}
+
+                failed = []
+                for i in pending:
+                    d = data[i]
+                    records[i].attempts += 1
+                    if str(i) in submitted:
+                        records[i].flight_seconds += elapsed
+                    text, error, usage = outputs[str(i)]
+                    if usage is not None:
+                        records[i].usage.update(usage)
+                    if error is not None:
+                        d.error_messages[turn].append(error)
+                        records[i].errors.append("BatchError")
+                        failed.append(i)
+                        continue
+
+                    d.response[turn] = text
+                    if self.cache is not None and str(i) in submitted and text is not None:
+                        self.cache.put(keys[i], text)
+                    if score_extractor is not None:
+                        try:
+                            assert text is not None
+                            d.pattern[turn] = score_extractor(text)
+                        except Exception as e:
+                            d.error_messages[turn].append(str(e))
+                            records[i].errors.append(type(e).__name__)
+                            failed.append(i)
+
+                pending = failed
+                retry_count += 1
+
+            for i, record in records.items():
+                self.complete_request(record, data[i], extract_score=score_extractor is not None)
+
+            if turn_callback is not None:
+                for d in data:
+                    if turn < len(d.prompt):
+                        turn_callback(d, turn)
+
+        if callback is not None:
+            for d in data:
+                callback(d)
+
+        return data
+
+
+class OpenAIBatch(BatchClient):
+    def __init__(
+        self,
+        model_name: str = "gpt-4o-2024-08-06",
+        batch_dir: str = "./batch",
+        max_batch_size: int = 50000,
+        poll_interval: float = 60.0,
+        completion_window: str = "24h",
+        **kwargs,
+    ):
+        OpenAI.__init__(self, model_name=model_name, **kwargs)
+        self.init_batch(batch_dir, max_batch_size, poll_interval)
+        self.batch_service = OpenAIBatchService(self.client, completion_window=completion_window)
+
+
+class AzureOpenAIBatch(BatchClient, AzureOpenAI):
+    def __init__(
+        self,
+        model_name: str = "gpt-4o-2024-08-06",
+        batch_dir: str = "./batch",
+        max_batch_size: int = 50000,
+        poll_interval: float = 60.0,
+        completion_window: str = "24h",
+        **kwargs,
+    ):
+        AzureOpenAI.__init__(self, model_name=model_name, **kwargs)
+        self.init_batch(batch_dir, max_batch_size, poll_interval)
+        self.batch_service = OpenAIBatchService(
+            self.client, url="/chat/completions", completion_window=completion_window
+        )
+
+
+class LocalBatch(BatchClient):
+    def __init__(
+        self,
+        model_name: str = "local",
+        batch_dir: str = "./batch",
+        max_batch_size: int = 50000,
+        poll_interval: float = 0.0,
+        response: str | None = None,
+        **kwargs,
+    ):
+        BaseClient.__init__(self, model_name=model_name, **kwargs)
+        self.init_batch(batch_dir, max_batch_size, poll_interval)
+
+        def respond(body: dict[str, Any]) -> str:
+            # 応答が指定されていない場合は、最後のユーザー入力をそのまま返す
+            if response is not None:
+                return response
+            return body["messages"][-1]["content"]
+
+        self.batch_service = LocalBatchService(self.batch_dir, respond)
+
+    async def aclose(self):
+        pass
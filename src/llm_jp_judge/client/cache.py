@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import Counter
+from collections.abc import MutableMapping
+from typing import Any
+
+import hydra
+
+from .scheduler import current_flow
+
+
+class CacheMissError(Exception):
+    pass
+
+
+class ResponseCache:
+    """On-disk response cache keyed by the hash of the request content.
+
+    Entries are stored in a SQLite database and evicted in least-recently-used order once the total size
+    of the cached responses exceeds `max_size_mb`. In `replay` mode, a cache miss raises `CacheMissError`
+    instead of sending the request.
+    """
+
+    def __init__(self, path: str, max_size_mb: float = 1024, mode: str = "read_write"):
+        if mode not in ["read_write", "replay"]:
+            raise ValueError(f"Invalid cache mode: {mode}")
+
+        self.path = hydra.utils.to_absolute_path(path)
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.mode = mode
+
+        self.hits = 0
+        self.misses = 0
+        # Hits and misses per flow (benchmark), as benchmarks may be evaluated concurrently
+        self.flow_hits: Counter[str | None] = Counter()
+        self.flow_misses: Counter[str | None] = Counter()
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self.conn.commit()
+
+        (self.size,) = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+
+    @property
+    def replay(self) -> bool:
+        return self.mode == "replay"
+
+    @staticmethod
+    def make_key(
+        model_name: str,
+        messages: Any,
+        system_prompt: str | None = None,
+        sampling_params: MutableMapping | None = None,
+        early_stop: bool = False,
+    ) -> str:
+        """Hash the request content into a cache key.
+
+        Responses of streamed requests stopped once the score was extracted (`early_stop`) are truncated, so they
+        are keyed apart from full responses to the same request.
+        """
+        request = {
+            "model_name": model_name,
+            "messages": messages,
+            "system_prompt": system_prompt,
+            "sampling_params": dict(sampling_params or {}),
+        }
+        if early_stop:
+            # 打ち切らない場合のキーは変えず、既存のキャッシュを引き続き使用できるようにする
+            request["early_stop"] = True
+        content = json.dumps(request, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            self.flow_misses[current_flow.get()] += 1
+            return None
+
+        self.hits += 1
+        self.flow_hits[current_flow.get()] += 1
+        self.conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        self.conn.commit()
+        return row[0]
+
+    def put(self, key: str, response: str):
+        size = len(response.encode("utf-8"))
+        row = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self.size -= row[0]
+
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (key, response, size, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, response, size, time.time()),
+        )
+        self.size += size
+        self.evict()
+        self.conn.commit()
+
+    def evict(self):
+        while self.size > self.max_size:
+            rows = self.conn.execute("SELECT key, size FROM responses ORDER BY accessed_at LIMIT 128").fetchall()
+            if len(rows) == 0:
+                self.size = 0
+                break
+
+            for key, size in rows:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.size -= size
+                if self.size <= self.max_size:
+                    break
+
+    def close(self):
+        self.conn.close()
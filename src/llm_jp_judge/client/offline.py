@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import sys
+import warnings
+from collections.abc import MutableMapping
+from typing import Any
+
+from .base import BaseClient
+from .batch import BatchClient, BatchOutput
+
+
+# OpenAI APIのパラメータのうち、vLLMの SamplingParams で名前が異なるもの
+SAMPLING_PARAM_ALIASES = {"max_completion_tokens": "max_tokens"}
+UNSUPPORTED_SAMPLING_PARAMS = ["reasoning_effort"]
+
+
+class VLLMEngine:
+    """Generates chat responses with an in-process `vllm.LLM` engine.
+
+    All the conversations of a call are submitted at once, and the engine schedules them with continuous
+    batching. Returns (response, prompt tokens, output tokens, prompt tokens read from the prefix cache) per
+    conversation.
+    """
+
+    def __init__(self, model: str, **engine_args):
+        try:
+            from vllm import LLM, SamplingParams
+        except ImportError as e:
+            raise ImportError("vllm is required to use the vllm client. Run `uv sync --extra vllm`.") from e
+
+        self.sampling_params_class = SamplingParams
+        self.llm = LLM(model=model, **{k: v for k, v in engine_args.items() if v is not None})
+
+    def chat(
+        self, messages: list[list[dict[str, Any]]], sampling_params: list[dict[str, Any]]
+    ) -> list[tuple[str, int, int, int]]:
+        params = [self.sampling_params_class(**p) for p in sampling_params]
+        outputs = self.llm.chat(messages, params, use_tqdm=True)  # type: ignore[arg-type]
+        return [
+            (
+                output.outputs[0].text,
+                len(output.prompt_token_ids or []),
+                len(output.outputs[0].token_ids),
+                output.num_cached_tokens or 0,
+            )
+            for output in outputs
+        ]
+
+
+class FakeEngine:
+    """Stand-in for `VLLMEngine` answering every conversation with `response`, to test without a GPU."""
+
+    def __init__(self, response: str | None = None):
+        self.response = response
+
+    def chat(
+        self, messages: list[list[dict[str, Any]]], sampling_params: list[dict[str, Any]]
+    ) -> list[tuple[str, int, int, int]]:
+        # 応答が指定されていない場合は、最後のユーザー入力をそのまま返す
+        return [(self.response if self.response is not None else m[-1]["content"], 0, 0, 0) for m in messages]
+
+
+class VLLM(BatchClient):
+    """Generates with an in-process vLLM engine instead of going through an OpenAI-compatible server.
+
+    Requests are handled as in `BatchClient`: each turn of all the items is generated in a single call to
+    the engine, and the items whose score cannot be extracted are generated again, up to `max_retries` times.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "llm-jp/llm-jp-3-1.8b-instruct",
+        max_retries: int = 1,
+        disable_system_prompt: bool = False,
+        max_batch_size: int | None = None,
+        fake: bool = False,
+        response: str | None = None,
+        engine_args: MutableMapping | None = None,
+        **kwargs,
+    ):
+        BaseClient.__init__(
+            self,
+            model_name=model_name,
+            max_retries=max_retries,
+            async_request_interval=0.0,
+            disable_system_prompt=disable_system_prompt,
+            **kwargs,
+        )
+        self.max_batch_size = max_batch_size or sys.maxsize
+        self.poll_interval = 0.0
+
+        self.engine: VLLMEngine | FakeEngine
+        if fake:
+            self.engine = FakeEngine(response)
+        else:
+            self.engine = VLLMEngine(model_name, **(engine_args or {}))
+        # エンジンはスレッドセーフではないため、同時に1つの呼び出しのみを実行する
+        self.engine_lock = asyncio.Lock()
+
+    def convert_sampling_params(self, sampling_params: MutableMapping) -> dict[str, Any]:
+        converted = {}
+        for key, value in sampling_params.items():
+            if key in UNSUPPORTED_SAMPLING_PARAMS:
+                warnings.warn(f"vLLM does not support {key} parameter. Ignoring.")
+                continue
+            converted[SAMPLING_PARAM_ALIASES.get(key, key)] = value
+        return converted
+
+    def build_request(
+        self,
+        custom_id: str,
+        prompt: list[str],
+        response: list[str | None],
+        system_prompt: str | None = None,
+        sampling_params: MutableMapping | None = None,
+        prompt_prefix: str | None = None,
+    ) -> dict[str, Any]:
+        if sampling_params is None:
+            sampling_params = {}
+
+        return {
+            "custom_id": custom_id,
+            "messages": self.get_messages(prompt, response, system_prompt=system_prompt),
+            "sampling_params": self.convert_sampling_params(sampling_params),
+        }
+
+    async def run_batch(self, requests: list[dict[str, Any]]) -> dict[str, BatchOutput]:
+        logging.info(f"Generating {len(requests)} requests with {self.model_name}")
+        async with self.engine_lock:
+            try:
+                # 生成中もイベントループを止めないよう、別スレッドで実行する (パイプライン実行時の評価など)
+                results = await asyncio.to_thread(
+                    self.engine.chat,
+                    [request["messages"] for request in requests],
+                    [request["sampling_params"] for request in requests],
+                )
+            except Exception as e:
+                logging.warning(f"vLLM generation failed: {e}")
+                return {request["custom_id"]: (None, str(e), None) for request in requests}
+
+        outputs: dict[str, BatchOutput] = {}
+        for request, (text, prompt_tokens, output_tokens, cached_tokens) in zip(requests, results):
+            usage = self.record_usage(prompt_tokens, output_tokens=output_tokens, cached_tokens=cached_tokens)
+            outputs[request["custom_id"]] = (text, None, usage)
+        return outputs
+
+    async def aclose(self):
+        pass
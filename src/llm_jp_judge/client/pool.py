@@ -0,0 +1,263 @@
+import logging
+import random
+import time
+from collections import Counter, defaultdict
+from collections.abc import Callable, Mapping, MutableMapping, Sequence
+from typing import Any
+
+import anthropic
+import openai
+
+from ..evaluator.base import BaseScoreExtractor
+from .base import BaseClient
+from .remote import AzureOpenAI, BedrockAnthropic, OpenAI
+from .scheduler import RateLimiter, parse_retry_after
+
+
+ENDPOINT_CLIENTS: dict[str, type[OpenAI]] = {
+    "openai": OpenAI,
+    "azure": AzureOpenAI,
+    "bedrock": BedrockAnthropic,
+}
+
+# Errors after which the request is sent to another endpoint
+FAILOVER_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,
+    anthropic.RateLimitError,
+    anthropic.InternalServerError,
+    anthropic.APIConnectionError,
+)
+
+
+class Endpoint:
+    """One backend of a `PooledClient` and its health statistics.
+
+    Latency and error rate are tracked as exponentially weighted moving averages. An endpoint that fails
+    `eject_threshold` times in a row with a 429, 5xx or connection error is ejected from routing for a
+    while, and the ejection time doubles every time it is ejected again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        client: OpenAI,
+        weight: float = 1.0,
+        eject_threshold: int = 3,
+        eject_seconds: float = 30.0,
+        max_eject_seconds: float = 300.0,
+        alpha: float = 0.2,
+    ):
+        if weight <= 0:
+            raise ValueError(f"weight must be positive: {weight}")
+
+        self.name = name
+        self.client = client
+        self.weight = weight
+        self.eject_threshold = eject_threshold
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self.alpha = alpha
+
+        self.latency: float | None = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+        self.requests = 0
+        self.failures = 0
+
+    def is_available(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+    def score(self, default_latency: float) -> float:
+        latency = self.latency if self.latency is not None else default_latency
+        return self.weight * max(1.0 - self.error_rate, 0.01) / max(latency, 1e-3)
+
+    def record_success(self, latency: float):
+        self.requests += 1
+        self.latency = latency if self.latency is None else (1 - self.alpha) * self.latency + self.alpha * latency
+        self.error_rate = (1 - self.alpha) * self.error_rate
+        self.consecutive_failures = 0
+        self.ejections = 0
+
+    def record_failure(self, headers: Mapping[str, str] | None = None):
+        self.requests += 1
+        self.failures += 1
+        self.error_rate = (1 - self.alpha) * self.error_rate + self.alpha
+        self.consecutive_failures += 1
+        if self.consecutive_failures < self.eject_threshold:
+            return
+
+        eject_seconds = min(self.eject_seconds * 2**self.ejections, self.max_eject_seconds)
+        retry_after = parse_retry_after(headers) if headers is not None else None
+        if retry_after is not None:
+            eject_seconds = max(eject_seconds, retry_after)
+
+        self.ejected_until = time.monotonic() + eject_seconds
+        self.ejections += 1
+        self.consecutive_failures = 0
+        logging.warning(f"Ejecting endpoint {self.name} for {eject_seconds:.1f} seconds")
+
+
+class PooledClient(OpenAI):
+    """Client that spreads requests over several endpoints (replicas, regions or API keys).
+
+    Each endpoint is a regular client with its own concurrency and rate limits. Requests are routed to
+    the available endpoints at random, in proportion to `weight / latency` scaled down by the recent error
+    rate, preferring endpoints with a free concurrency slot. A request that fails with a 429, 5xx or
+    connection error is retried on another endpoint before the error is returned to the caller.
+    """
+
+    def __init__(
+        self,
+        endpoints: Sequence[MutableMapping],
+        model_name: str = "gpt-4o-2024-08-06",
+        max_retries: int = 1,
+        async_request_interval: float = 1.0,
+        disable_system_prompt: bool = False,
+        max_concurrency: int | None = None,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        eject_threshold: int = 3,
+        eject_seconds: float = 30.0,
+        adaptive_concurrency: MutableMapping | None = None,
+        **kwargs,
+    ):
+        BaseClient.__init__(
+            self,
+            model_name=model_name,
+            max_retries=max_retries,
+            async_request_interval=async_request_interval,
+            disable_system_prompt=disable_system_prompt,
+            **kwargs,
+        )
+        # レート制限は各エンドポイントで行い、プール全体には明示的に指定された上限のみを適用する
+        self.rate_limiter = RateLimiter(
+            max_concurrency=max_concurrency,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+        )
+
+        if len(endpoints) == 0:
+            raise ValueError("At least one endpoint is required")
+
+        self.endpoints: list[Endpoint] = []
+        for endpoint_cfg in endpoints:
+            endpoint_cfg = dict(endpoint_cfg)
+            name = endpoint_cfg.pop("name", "openai")
+            weight = endpoint_cfg.pop("weight", 1.0)
+            if name not in ENDPOINT_CLIENTS:
+                raise ValueError(f"Invalid endpoint client name: {name}")
+
+            endpoint_cfg.setdefault("model_name", model_name)
+            endpoint_cfg.setdefault("async_request_interval", async_request_interval)
+            endpoint_cfg.setdefault("disable_system_prompt", disable_system_prompt)
+            # 同時実行数の自動調整はエンドポイントごとに行う
+            endpoint_cfg.setdefault("adaptive_concurrency", adaptive_concurrency)
+            endpoint_cfg.setdefault("stream", self.stream)
+            endpoint_cfg.setdefault("prompt_cache", self.prompt_cache)
+            client = ENDPOINT_CLIENTS[name](**endpoint_cfg)
+
+            location = (
+                endpoint_cfg.get("base_url") or endpoint_cfg.get("azure_endpoint") or endpoint_cfg.get("aws_region")
+            )
+            self.endpoints.append(
+                Endpoint(
+                    f"{client.model_name}@{location or name}",
+                    client,
+                    weight=weight,
+                    eject_threshold=eject_threshold,
+                    eject_seconds=eject_seconds,
+                )
+            )
+
+    def get_concurrency_history(self) -> dict[str, list[tuple[float, int]]]:
+        history = {}
+        for endpoint in self.endpoints:
+            if endpoint.client.rate_limiter.adaptive is not None:
+                history[endpoint.name] = endpoint.client.rate_limiter.adaptive.history
+        return history
+
+    def get_usage(self) -> dict[str | None, Counter[str]]:
+        usage: defaultdict[str | None, Counter[str]] = defaultdict(Counter)
+        for endpoint in self.endpoints:
+            for flow, counter in endpoint.client.get_usage().items():
+                usage[flow].update(counter)
+        return dict(usage)
+
+    async def aclose(self):
+        for endpoint in self.endpoints:
+            await endpoint.client.aclose()
+
+        for endpoint in self.endpoints:
+            logging.info(
+                f"Endpoint {endpoint.name}: {endpoint.requests} requests, {endpoint.failures} failures, "
+                f"latency {endpoint.latency or 0.0:.2f}s"
+            )
+
+    def select_endpoint(self, exclude: Sequence[Endpoint] = ()) -> Endpoint:
+        candidates = [e for e in self.endpoints if e not in exclude] or list(self.endpoints)
+
+        available = [e for e in candidates if e.is_available()]
+        if len(available) == 0:
+            # すべてのエンドポイントが除外されている場合は、最も早く復帰するものを試す
+            return min(candidates, key=lambda e: e.ejected_until)
+
+        idle = [e for e in available if e.client.rate_limiter.has_capacity()]
+        if len(idle) > 0:
+            available = idle
+
+        latencies = [e.latency for e in available if e.latency is not None]
+        default_latency = min(latencies) if len(latencies) > 0 else 1.0
+        return random.choices(available, weights=[e.score(default_latency) for e in available])[0]
+
+    async def async_request(
+        self,
+        prompt: list[str],
+        response: list[str | None],
+        system_prompt: str | None = None,
+        sampling_params: MutableMapping | None = None,
+        score_extractor: BaseScoreExtractor | None = None,
+        on_first_token: Callable[[float], Any] | None = None,
+        prompt_prefix: str | None = None,
+    ) -> str | None:
+        if sampling_params is None:
+            sampling_params = {}
+
+        tokens = self.count_tokens(prompt, response, system_prompt=system_prompt, sampling_params=sampling_params)
+
+        tried: list[Endpoint] = []
+        while True:
+            endpoint = self.select_endpoint(exclude=tried)
+
+            async with endpoint.client.rate_limiter.slot(tokens):
+                # 空きを待つ間に除外されたエンドポイントには送信せず、他のエンドポイントを選び直す
+                if not endpoint.is_available() and any(
+                    e.is_available() for e in self.endpoints if e is not endpoint and e not in tried
+                ):
+                    continue
+
+                tried.append(endpoint)
+                start = time.monotonic()
+                try:
+                    result = await endpoint.client.async_request(
+                        prompt,
+                        response,
+                        system_prompt=system_prompt,
+                        sampling_params=sampling_params,
+                        score_extractor=score_extractor,
+                        on_first_token=on_first_token,
+                        prompt_prefix=prompt_prefix,
+                    )
+                except FAILOVER_ERRORS as e:
+                    endpoint.record_failure(getattr(getattr(e, "response", None), "headers", None))
+                    if len(tried) >= len(self.endpoints):
+                        raise
+                    logging.warning(f"Endpoint {endpoint.name} failed ({type(e).__name__}). Failing over.")
+                    continue
+
+                endpoint.record_success(time.monotonic() - start)
+                return result
@@ -1,30 +1,93 @@
 import asyncio
+import hashlib
 import logging
+import time
 import warnings
-from collections.abc import MutableMapping, Sequence
+from collections import Counter
+from collections.abc import Callable, Iterable, Mapping, MutableMapping, Sequence, Sized
 from copy import deepcopy
-from typing import TypeVar, cast
+from typing import Any, TypeVar, cast
 
+import anthropic
+import httpx
 import openai
 import tqdm
-import tqdm.asyncio
-from anthropic import AnthropicBedrock as AnthropicBedrockClient
-from anthropic.types import Message, MessageParam, TextBlock
+from anthropic import AsyncAnthropicBedrock as AnthropicBedrockClient
+from anthropic.types import Message, MessageParam, TextBlock, TextBlockParam, Usage
 from dotenv import load_dotenv
-from openai import AzureOpenAI as AzureOpenAIClient
-from openai import OpenAI as OpenAIClient
+from openai import AsyncAzureOpenAI as AzureOpenAIClient
+from openai import AsyncOpenAI as OpenAIClient
+from openai.types import CompletionUsage
 
 from ..dataset import DatasetItem
 from ..evaluator.base import BaseScoreExtractor
 from .base import BaseClient
+from .cache import CacheMissError
+from .scheduler import backoff_delay, current_flow, parse_retry_after
+from .telemetry import current_request
+from .tokenizer import ContextLengthExceededError
 
 
 T = TypeVar("T", bound=DatasetItem)
 
+RATE_LIMIT_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    anthropic.RateLimitError,
+    anthropic.APITimeoutError,
+)
+SERVER_ERRORS = (
+    openai.InternalServerError,
+    openai.APIConnectionError,
+    anthropic.InternalServerError,
+    anthropic.APIConnectionError,
+)
+BAD_REQUEST_ERRORS = (openai.BadRequestError, anthropic.BadRequestError)
+
 
 load_dotenv(override=True)
 
 
+class StreamCollector:
+    """Accumulates a streamed response and tells when the rest of it can be skipped.
+
+    When a score extractor is given, the stream is stopped once the extractor returns the same result for
+    two consecutive chunks, so that a score still being written (e.g. the `1` of `10`) is not taken early.
+    The time from the request to the first token is passed to `on_first_token`.
+    """
+
+    def __init__(
+        self,
+        score_extractor: BaseScoreExtractor | None = None,
+        on_first_token: Callable[[float], Any] | None = None,
+    ):
+        self.score_extractor = score_extractor
+        self.on_first_token = on_first_token
+        self.started_at = time.monotonic()
+        self.text: str | None = None
+        self.pattern: Any = None
+
+    def add(self, delta: str | None) -> bool:
+        if not delta:
+            return False
+
+        if self.text is None:
+            self.text = ""
+            if self.on_first_token is not None:
+                self.on_first_token(time.monotonic() - self.started_at)
+        self.text += delta
+
+        if self.score_extractor is None:
+            return False
+
+        previous, self.pattern = self.pattern, None
+        try:
+            self.pattern = self.score_extractor(self.text)
+        except Exception:
+            return False
+        return previous is not None and self.pattern == previous
+
+
 class OpenAI(BaseClient):
     def __init__(
         self,
@@ -36,19 +99,53 @@ class OpenAI(BaseClient):
         organization: str | None = None,
         project: str | None = None,
         base_url: str | None = None,
+        **kwargs,
     ):
-        self.model_name = model_name
-        self.max_retries = max_retries
-        self.async_request_interval = async_request_interval
-        self.disable_system_prompt = disable_system_prompt
+        super().__init__(
+            model_name=model_name,
+            max_retries=max_retries,
+            async_request_interval=async_request_interval,
+            disable_system_prompt=disable_system_prompt,
+            **kwargs,
+        )
 
         self.client = OpenAIClient(
             api_key=api_key,
             organization=organization,
             project=project,
             base_url=base_url,
+            # 再試行はスケジューラが Retry-After などに従って行うため、SDKでは再試行しない
+            max_retries=0,
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=self.get_http_limits(), event_hooks={"response": [self.on_http_response]}
+            ),
         )
 
+    def get_http_limits(self) -> httpx.Limits:
+        # 同時実行数と同じ数の接続をプールし、リクエスト間で使い回す
+        max_connections = self.rate_limiter.max_concurrency
+        return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+    async def on_http_response(self, response: httpx.Response):
+        # レート制限のヘッダーを読み取り、上限に達する前にリクエストの送信を遅らせる
+        self.rate_limiter.update(response.headers)
+        if response.status_code == 429:
+            self.rate_limiter.record_rate_limit()
+            retry_after = parse_retry_after(response.headers)
+            if retry_after is not None:
+                self.rate_limiter.pause(retry_after)
+
+    def get_retry_delay(self, error: Exception, attempt: int) -> float:
+        headers: Mapping[str, str] = {}
+        if isinstance(error, (openai.APIStatusError, anthropic.APIStatusError)):
+            headers = error.response.headers
+        return backoff_delay(
+            attempt, retry_after=parse_retry_after(headers), base=max(self.async_request_interval, 1.0)
+        )
+
+    async def aclose(self):
+        await self.client.close()
+
     def get_messages(
         self,
         prompt: list[str],
@@ -71,96 +168,319 @@ class OpenAI(BaseClient):
 
         return messages
 
+    def get_prompt_cache_params(self, system_prompt: str | None = None, prompt_prefix: str | None = None) -> dict:
+        if not self.prompt_cache or (system_prompt is None and not prompt_prefix):
+            return {}
+
+        # 共通部分(システムプロンプトと評価基準)が同じリクエストを同じキャッシュに振り分ける
+        digest = hashlib.sha256(f"{system_prompt}\n{prompt_prefix}".encode()).hexdigest()[:16]
+        return {"prompt_cache_key": f"llm-jp-judge-{digest}"}
+
+    def record_completion_usage(self, usage: CompletionUsage | None) -> Counter[str] | None:
+        if usage is None:
+            return None
+
+        details = usage.prompt_tokens_details
+        cached_tokens = details.cached_tokens if details is not None else None
+        completion_details = usage.completion_tokens_details
+        reasoning_tokens = completion_details.reasoning_tokens if completion_details is not None else None
+        return self.record_usage(
+            usage.prompt_tokens,
+            output_tokens=usage.completion_tokens,
+            reasoning_tokens=reasoning_tokens or 0,
+            cached_tokens=cached_tokens or 0,
+        )
+
     async def async_request(
         self,
         prompt: list[str],
         response: list[str | None],
         system_prompt: str | None = None,
         sampling_params: MutableMapping | None = None,
+        score_extractor: BaseScoreExtractor | None = None,
+        on_first_token: Callable[[float], Any] | None = None,
+        prompt_prefix: str | None = None,
     ) -> str | None:
         if sampling_params is None:
             sampling_params = {}
 
-        messages = await asyncio.to_thread(self.get_messages, prompt, response, system_prompt=system_prompt)
+        messages = self.get_messages(prompt, response, system_prompt=system_prompt)
+        sampling_params = {**self.get_prompt_cache_params(system_prompt, prompt_prefix), **sampling_params}
 
-        client_response = await asyncio.to_thread(
-            self.client.chat.completions.create,  # type: ignore[arg-type]
+        if not self.stream:
+            client_response = await self.client.chat.completions.create(
+                model=self.model_name,
+                messages=messages,  # type: ignore[arg-type]
+                **sampling_params,
+            )
+            self.record_completion_usage(client_response.usage)
+            return client_response.choices[0].message.content
+
+        sampling_params["stream_options"] = {"include_usage": True}
+
+        collector = StreamCollector(score_extractor, on_first_token)
+        stream = await self.client.chat.completions.create(
             model=self.model_name,
-            messages=messages,
+            messages=messages,  # type: ignore[arg-type]
+            stream=True,
             **sampling_params,
         )
-        return client_response.choices[0].message.content
+        assert isinstance(stream, openai.AsyncStream)
+        usage: Counter[str] | None = None
+        # ストリームを途中で閉じると接続が切断され、以降のトークンは生成されない
+        async with stream:
+            async for chunk in stream:
+                usage = self.record_completion_usage(chunk.usage) or usage
+                if len(chunk.choices) > 0 and collector.add(chunk.choices[0].delta.content):
+                    break
+
+        if usage is None:
+            # 使用量は最後のチャンクで返されるため、途中で打ち切った場合は受信したトークンから推定する
+            self.record_usage(
+                self.count_tokens(prompt, response, system_prompt=system_prompt),
+                output_tokens=self.token_counter.count(collector.text or ""),
+                estimated=True,
+            )
+        return collector.text
+
+    async def _send_request(
+        self,
+        prompt: list[str],
+        response: list[str | None],
+        system_prompt: str | None = None,
+        sampling_params: MutableMapping | None = None,
+        refresh: bool = False,
+        score_extractor: BaseScoreExtractor | None = None,
+        on_first_token: Callable[[float], Any] | None = None,
+        prompt_prefix: str | None = None,
+        tokens: int | None = None,
+    ) -> str | None:
+        if sampling_params is None:
+            sampling_params = {}
+
+        if tokens is None:
+            tokens = self.count_tokens(prompt, response, system_prompt=system_prompt, sampling_params=sampling_params)
+        if self.cache is None:
+            async with self.rate_limiter.slot(tokens):
+                return await self.async_request(
+                    prompt,
+                    response,
+                    system_prompt=system_prompt,
+                    sampling_params=sampling_params,
+                    score_extractor=score_extractor,
+                    on_first_token=on_first_token,
+                    prompt_prefix=prompt_prefix,
+                )
+
+        key = self.cache.make_key(
+            self.model_name,
+            self.get_messages(prompt, response, system_prompt=system_prompt),
+            system_prompt=system_prompt,
+            sampling_params=sampling_params,
+            early_stop=self.stream and score_extractor is not None,
+        )
+        if not refresh:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+            # 同一のリクエストが処理中であれば、その結果を待つ
+            if key in self._pending_requests:
+                return await asyncio.shield(self._pending_requests[key])
+
+        if self.cache.replay:
+            raise CacheMissError(f"Cache miss in replay mode: {key}")
+
+        future: asyncio.Future[str | None] = asyncio.get_running_loop().create_future()
+        self._pending_requests[key] = future
+        try:
+            async with self.rate_limiter.slot(tokens):
+                result = await self.async_request(
+                    prompt,
+                    response,
+                    system_prompt=system_prompt,
+                    sampling_params=sampling_params,
+                    score_extractor=score_extractor,
+                    on_first_token=on_first_token,
+                    prompt_prefix=prompt_prefix,
+                )
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark the exception as retrieved when there are no waiters
+            raise
+        else:
+            if result is not None:
+                self.cache.put(key, result)
+            future.set_result(result)
+            return result
+        finally:
+            if self._pending_requests.get(key) is future:
+                del self._pending_requests[key]
 
     async def process_data(
         self,
-        data: Sequence[T],
+        data: Iterable[T],
         score_extractor: BaseScoreExtractor | None = None,
         system_prompt: str | None = None,
         sampling_params: MutableMapping | None = None,
+        callback: Callable[[T], Any] | None = None,
+        turn_callback: Callable[[T, int], Any] | None = None,
+        prompt_prefix: str | None = None,
     ) -> Sequence[T]:
         if sampling_params is None:
             sampling_params = {}
 
-        tasks = []
-        wait = 0.0
-        for d in data:
-            tasks.append(
-                self._process_single_request(
-                    d,
-                    score_extractor,
-                    system_prompt,
-                    wait=wait,
-                    sampling_params=sampling_params,
+        # 1件ずつ送信される場合 (パイプライン実行時など) は進捗を表示しない
+        total = len(data) if isinstance(data, Sized) else None
+        progress = tqdm.tqdm(
+            total=total, desc=current_flow.get() or self.model_name, disable=total is not None and total <= 1
+        )
+
+        # 項目を読み込みながら送信し、未完了のリクエストが同時実行数の数倍に達したら読み込みを待つ
+        max_pending = 4 * self.rate_limiter.max_concurrency if self.rate_limiter.max_concurrency else None
+        items: list[T] = []
+        pending: set[asyncio.Future[T]] = set()
+
+        async def wait_for_completion():
+            nonlocal pending
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+            progress.update(len(done))
+
+        try:
+            for d in data:
+                if max_pending is not None and len(pending) >= max_pending:
+                    await wait_for_completion()
+
+                items.append(d)
+                pending.add(
+                    asyncio.ensure_future(
+                        self._process_single_request(
+                            d,
+                            score_extractor,
+                            system_prompt,
+                            sampling_params=sampling_params,
+                            callback=callback,
+                            turn_callback=turn_callback,
+                            prompt_prefix=prompt_prefix,
+                        )
+                    )
                 )
-            )
-            wait += self.async_request_interval * len(d.prompt)
+                # 残りの項目を読み込む前に、追加したリクエストを送信する
+                await asyncio.sleep(0)
 
-        data = await tqdm.asyncio.tqdm.gather(*tasks, desc=self.model_name)
+            while len(pending) > 0:
+                await wait_for_completion()
+        except BaseException:
+            for task in pending:
+                task.cancel()
+            raise
+        finally:
+            progress.close()
 
-        return data
+        return items
 
     async def _process_single_request(
         self,
         d: T,
         score_extractor: BaseScoreExtractor | None,
         system_prompt: str | None,
-        wait: float,
         sampling_params: MutableMapping | None = None,
+        callback: Callable[[T], Any] | None = None,
+        turn_callback: Callable[[T, int], Any] | None = None,
+        prompt_prefix: str | None = None,
     ) -> T:
         if sampling_params is None:
             sampling_params = {}
+        sampling_params = self.get_item_sampling_params(sampling_params, d)
 
-        await asyncio.sleep(wait)
+        d.response, d.pattern, d.error_messages, d.time_to_first_token, d.usage = [], [], [], [], []
 
-        d.response, d.pattern, d.error_messages = [], [], []
+        def record_first_token(latency: float):
+            d.time_to_first_token[-1] = latency
+
+        # 送信したプロンプト。コンテキスト長に合わせて省略した場合も、項目のプロンプトは変更しない
+        sent_prompts: list[str] = []
         for turn in range(len(d.prompt)):
             retry_count = 0
+            rate_limit_count = 0
             sleep = 0.0
+            refresh = False
 
             d.response.append(None)
             d.pattern.append(None)
             d.error_messages.append([])
-            while retry_count <= self.max_retries:
-                if len(d.error_messages[-1]) > 0:
-                    logging.warning(f"{d.error_messages[-1][-1]}. Retrying in {sleep} seconds.")
+            d.time_to_first_token.append(None)
+            d.usage.append(None)
+
+            record = self.start_request(d, turn)
+            # レート制限の空き待ち時間をこのリクエストに記録する
+            token = current_request.set(record)
+
+            prompt: list[str] | None = None
+            try:
+                prompt, tokens = self.preflight(
+                    [*sent_prompts, d.prompt[turn]],
+                    d.response[:turn],
+                    system_prompt=system_prompt,
+                    sampling_params=sampling_params,
+                )
+                if prompt[-1] != d.prompt[turn]:
+                    d.error_messages[-1].append(f"Prompt truncated to fit the context length ({tokens} tokens)")
+            except ContextLengthExceededError as e:
+                # コンテキスト長を超えるリクエストは送信しても失敗するため、送信せずにエラーとする
+                d.error_messages[-1].append(str(e))
+                record.errors.append(type(e).__name__)
+            sent_prompts.append(prompt[-1] if prompt is not None else d.prompt[turn])
+
+            while prompt is not None and retry_count <= self.max_retries:
+                if record.attempts > 0:
+                    logging.warning(f"{d.error_messages[-1][-1]}. Retrying in {sleep:.1f} seconds.")
+                    record.sleep_seconds += sleep
+                    self.emit_request_event("retry", record)
                 await asyncio.sleep(sleep)
 
                 try:
-                    d.response[-1] = await self.async_request(
-                        d.prompt[: turn + 1],
-                        d.response[:turn],
-                        system_prompt=system_prompt,
-                        sampling_params=sampling_params,
-                    )
-                except (openai.RateLimitError, openai.APITimeoutError) as e:
+                    with record.attempt():
+                        d.response[-1] = await self._send_request(
+                            prompt,
+                            d.response[:turn],
+                            system_prompt=system_prompt,
+                            sampling_params=sampling_params,
+                            refresh=refresh,
+                            score_extractor=score_extractor,
+                            on_first_token=record_first_token,
+                            prompt_prefix=prompt_prefix,
+                            tokens=tokens,
+                        )
+                except CacheMissError as e:
+                    d.error_messages[-1].append(str(e))
+                    record.errors.append(type(e).__name__)
+                    break
+                except RATE_LIMIT_ERRORS as e:
+                    d.error_messages[-1].append(str(e))
+                    record.errors.append(type(e).__name__)
+                    sleep = self.get_retry_delay(e, rate_limit_count)
+                    rate_limit_count += 1
+                except SERVER_ERRORS as e:
+                    # SDKでは再試行しないため、5xx や接続エラーもバックオフして再試行する
                     d.error_messages[-1].append(str(e))
-                    sleep = 60
-                except openai.BadRequestError as e:
+                    record.errors.append(type(e).__name__)
+                    retry_count += 1
+                    sleep = self.get_retry_delay(e, rate_limit_count)
+                    rate_limit_count += 1
+                except BAD_REQUEST_ERRORS as e:
                     d.error_messages[-1].append(str(e))
+                    record.errors.append(type(e).__name__)
+                    if getattr(e, "code", None) == "context_length_exceeded":
+                        break
 
                     retry_count += 1
                     sleep = self.async_request_interval
-                    await asyncio.sleep(self.async_request_interval)
                 else:
                     if score_extractor is not None:
                         try:
@@ -168,13 +488,22 @@ class OpenAI(BaseClient):
                             d.pattern[-1] = score_extractor(d.response[-1])
                         except Exception as e:
                             d.error_messages[-1].append(str(e))
+                            record.errors.append(type(e).__name__)
                             retry_count += 1
                             sleep = self.async_request_interval
+                            # キャッシュされた応答からスコアを抽出できない場合は、再生成する
+                            refresh = True
                             continue
                     break
 
-            if turn < len(d.prompt) - 1:
-                await asyncio.sleep(self.async_request_interval)
+            current_request.reset(token)
+            self.complete_request(record, d, extract_score=score_extractor is not None)
+
+            if turn_callback is not None:
+                turn_callback(d, turn)
+
+        if callback is not None:
+            callback(d)
 
         return d
 
@@ -190,12 +519,23 @@ class OpenAI(BaseClient):
                 del sampling_params["top_p"]
         return sampling_params
 
-    def __call__(
+    def get_item_sampling_params(self, sampling_params: MutableMapping, d: DatasetItem) -> MutableMapping:
+        if d.sampling_params is None:
+            return sampling_params
+
+        # 項目ごとのサンプリングパラメータで上書きする (null を指定した場合はパラメータを指定しない)
+        item_sampling_params = self.update_sampling_params(dict(d.sampling_params))
+        return self.fill_sampling_params({**sampling_params, **item_sampling_params})
+
+    async def acall(
         self,
-        data: Sequence[T],
+        data: Iterable[T],
         score_extractor: BaseScoreExtractor | None = None,
         system_prompt: str | None = None,
         sampling_params: MutableMapping | None = None,
+        callback: Callable[[T], Any] | None = None,
+        turn_callback: Callable[[T, int], Any] | None = None,
+        prompt_prefix: str | None = None,
     ) -> Sequence[T]:
         if sampling_params is None:
             sampling_params = {}
@@ -203,7 +543,15 @@ class OpenAI(BaseClient):
         sampling_params = self.fill_sampling_params(sampling_params)
         sampling_params = self.update_sampling_params(sampling_params)
 
-        return asyncio.run(self.process_data(data, score_extractor, system_prompt, sampling_params=sampling_params))
+        return await self.process_data(
+            data,
+            score_extractor,
+            system_prompt,
+            sampling_params=sampling_params,
+            callback=callback,
+            turn_callback=turn_callback,
+            prompt_prefix=prompt_prefix,
+        )
 
 
 class AzureOpenAI(OpenAI):
@@ -216,16 +564,25 @@ class AzureOpenAI(OpenAI):
         azure_endpoint: str | None = None,
         api_version: str | None = None,
         api_key: str | None = None,
+        **kwargs,
     ):
-        self.model_name = model_name
-        self.max_retries = max_retries
-        self.async_request_interval = async_request_interval
-        self.disable_system_prompt = disable_system_prompt
+        BaseClient.__init__(
+            self,
+            model_name=model_name,
+            max_retries=max_retries,
+            async_request_interval=async_request_interval,
+            disable_system_prompt=disable_system_prompt,
+            **kwargs,
+        )
 
         self.client = AzureOpenAIClient(
             azure_endpoint=azure_endpoint,  # type: ignore[arg-type]
             api_version=api_version,
             api_key=api_key,
+            max_retries=0,
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=self.get_http_limits(), event_hooks={"response": [self.on_http_response]}
+            ),
         )
 
 
@@ -239,29 +596,44 @@ class BedrockAnthropic(AzureOpenAI):
         aws_access_key: str | None = None,
         aws_secret_key: str | None = None,
         aws_region: str | None = None,
+        **kwargs,
     ):
-        self.model_name = model_name
-        self.max_retries = max_retries
-        self.async_request_interval = async_request_interval
-        self.disable_system_prompt = disable_system_prompt
+        BaseClient.__init__(
+            self,
+            model_name=model_name,
+            max_retries=max_retries,
+            async_request_interval=async_request_interval,
+            disable_system_prompt=disable_system_prompt,
+            **kwargs,
+        )
 
         self.anthropic_client = AnthropicBedrockClient(
             aws_access_key=aws_access_key,
             aws_secret_key=aws_secret_key,
             aws_region=aws_region,
+            max_retries=0,
+            http_client=anthropic.DefaultAsyncHttpxClient(
+                limits=self.get_http_limits(), event_hooks={"response": [self.on_http_response]}
+            ),
         )
 
+    async def aclose(self):
+        await self.anthropic_client.close()
+
     async def async_request(
         self,
         prompt: list[str],
         response: list[str | None],
         system_prompt: str | None = None,
         sampling_params: MutableMapping | None = None,
-    ) -> str:
+        score_extractor: BaseScoreExtractor | None = None,
+        on_first_token: Callable[[float], Any] | None = None,
+        prompt_prefix: str | None = None,
+    ) -> str | None:
         if sampling_params is None:
             sampling_params = {}
 
-        messages = await asyncio.to_thread(self.get_messages, prompt, response)
+        messages = cast(list[MessageParam], self.get_messages(prompt, response))
 
         sampling_params = dict(sampling_params)
         # Ignore unsupported parameters
@@ -270,20 +642,79 @@ class BedrockAnthropic(AzureOpenAI):
                 warnings.warn(f"BedrockAnthropic does not support {key} parameter. Ignoring.")
                 sampling_params.pop(key)
 
-        completions: Message
-        if system_prompt is not None:
-            completions = self.anthropic_client.messages.create(
-                model=self.model_name,
-                messages=cast(list[MessageParam], messages),
-                system=system_prompt,
-                **sampling_params,
-            )
-        else:
-            completions = self.anthropic_client.messages.create(
+        if self.prompt_cache:
+            system, messages = self.add_cache_control(system_prompt, messages, prompt_prefix)
+            if system is not None:
+                sampling_params["system"] = system
+        elif system_prompt is not None:
+            sampling_params["system"] = system_prompt
+
+        if self.stream:
+            collector = StreamCollector(score_extractor, on_first_token)
+            async with self.anthropic_client.messages.stream(
                 model=self.model_name,
-                messages=cast(list[MessageParam], messages),
+                messages=messages,
                 **sampling_params,
-            )
+            ) as stream:
+                stopped = False
+                async for text in stream.text_stream:
+                    if collector.add(text):
+                        stopped = True
+                        break
+                usage = stream.current_message_snapshot.usage
+                if stopped:
+                    # 出力トークン数は最後のイベントで返されるため、途中で打ち切った場合は受信したテキストから推定する
+                    usage = usage.model_copy(update={"output_tokens": self.token_counter.count(collector.text or "")})
+                self.record_message_usage(usage, estimated=stopped)
+            return collector.text
+
+        completions: Message = await self.anthropic_client.messages.create(
+            model=self.model_name,
+            messages=messages,
+            **sampling_params,
+        )
+        self.record_message_usage(completions.usage)
 
         assert isinstance(completions.content[0], TextBlock)
         return completions.content[0].text
+
+    def add_cache_control(
+        self, system_prompt: str | None, messages: list[MessageParam], prompt_prefix: str | None = None
+    ) -> tuple[list[TextBlockParam] | None, list[MessageParam]]:
+        """Mark the system prompt and the static prefix of the first user message as cacheable.
+
+        The first user message is split into two text blocks at the end of `prompt_prefix`, so that only the
+        prefix shared by all the judge prompts (e.g. the rubric) is cached. Prefixes shorter than the minimum
+        cacheable length of the model are ignored by the API.
+        """
+        system: list[TextBlockParam] | None = None
+        if system_prompt is not None:
+            system = [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+
+        content = messages[0]["content"]
+        if prompt_prefix and isinstance(content, str) and content.startswith(prompt_prefix):
+            suffix = content[len(prompt_prefix) :]
+            # 空白のみのテキストブロックは受け付けられないため、分割できない場合はそのまま送信する
+            if prompt_prefix.strip() and suffix.strip():
+                messages = list(messages)
+                messages[0] = {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt_prefix, "cache_control": {"type": "ephemeral"}},
+                        {"type": "text", "text": suffix},
+                    ],
+                }
+
+        return system, messages
+
+    def record_message_usage(self, usage: Usage, estimated: bool = False) -> Counter[str]:
+        cached_tokens = usage.cache_read_input_tokens or 0
+        cache_creation_tokens = usage.cache_creation_input_tokens or 0
+        # input_tokens はキャッシュから読み書きされたトークンを含まない
+        return self.record_usage(
+            usage.input_tokens + cached_tokens + cache_creation_tokens,
+            output_tokens=usage.output_tokens,
+            cached_tokens=cached_tokens,
+            cache_creation_tokens=cache_creation_tokens,
+            estimated=estimated,
+        )
@@ -0,0 +1,385 @@
+import asyncio
+import email.utils
+import logging
+import random
+import re
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Iterable, Mapping, MutableMapping
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from .telemetry import current_request
+
+
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+
+# Flow (e.g. benchmark name) of the requests sent from the current task, used for fair queuing
+current_flow: ContextVar[str | None] = ContextVar("current_flow", default=None)
+
+
+def estimate_tokens(texts: Iterable[str | None], sampling_params: MutableMapping | None = None) -> int:
+    """Roughly estimate the number of tokens a request consumes from a TPM quota.
+
+    UTF-8 bytes / 3 slightly overestimates both Japanese (about 1 token per character) and English text.
+    Providers count the requested completion length against the quota, so `max_tokens` is added as well.
+    """
+    if sampling_params is None:
+        sampling_params = {}
+
+    num_bytes = sum(len(text.encode("utf-8")) for text in texts if text is not None)
+    max_tokens = sampling_params.get("max_tokens", sampling_params.get("max_completion_tokens")) or 0
+    return num_bytes // 3 + 1 + max_tokens
+
+
+def parse_duration(value: str) -> float | None:
+    """Parse a duration such as `1s`, `6m0s` or `20ms` (as in `x-ratelimit-reset-*`) into seconds."""
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    matches = DURATION_PATTERN.findall(value)
+    if len(matches) == 0:
+        return None
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in matches)
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> float | None:
+    """Return the delay in seconds requested by `retry-after-ms` or `retry-after`, if any."""
+    if "retry-after-ms" in headers:
+        try:
+            return max(float(headers["retry-after-ms"]) / 1000, 0.0)
+        except ValueError:
+            pass
+
+    if "retry-after" in headers:
+        retry_after = headers["retry-after"]
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+        try:
+            date = email.utils.parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            return None
+        return max(date.timestamp() - time.time(), 0.0)
+
+    return None
+
+
+def backoff_delay(attempt: int, retry_after: float | None = None, base: float = 1.0, max_delay: float = 60.0) -> float:
+    """Delay before retrying a rate-limited request.
+
+    `retry_after` is honored when the server provides it, otherwise the delay grows exponentially with
+    `attempt`. Random jitter is added so that requests limited at the same time do not retry together.
+    """
+    if retry_after is not None:
+        return retry_after + random.uniform(0, max(retry_after, base) / 2)
+
+    delay = min(max_delay, base * 2**attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate_per_minute`.
+
+    The bucket holds at most one second worth of quota, so requests are spread evenly over the minute
+    instead of being sent in a single burst. A request larger than the bucket is admitted once the bucket
+    is full and leaves it in debt, which keeps the long-term rate correct.
+    """
+
+    def __init__(self, rate_per_minute: float):
+        if rate_per_minute <= 0:
+            raise ValueError(f"rate_per_minute must be positive: {rate_per_minute}")
+
+        self.rate = rate_per_minute / 60
+        self.capacity = max(self.rate, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        self.refill()
+        required = min(amount, self.capacity)
+        if self.tokens >= required:
+            return 0.0
+        return (required - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self.refill()
+        self.tokens -= amount
+
+
+class HeaderQuota:
+    """Quota reported by the `x-ratelimit-remaining-*` and `x-ratelimit-reset-*` response headers.
+
+    The remaining quota is decreased locally for every admitted request and overwritten by the server's
+    value on every response. Once it runs out, requests wait until the reported reset time.
+    """
+
+    def __init__(self, default_reset: float = 1.0):
+        self.default_reset = default_reset
+        self.remaining: float | None = None
+        self.reset_at = 0.0
+
+    def update(self, remaining: str | None, reset: str | None):
+        if remaining is None:
+            return
+        try:
+            self.remaining = float(remaining)
+        except ValueError:
+            return
+
+        reset_after = parse_duration(reset) if reset is not None else None
+        if reset_after is None:
+            # Azure OpenAI はリセットまでの時間を返さないため、既定値を用いる
+            reset_after = self.default_reset
+        self.reset_at = time.monotonic() + reset_after
+
+    def wait_time(self, amount: float) -> float:
+        now = time.monotonic()
+        if self.remaining is None or now >= self.reset_at or self.remaining >= amount:
+            return 0.0
+        return self.reset_at - now
+
+    def consume(self, amount: float):
+        if self.remaining is not None and time.monotonic() < self.reset_at:
+            self.remaining -= amount
+
+
+class AdaptiveConcurrency:
+    """Concurrency limit adjusted by additive-increase/multiplicative-decrease (AIMD).
+
+    The limit grows by one per round trip (by `1 / limit` per successful request) while the short-term
+    latency average stays within `latency_tolerance` times the long-term average, and is multiplied by
+    `decrease_factor` on a 429 response or a latency spike. Decreases are applied at most once per
+    smoothed latency, so a burst of errors from requests sent at the same time only counts once.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int | None = None,
+        min_concurrency: int = 1,
+        initial_concurrency: int = 8,
+        latency_tolerance: float = 2.0,
+        decrease_factor: float = 0.5,
+        short_alpha: float = 0.2,
+        long_alpha: float = 0.02,
+    ):
+        if min_concurrency < 1:
+            raise ValueError(f"min_concurrency must be positive: {min_concurrency}")
+        if not 0 < decrease_factor < 1:
+            raise ValueError(f"decrease_factor must be between 0 and 1: {decrease_factor}")
+
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        self.short_alpha = short_alpha
+        self.long_alpha = long_alpha
+
+        self.limit = float(self.clip(initial_concurrency))
+        self.short_latency: float | None = None
+        self.long_latency: float | None = None
+        self.decreased_at = 0.0
+
+        self.started_at = time.monotonic()
+        self.history: list[tuple[float, int]] = [(0.0, self.current)]
+
+    def clip(self, limit: float) -> float:
+        if self.max_concurrency is not None:
+            limit = min(limit, self.max_concurrency)
+        return max(limit, self.min_concurrency)
+
+    @property
+    def current(self) -> int:
+        return int(self.limit)
+
+    def set_limit(self, limit: float, reason: str):
+        previous = self.current
+        self.limit = self.clip(limit)
+        if self.current == previous:
+            return
+
+        self.history.append((time.monotonic() - self.started_at, self.current))
+        message = f"Concurrency limit {previous} -> {self.current} ({reason})"
+        if self.current < previous:
+            logging.info(message)
+        else:
+            logging.debug(message)
+
+    def decrease(self, reason: str):
+        now = time.monotonic()
+        if now - self.decreased_at < (self.short_latency or 0.0):
+            return
+        self.decreased_at = now
+        self.set_limit(self.limit * self.decrease_factor, reason)
+
+    def record_latency(self, latency: float):
+        if self.short_latency is None or self.long_latency is None:
+            self.short_latency = self.long_latency = latency
+        else:
+            self.short_latency = (1 - self.short_alpha) * self.short_latency + self.short_alpha * latency
+            self.long_latency = (1 - self.long_alpha) * self.long_latency + self.long_alpha * latency
+
+        if self.short_latency > self.latency_tolerance * self.long_latency:
+            self.decrease(f"latency {self.short_latency:.2f}s > {self.latency_tolerance} x {self.long_latency:.2f}s")
+            # 減少後の遅延を新たな基準とし、同じ遅延で減少し続けないようにする
+            self.long_latency = self.short_latency / self.latency_tolerance
+        else:
+            self.set_limit(self.limit + 1 / self.limit, "latency stable")
+
+    def record_rate_limit(self):
+        self.decrease("rate limited")
+
+
+class RateLimiter:
+    """Request scheduler bounded by in-flight concurrency and RPM/TPM token buckets.
+
+    Requests are admitted as soon as a concurrency slot is free and both buckets hold enough quota.
+    Waiting requests are queued per flow (`current_flow`, e.g. the benchmark being evaluated) and admitted
+    in round-robin order over the flows, so that a large benchmark does not hold back the others. With
+    `adaptive`, the concurrency bound is an `AdaptiveConcurrency` limit fed by the latency of each request
+    and by 429 responses. The rate limit headers of each response are fed back through `update`, so
+    admission also slows down before the server's quota runs out, and `pause` holds every request back
+    after a 429 response until its `Retry-After` has passed. asyncio primitives are bound to the running
+    event loop and re-created when the loop changes, while the buckets are kept so that the quota is
+    shared across calls.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int | None = None,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        adaptive: Mapping | None = None,
+    ):
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError(f"max_concurrency must be positive: {max_concurrency}")
+
+        self.max_concurrency = max_concurrency
+        self.adaptive: AdaptiveConcurrency | None = None
+        if adaptive is not None:
+            self.adaptive = AdaptiveConcurrency(max_concurrency=max_concurrency, **adaptive)
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.request_quota = HeaderQuota()
+        self.token_quota = HeaderQuota()
+        self.paused_until = 0.0
+
+        self.in_flight = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._waiters: dict[str | None, deque[asyncio.Future[None]]] = {}
+        self._bucket_lock: asyncio.Lock | None = None
+
+    def _bind_loop(self) -> tuple[asyncio.AbstractEventLoop, asyncio.Lock]:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._bucket_lock is None:
+            self._loop = loop
+            self._waiters = {}
+            self._bucket_lock = asyncio.Lock()
+            self.in_flight = 0
+        return loop, self._bucket_lock
+
+    def _dispatch(self):
+        while len(self._waiters) > 0 and self.has_capacity():
+            # 先頭のフローから1件を許可し、そのフローを末尾に回す
+            flow = next(iter(self._waiters))
+            waiters = self._waiters.pop(flow)
+            waiter = waiters.popleft()
+            if len(waiters) > 0:
+                self._waiters[flow] = waiters
+
+            if waiter.done():  # Cancelled while waiting
+                continue
+            waiter.set_result(None)
+            self.in_flight += 1
+
+    @property
+    def concurrency_limit(self) -> int | None:
+        if self.adaptive is not None:
+            return self.adaptive.current
+        return self.max_concurrency
+
+    def has_capacity(self) -> bool:
+        limit = self.concurrency_limit
+        return limit is None or self.in_flight < limit
+
+    async def acquire(self, tokens: int = 0):
+        loop, bucket_lock = self._bind_loop()
+
+        if len(self._waiters) == 0 and self.has_capacity():
+            self.in_flight += 1
+        else:
+            waiter = loop.create_future()
+            self._waiters.setdefault(current_flow.get(), deque()).append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Admitted right before being cancelled
+                    await self.release()
+                raise
+
+        try:
+            async with bucket_lock:
+                while True:
+                    wait = max(self.paused_until - time.monotonic(), 0.0)
+                    wait = max(wait, self.request_quota.wait_time(1), self.token_quota.wait_time(tokens))
+                    if self.request_bucket is not None:
+                        wait = max(wait, self.request_bucket.wait_time(1))
+                    if self.token_bucket is not None:
+                        wait = max(wait, self.token_bucket.wait_time(tokens))
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+
+                if self.request_bucket is not None:
+                    self.request_bucket.consume(1)
+                if self.token_bucket is not None:
+                    self.token_bucket.consume(tokens)
+                self.request_quota.consume(1)
+                self.token_quota.consume(tokens)
+        except BaseException:
+            await self.release()
+            raise
+
+    def update(self, headers: Mapping[str, str]):
+        self.request_quota.update(
+            headers.get("x-ratelimit-remaining-requests"), headers.get("x-ratelimit-reset-requests")
+        )
+        self.token_quota.update(headers.get("x-ratelimit-remaining-tokens"), headers.get("x-ratelimit-reset-tokens"))
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def record_rate_limit(self):
+        if self.adaptive is not None:
+            self.adaptive.record_rate_limit()
+
+    async def release(self):
+        self._bind_loop()
+        self.in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 0) -> AsyncIterator[None]:
+        queued_at = time.monotonic()
+        await self.acquire(tokens)
+        record = current_request.get()
+        if record is not None:
+            record.queue_seconds += time.monotonic() - queued_at
+        try:
+            start = time.monotonic()
+            yield
+            if self.adaptive is not None:
+                self.adaptive.record_latency(time.monotonic() - start)
+        finally:
+            await self.release()
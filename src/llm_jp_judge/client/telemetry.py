@@ -0,0 +1,286 @@
+import logging
+import math
+import os
+import time
+from collections import Counter, defaultdict
+from collections.abc import Iterator, Mapping, Sequence
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+
+if TYPE_CHECKING:
+    from ..dashboard.base import BaseDashboard
+
+# Upper bounds (seconds) of the histogram buckets, following the defaults of the Prometheus client libraries
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, math.inf)
+PERCENTILES = (50, 95, 99)
+USAGE_KEYS = ("input_tokens", "output_tokens", "reasoning_tokens", "cached_tokens")
+REQUEST_EVENTS = ("start", "retry", "complete")
+
+
+@dataclass
+class RequestRecord:
+    """Telemetry of one turn of one item, from its first attempt to its last one.
+
+    Attributes:
+        flow: Flow (benchmark) of the request.
+        item_id: ID of the dataset item.
+        turn: Turn of the item.
+        queue_seconds: Time spent waiting for a slot of the rate limiters.
+        flight_seconds: Time spent sending the request and receiving the response, over all the attempts.
+        sleep_seconds: Time spent sleeping before retries.
+        attempts: Number of attempts.
+        errors: Error class of each failed attempt.
+        success: Whether a response (and its score, when extracted) was obtained.
+        usage: Tokens reported by the API over all the attempts (input, output, reasoning and cached tokens).
+        started_at: Monotonic time at which the request started.
+    """
+
+    flow: str | None
+    item_id: int | str
+    turn: int
+    queue_seconds: float = 0.0
+    flight_seconds: float = 0.0
+    sleep_seconds: float = 0.0
+    attempts: int = 0
+    errors: list[str] = field(default_factory=list)
+    success: bool = False
+    usage: Counter[str] = field(default_factory=Counter)
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def total_seconds(self) -> float:
+        return self.queue_seconds + self.flight_seconds + self.sleep_seconds
+
+    @contextmanager
+    def attempt(self) -> Iterator[None]:
+        """Count an attempt and add its time, except the time waited for rate limiter slots, to the flight time."""
+        self.attempts += 1
+        started_at, queue_seconds = time.monotonic(), self.queue_seconds
+        try:
+            yield
+        finally:
+            self.flight_seconds += time.monotonic() - started_at - (self.queue_seconds - queue_seconds)
+
+
+# Request being processed by the current task, to which the rate limiter adds the time waited for a slot
+current_request: ContextVar[RequestRecord | None] = ContextVar("current_request", default=None)
+
+
+def percentile(values: Sequence[float], q: float) -> float | None:
+    """Return the `q`-th percentile of sorted `values` with the nearest-rank method."""
+    if len(values) == 0:
+        return None
+    return values[min(max(math.ceil(len(values) * q / 100) - 1, 0), len(values) - 1)]
+
+
+def format_labels(labels: Mapping[str, str]) -> str:
+    escaped = {k: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for k, v in labels.items()}
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped.items()) + "}"
+
+
+def format_bound(bound: float) -> str:
+    return "+Inf" if math.isinf(bound) else f"{bound:g}"
+
+
+class FlowTelemetry:
+    def __init__(self):
+        # Seconds per request for each of "latency" (in flight), "queue_wait" and "total"
+        self.seconds: dict[str, list[float]] = {"latency": [], "queue_wait": [], "total": []}
+        self.counts: Counter[str] = Counter()
+        self.sleep_seconds = 0.0
+        self.errors: Counter[str] = Counter()
+        self.usage: Counter[str] = Counter()
+        self.started_at: float | None = None
+        self.completed_at: float | None = None
+
+    def add(self, record: RequestRecord):
+        self.started_at = record.started_at if self.started_at is None else min(self.started_at, record.started_at)
+        self.completed_at = time.monotonic()
+        self.seconds["latency"].append(record.flight_seconds)
+        self.seconds["queue_wait"].append(record.queue_seconds)
+        self.seconds["total"].append(record.total_seconds)
+        self.counts["requests"] += 1
+        self.counts["items"] += record.turn == 0
+        self.counts["failures"] += not record.success
+        self.counts["attempts"] += record.attempts
+        self.counts["retries"] += max(record.attempts - 1, 0)
+        self.sleep_seconds += record.sleep_seconds
+        self.errors.update(record.errors)
+        self.usage.update(record.usage)
+
+    def throughput(self) -> dict[str, float]:
+        elapsed = (self.completed_at or 0.0) - (self.started_at or 0.0)
+        requests, items = self.counts["requests"], self.counts["items"]
+        tokens = self.usage["input_tokens"] + self.usage["output_tokens"]
+        return {
+            "items": items,
+            "requests": requests,
+            **{key: self.usage[key] for key in USAGE_KEYS},
+            # 途中で打ち切ったストリーミングなど、使用量を推定したリクエストの数
+            "estimated_requests": self.usage["estimated_requests"],
+            "elapsed(s)": elapsed,
+            "requests/s": requests / elapsed if elapsed > 0 else 0.0,
+            "output_tokens/s": self.usage["output_tokens"] / elapsed if elapsed > 0 else 0.0,
+            "tokens/s": tokens / elapsed if elapsed > 0 else 0.0,
+            "tokens/item": tokens / items if items > 0 else 0.0,
+            "output_tokens/item": self.usage["output_tokens"] / items if items > 0 else 0.0,
+        }
+
+
+class RequestTelemetry:
+    """Aggregates the records of completed requests per flow (benchmark).
+
+    It is registered as the `complete` hook of the client, and reports the latency percentiles, histograms,
+    retries and error classes to the dashboard and as a Prometheus text file.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = sorted(buckets) if math.inf in buckets else [*sorted(buckets), math.inf]
+        self.flows: defaultdict[str | None, FlowTelemetry] = defaultdict(FlowTelemetry)
+
+    def record(self, record: RequestRecord):
+        self.flows[record.flow].add(record)
+
+    def summarize(self) -> dict[str | None, dict[str, float | None]]:
+        summaries: dict[str | None, dict[str, float | None]] = {}
+        for flow, telemetry in self.flows.items():
+            summary: dict[str, float | None] = {key: float(value) for key, value in telemetry.counts.items()}
+            summary["sleep(s)"] = telemetry.sleep_seconds
+            for name, values in telemetry.seconds.items():
+                values = sorted(values)
+                for q in PERCENTILES:
+                    summary[f"{name}_p{q}(s)"] = percentile(values, q)
+            summaries[flow] = summary
+        return summaries
+
+    def throughput(self) -> dict[str | None, dict[str, float]]:
+        """Return the tokens and requests per flow, and their rates over the wall-clock time of the flow."""
+        return {flow: telemetry.throughput() for flow, telemetry in self.flows.items()}
+
+    def histogram(self, name: str, flow: str | None) -> list[tuple[float, int]]:
+        """Return the cumulative counts of the requests of `flow` per bucket, as in Prometheus histograms."""
+        values = sorted(self.flows[flow].seconds[name])
+        counts, i = [], 0
+        for bound in self.buckets:
+            while i < len(values) and values[i] <= bound:
+                i += 1
+            counts.append((bound, i))
+        return counts
+
+    def log(self, stage: str, dashboard: "BaseDashboard | None" = None):
+        """Log the telemetry of `stage` (e.g. generate or evaluate), and to the dashboard if given."""
+        if len(self.flows) == 0:
+            return
+
+        summaries = self.summarize()
+        throughputs = self.throughput()
+        for flow, summary in summaries.items():
+            logging.info(
+                f"Request latency of {flow}: p50 {summary['latency_p50(s)'] or 0.0:.2f}s, "
+                f"p95 {summary['latency_p95(s)'] or 0.0:.2f}s, p99 {summary['latency_p99(s)'] or 0.0:.2f}s "
+                f"({summary['retries']:.0f} retries, queue wait p95 {summary['queue_wait_p95(s)'] or 0.0:.2f}s)"
+            )
+            throughput = throughputs[flow]
+            logging.info(
+                f"Throughput of {flow}: {throughput['requests/s']:.2f} requests/s, "
+                f"{throughput['output_tokens/s']:.1f} output tokens/s, {throughput['tokens/item']:.1f} tokens/item "
+                f"({throughput['input_tokens']:.0f} input, {throughput['output_tokens']:.0f} output, "
+                f"{throughput['reasoning_tokens']:.0f} reasoning tokens)"
+            )
+
+        if dashboard is None:
+            return
+
+        dashboard.log_summaries(
+            {f"{stage}:{flow}:{key}": value for flow, summary in summaries.items() for key, value in summary.items()}
+        )
+        dashboard.log_table(
+            f"{stage}_request_histogram_table",
+            columns=["benchmark", "metric", "le(s)", "count"],
+            data=[
+                [flow, name, format_bound(bound), count]
+                for flow, telemetry in self.flows.items()
+                for name in telemetry.seconds
+                for bound, count in self.histogram(name, flow)
+            ],
+        )
+        columns = list(next(iter(throughputs.values())))
+        dashboard.log_table(
+            f"{stage}_throughput_table",
+            columns=["benchmark", *columns],
+            data=[[flow, *(throughput[key] for key in columns)] for flow, throughput in throughputs.items()],
+        )
+        dashboard.log_table(
+            f"{stage}_request_error_table",
+            columns=["benchmark", "error", "count"],
+            data=[
+                [flow, error, count]
+                for flow, telemetry in self.flows.items()
+                for error, count in telemetry.errors.items()
+            ],
+        )
+
+    def to_prometheus(self, labels: Mapping[str, str] | None = None) -> str:
+        """Format the telemetry in the Prometheus text exposition format."""
+        if labels is None:
+            labels = {}
+
+        lines = []
+        histograms = {
+            "latency": "Time in flight per request, excluding queue waits and retry sleeps.",
+            "queue_wait": "Time waited for a rate limiter slot per request.",
+            "total": "Time from the first attempt to the completion per request.",
+        }
+        for name, description in histograms.items():
+            metric = f"llm_jp_judge_request_{name}_seconds"
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} histogram"]
+            for flow, telemetry in self.flows.items():
+                flow_labels = {**labels, "benchmark": flow or ""}
+                for bound, count in self.histogram(name, flow):
+                    lines.append(f"{metric}_bucket{format_labels({**flow_labels, 'le': format_bound(bound)})} {count}")
+                lines.append(f"{metric}_sum{format_labels(flow_labels)} {sum(telemetry.seconds[name]):g}")
+                lines.append(f"{metric}_count{format_labels(flow_labels)} {len(telemetry.seconds[name])}")
+
+        counters = {
+            "requests": "Requests (turns of items) processed.",
+            "failures": "Requests that failed after all the attempts.",
+            "attempts": "Attempts including retries.",
+            "retries": "Retries.",
+        }
+        for name, description in counters.items():
+            metric = f"llm_jp_judge_{name}_total"
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} counter"]
+            for flow, telemetry in self.flows.items():
+                lines.append(f"{metric}{format_labels({**labels, 'benchmark': flow or ''})} {telemetry.counts[name]}")
+
+        metric = "llm_jp_judge_retry_sleep_seconds_total"
+        lines += [f"# HELP {metric} Time slept before retries.", f"# TYPE {metric} counter"]
+        for flow, telemetry in self.flows.items():
+            lines.append(f"{metric}{format_labels({**labels, 'benchmark': flow or ''})} {telemetry.sleep_seconds:g}")
+
+        metric = "llm_jp_judge_tokens_total"
+        lines += [f"# HELP {metric} Tokens reported by the API per type.", f"# TYPE {metric} counter"]
+        for flow, telemetry in self.flows.items():
+            for key in USAGE_KEYS:
+                flow_labels = {**labels, "benchmark": flow or "", "type": key.removesuffix("_tokens")}
+                lines.append(f"{metric}{format_labels(flow_labels)} {telemetry.usage[key]}")
+
+        metric = "llm_jp_judge_request_errors_total"
+        lines += [f"# HELP {metric} Failed attempts per error class.", f"# TYPE {metric} counter"]
+        for flow, telemetry in self.flows.items():
+            for error, count in telemetry.errors.items():
+                lines.append(f"{metric}{format_labels({**labels, 'benchmark': flow or '', 'error': error})} {count}")
+
+        return "\n".join(lines) + "\n"
+
+    def save_prometheus(self, path: str, labels: Mapping[str, str] | None = None):
+        if len(self.flows) == 0:
+            return
+
+        logging.info(f"Saving request telemetry to {path}")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus(labels))
@@ -0,0 +1,95 @@
+import math
+from typing import Any
+
+from .scheduler import estimate_tokens
+
+
+TRUNCATION_MARKER = "\n...\n"
+
+
+class ContextLengthExceededError(Exception):
+    pass
+
+
+class TokenCounter:
+    """Counts the tokens of a text. This base class roughly estimates them from UTF-8 bytes."""
+
+    def count(self, text: str) -> int:
+        return estimate_tokens([text])
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Drop the middle of `text` so that it fits in `max_tokens`, keeping its beginning and end.
+
+        Judge prompts have the instructions at the beginning and the output format at the end, so the middle
+        (the question and the answer being judged) is the part to drop.
+        """
+        num_tokens = self.count(text)
+        if num_tokens <= max_tokens:
+            return text
+
+        keep = max(math.floor(len(text) * max_tokens / num_tokens) - len(TRUNCATION_MARKER), 0)
+        while True:
+            head, tail = keep - keep // 2, keep // 2
+            truncated = text[:head] + TRUNCATION_MARKER + (text[-tail:] if tail > 0 else "")
+            if self.count(truncated) <= max_tokens or keep == 0:
+                return truncated
+            keep = math.floor(keep * 0.9)
+
+
+class TokenizerCounter(TokenCounter):
+    """Counts tokens with a tokenizer exposing `encode`/`decode` like those of Hugging Face `transformers`."""
+
+    def __init__(self, tokenizer: Any):
+        self.tokenizer = tokenizer
+
+    def count(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        token_ids = self.tokenizer.encode(text, add_special_tokens=False)
+        if len(token_ids) <= max_tokens:
+            return text
+
+        keep = max(max_tokens - self.count(TRUNCATION_MARKER), 0)
+        head, tail = keep - keep // 2, keep // 2
+        return (
+            self.tokenizer.decode(token_ids[:head])
+            + TRUNCATION_MARKER
+            + (self.tokenizer.decode(token_ids[-tail:]) if tail > 0 else "")
+        )
+
+
+class TiktokenAdapter:
+    """Exposes a tiktoken encoding with the `encode`/`decode` interface of Hugging Face tokenizers."""
+
+    def __init__(self, encoding: Any):
+        self.encoding = encoding
+
+    def encode(self, text: str, add_special_tokens: bool = False) -> list[int]:
+        return self.encoding.encode(text, disallowed_special=())
+
+    def decode(self, token_ids: list[int]) -> str:
+        return self.encoding.decode(token_ids)
+
+
+def load_token_counter(tokenizer: str | None = None) -> TokenCounter:
+    """Load a token counter from a Hugging Face model name, `tiktoken:<model or encoding>`, or null (estimate)."""
+    if tokenizer is None:
+        return TokenCounter()
+
+    if tokenizer.startswith("tiktoken:"):
+        try:
+            import tiktoken
+        except ImportError as e:
+            raise ImportError("tiktoken is required to count tokens with `tiktoken:` tokenizers") from e
+
+        name = tokenizer.removeprefix("tiktoken:")
+        try:
+            encoding = tiktoken.encoding_for_model(name)
+        except KeyError:
+            encoding = tiktoken.get_encoding(name)
+        return TokenizerCounter(TiktokenAdapter(encoding))
+
+    from transformers import AutoTokenizer
+
+    return TokenizerCounter(AutoTokenizer.from_pretrained(tokenizer))
@@ -2,6 +2,11 @@ import json
 import os
 from typing import Any
 
+from ..utils.data import save_parquet
+
+
+TABLE_FORMATS = ["json", "parquet"]
+
 
 class BaseDashboard:
     def __init__(self):
@@ -37,3 +42,22 @@ class BaseDashboard:
             file_path = os.path.join(file_dir, f"{key}.json")
             with open(file_path, "w") as f:
                 json.dump(value, f, ensure_ascii=False, indent=4)
+
+    def save_parquet(self, file_dir: str):
+        """Save the tables as Parquet files, and the other logged values (e.g. the summary) as JSON files."""
+        os.makedirs(file_dir, exist_ok=True)
+        for key, value in self.cache.items():
+            if isinstance(value, list):
+                save_parquet(os.path.join(file_dir, f"{key}.parquet"), value)
+            else:
+                with open(os.path.join(file_dir, f"{key}.json"), "w") as f:
+                    json.dump(value, f, ensure_ascii=False, indent=4)
+
+    def save(self, file_dir: str, table_format: str = "json"):
+        if table_format not in TABLE_FORMATS:
+            raise ValueError(f"Invalid table format: {table_format}")
+
+        if table_format == "parquet":
+            self.save_parquet(file_dir)
+        else:
+            self.save_json(file_dir)
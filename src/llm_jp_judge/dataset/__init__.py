@@ -1,3 +1,5 @@
+from typing import Any
+
 from pydantic import BaseModel
 
 
@@ -10,6 +12,9 @@ class DatasetItem(BaseModel):
         response: Model response for each turn.
         error_messages: Error messages for each turn.
         pattern: Extracted pattern for each turn.
+        time_to_first_token: Seconds until the first token of the streamed response for each turn.
+        usage: Tokens reported by the API (input, output, reasoning and cached tokens) for each turn.
+        sampling_params: Sampling parameters overriding those of the request for this item.
         original_index: Original index of the item.
     """
 
@@ -18,12 +23,19 @@ class DatasetItem(BaseModel):
     response: list[str | None] = []
     error_messages: list[list[str]] = []
     pattern: list[str | dict[str, int] | None] = []
+    time_to_first_token: list[float | None] = []
+    usage: list[dict[str, int] | None] = []
+    sampling_params: dict[str, Any] | None = None
     original_index: int | None = None
 
 
 class DatasetItemForEvaluation(DatasetItem):
     """Base class for dataset item for evaluation.
 
+    Evaluators build these items from generation outputs that were validated when loaded, so they are created
+    with `model_construct`: validation is skipped and the generation fields are shared with the output item
+    rather than copied. They must therefore be treated as read-only.
+
     Attributes:
         generate_prompt: Prompt for each turn used in generation phase.
         generate_response: Model response for each turn used in generation phase.
@@ -1,8 +1,8 @@
-import json
+from collections.abc import Iterator
 
-import hydra
 from pydantic import BaseModel
 
+from ..utils.data import iter_dataset, iter_json_array, iter_records
 from . import DatasetItem, DatasetItemForEvaluation
 
 
@@ -28,24 +28,11 @@ class CultureDatasetItemForEvaluation(DatasetItemForEvaluation, CultureDatasetIt
     pass
 
 
-def load_culture(path: str) -> list[CultureDatasetItem]:
-    path = hydra.utils.to_absolute_path(path)
-    data = []
-    with open(path, "r", encoding="utf-8") as f:
-        for d in json.load(f):
-            item = CultureDatasetItem(ID=d["ID"], prompt=[d["text"]], reference=[d["output"]])
-            data.append(item)
+def load_culture(path: str) -> Iterator[CultureDatasetItem]:
+    for d in iter_dataset(path, iter_json_array):
+        yield CultureDatasetItem(ID=d["ID"], prompt=[d["text"]], reference=[d["output"]])
 
-    return data
 
-
-def load_culture_raw_output(path: str) -> list[CultureDatasetItem]:
-    path = hydra.utils.to_absolute_path(path)
-    data = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            d = json.loads(line)
-            item = CultureDatasetItem(**d)
-            data.append(item)
-
-    return data
+def load_culture_raw_output(path: str) -> Iterator[CultureDatasetItem]:
+    for d in iter_records(path):
+        yield CultureDatasetItem(**d)
@@ -1,8 +1,8 @@
-import json
+from collections.abc import Iterator
 
-import hydra
 from pydantic import BaseModel
 
+from ..utils.data import iter_dataset, iter_jsonl, iter_records
 from . import DatasetItem, DatasetItemForEvaluation
 
 
@@ -32,25 +32,11 @@ class MTBenchDatasetItemForEvaluation(DatasetItemForEvaluation, MTBenchDatasetIt
     system_prompt: str
 
 
-def load_mt_bench(path: str) -> list[MTBenchDatasetItem]:
-    path = hydra.utils.to_absolute_path(path)
-    data = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            d = json.loads(line)
-            item = MTBenchDatasetItem(ID=d["question_id"], prompt=d["turns"], category=d["category"])
-            data.append(item)
+def load_mt_bench(path: str) -> Iterator[MTBenchDatasetItem]:
+    for d in iter_dataset(path, iter_jsonl):
+        yield MTBenchDatasetItem(ID=d["question_id"], prompt=d["turns"], category=d["category"])
 
-    return data
 
-
-def load_mt_bench_raw_output(path: str) -> list[MTBenchDatasetItem]:
-    path = hydra.utils.to_absolute_path(path)
-    data = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            d = json.loads(line)
-            item = MTBenchDatasetItem(**d)
-            data.append(item)
-
-    return data
+def load_mt_bench_raw_output(path: str) -> Iterator[MTBenchDatasetItem]:
+    for d in iter_records(path):
+        yield MTBenchDatasetItem(**d)
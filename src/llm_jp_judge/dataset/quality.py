@@ -1,8 +1,8 @@
-import json
+from collections.abc import Iterator
 
-import hydra
 from pydantic import BaseModel
 
+from ..utils.data import iter_dataset, iter_json_array, iter_records
 from . import DatasetItem, DatasetItemForEvaluation
 
 
@@ -28,24 +28,11 @@ class QualityDatasetItemForEvaluation(DatasetItemForEvaluation, QualityDatasetIt
     pass
 
 
-def load_quality(path: str) -> list[QualityDatasetItem]:
-    path = hydra.utils.to_absolute_path(path)
-    data = []
-    with open(path, "r", encoding="utf-8") as f:
-        for d in json.load(f):
-            item = QualityDatasetItem(ID=d["ID"], prompt=[d["text"]], text=[d["text"]])
-            data.append(item)
+def load_quality(path: str) -> Iterator[QualityDatasetItem]:
+    for d in iter_dataset(path, iter_json_array):
+        yield QualityDatasetItem(ID=d["ID"], prompt=[d["text"]], text=[d["text"]])
 
-    return data
 
-
-def load_quality_raw_output(path: str) -> list[QualityDatasetItem]:
-    path = hydra.utils.to_absolute_path(path)
-    data = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            d = json.loads(line)
-            item = QualityDatasetItem(**d)
-            data.append(item)
-
-    return data
+def load_quality_raw_output(path: str) -> Iterator[QualityDatasetItem]:
+    for d in iter_records(path):
+        yield QualityDatasetItem(**d)
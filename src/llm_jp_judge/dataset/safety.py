@@ -1,8 +1,8 @@
-import json
+from collections.abc import Iterator
 
-import hydra
 from pydantic import BaseModel
 
+from ..utils.data import iter_dataset, iter_json_array, iter_records
 from . import DatasetItem, DatasetItemForEvaluation
 
 
@@ -30,24 +30,11 @@ class SafetyDatasetItemForEvaluation(DatasetItemForEvaluation, SafetyDatasetItem
     pass
 
 
-def load_safety(path: str) -> list[SafetyDatasetItem]:
-    path = hydra.utils.to_absolute_path(path)
-    data = []
-    with open(path, "r", encoding="utf-8") as f:
-        for d in json.load(f):
-            item = SafetyDatasetItem(ID=d["ID"], prompt=[d["text"]], text=[d["text"]], reference=[d["output"]])
-            data.append(item)
+def load_safety(path: str) -> Iterator[SafetyDatasetItem]:
+    for d in iter_dataset(path, iter_json_array):
+        yield SafetyDatasetItem(ID=d["ID"], prompt=[d["text"]], text=[d["text"]], reference=[d["output"]])
 
-    return data
 
-
-def load_safety_raw_output(path: str) -> list[SafetyDatasetItem]:
-    path = hydra.utils.to_absolute_path(path)
-    data = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            d = json.loads(line)
-            item = SafetyDatasetItem(**d)
-            data.append(item)
-
-    return data
+def load_safety_raw_output(path: str) -> Iterator[SafetyDatasetItem]:
+    for d in iter_records(path):
+        yield SafetyDatasetItem(**d)
@@ -1,8 +1,8 @@
-import json
+from collections.abc import Iterator
 
-import hydra
 from pydantic import BaseModel
 
+from ..utils.data import iter_dataset, iter_json_array, iter_records
 from . import DatasetItem, DatasetItemForEvaluation
 
 
@@ -30,26 +30,11 @@ class SafetyBorderlineDatasetItemForEvaluation(DatasetItemForEvaluation, SafetyB
     pass
 
 
-def load_safety_boarderline(path: str) -> list[SafetyBorderlineDatasetItem]:
-    path = hydra.utils.to_absolute_path(path)
-    data = []
-    with open(path, "r", encoding="utf-8") as f:
-        for d in json.load(f):
-            item = SafetyBorderlineDatasetItem(
-                ID=d["ID"], prompt=[d["text"]], text=[d["text"]], reference=[d["output"]]
-            )
-            data.append(item)
+def load_safety_boarderline(path: str) -> Iterator[SafetyBorderlineDatasetItem]:
+    for d in iter_dataset(path, iter_json_array):
+        yield SafetyBorderlineDatasetItem(ID=d["ID"], prompt=[d["text"]], text=[d["text"]], reference=[d["output"]])
 
-    return data
 
-
-def load_safety_boarderline_raw_output(path: str) -> list[SafetyBorderlineDatasetItem]:
-    path = hydra.utils.to_absolute_path(path)
-    data = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            d = json.loads(line)
-            item = SafetyBorderlineDatasetItem(**d)
-            data.append(item)
-
-    return data
+def load_safety_boarderline_raw_output(path: str) -> Iterator[SafetyBorderlineDatasetItem]:
+    for d in iter_records(path):
+        yield SafetyBorderlineDatasetItem(**d)
@@ -1,9 +1,8 @@
-import csv
-import json
+from collections.abc import Iterator
 
-import hydra
 from pydantic import BaseModel
 
+from ..utils.data import iter_csv, iter_dataset, iter_records
 from . import DatasetItem, DatasetItemForEvaluation
 
 
@@ -37,34 +36,19 @@ class SafetyBoundaryDatasetItemForEvaluation(DatasetItemForEvaluation, SafetyBou
     pass
 
 
-def load_safety_boundary(path: str) -> list[SafetyBoundaryDatasetItem]:
-    path = hydra.utils.to_absolute_path(path)
-    data = []
-
-    with open(path, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for i, d in enumerate(reader):
-            item = SafetyBoundaryDatasetItem(
-                ID=i,
-                prompt=[d["input"]],
-                text=[d["input"]],
-                type=d["type"],
-                safety=d["safety"],
-                eval_aspect=d["eval_aspect"],
-                ng_aspect=d["ng_aspect"],
-            )
-            data.append(item)
-
-    return data
-
-
-def load_safety_boundary_raw_output(path: str) -> list[SafetyBoundaryDatasetItem]:
-    path = hydra.utils.to_absolute_path(path)
-    data = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            d = json.loads(line)
-            item = SafetyBoundaryDatasetItem(**d)
-            data.append(item)
-
-    return data
+def load_safety_boundary(path: str) -> Iterator[SafetyBoundaryDatasetItem]:
+    for i, d in enumerate(iter_dataset(path, iter_csv)):
+        yield SafetyBoundaryDatasetItem(
+            ID=i,
+            prompt=[d["input"]],
+            text=[d["input"]],
+            type=d["type"],
+            safety=d["safety"],
+            eval_aspect=d["eval_aspect"],
+            ng_aspect=d["ng_aspect"],
+        )
+
+
+def load_safety_boundary_raw_output(path: str) -> Iterator[SafetyBoundaryDatasetItem]:
+    for d in iter_records(path):
+        yield SafetyBoundaryDatasetItem(**d)
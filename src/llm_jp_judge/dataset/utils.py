@@ -1,4 +1,5 @@
-from collections.abc import Sequence
+import itertools
+from collections.abc import Iterator
 
 from . import DatasetItem
 from .culture import load_culture, load_culture_raw_output
@@ -9,8 +10,9 @@ from .safety_borderline import load_safety_boarderline, load_safety_boarderline_
 from .safety_boundary import load_safety_boundary, load_safety_boundary_raw_output
 
 
-def load_dataset(name: str, path: str, size: int | None = None) -> Sequence[DatasetItem]:
-    dataset: Sequence[DatasetItem]
+def load_dataset(name: str, path: str, size: int | None = None) -> Iterator[DatasetItem]:
+    """Return a lazy iterator over the items of a dataset, which reads only the first `size` records if given."""
+    dataset: Iterator[DatasetItem]
     if name == "quality_ja":
         dataset = load_quality(path)
     elif name == "safety_ja":
@@ -29,11 +31,12 @@ def load_dataset(name: str, path: str, size: int | None = None) -> Sequence[Data
     if size is None:
         return dataset
 
-    return dataset[:size]
+    return itertools.islice(dataset, size)
 
 
-def load_raw_output(name: str, path: str) -> Sequence[DatasetItem]:
-    dataset: Sequence[DatasetItem]
+def load_raw_output(name: str, path: str) -> Iterator[DatasetItem]:
+    """Return a lazy iterator over the generated outputs of a benchmark."""
+    dataset: Iterator[DatasetItem]
     if name == "quality_ja":
         dataset = load_quality_raw_output(path)
     elif name == "safety_ja":
@@ -1,16 +1,23 @@
+import asyncio
 import glob
 import logging
 import os
-from collections.abc import Sequence
+from collections import Counter
+from collections.abc import Mapping, Sequence
 
 import hydra
 from omegaconf import DictConfig
 
 from .client import load_client
+from .client.base import BaseClient
+from .client.scheduler import current_flow
 from .dashboard import load_dashboard
+from .dashboard.base import BaseDashboard
 from .dataset import DatasetItem
 from .dataset.utils import load_raw_output
 from .evaluator import load_evaluator
+from .evaluator.base import BaseEvaluator
+from .utils.checkpoint import Checkpoint
 from .utils.data import load_json
 
 
@@ -23,19 +30,97 @@ def load_metadata(cfg: DictConfig) -> dict[str, str]:
 
 def load_raw_outputs(cfg: DictConfig) -> dict[str, Sequence[DatasetItem]]:
     input_dir = hydra.utils.to_absolute_path(cfg.input.dir)
-    output_paths = glob.glob(os.path.join(input_dir, "*.jsonl"))
+    output_paths = sorted(
+        path for extension in ["jsonl", "parquet"] for path in glob.glob(os.path.join(input_dir, f"*.{extension}"))
+    )
 
     raw_outputs: dict[str, Sequence[DatasetItem]] = {}
     for output_path in output_paths:
         assert os.path.exists(output_path), f"Responses not found at {output_path}"
 
         benchmark_name = os.path.splitext(os.path.basename(output_path))[0]
-        raw_outputs[benchmark_name] = load_raw_output(benchmark_name, output_path)
+        if benchmark_name in raw_outputs:
+            raise ValueError(f"Raw outputs of {benchmark_name} found in both .jsonl and .parquet in {cfg.input.dir}")
+        # 評価器は応答を複数回走査する(MT-Benchの参照の有無やターン数ごとの振り分けなど)ため、リストにする
+        raw_outputs[benchmark_name] = list(load_raw_output(benchmark_name, output_path))
 
-    assert len(raw_outputs) > 0, f"No raw outputs (.jsonl) found in {cfg.input.dir}"
+    assert len(raw_outputs) > 0, f"No raw outputs (.jsonl or .parquet) found in {cfg.input.dir}"
     return raw_outputs
 
 
+async def evaluate(
+    benchmark_name: str, evaluator: BaseEvaluator, data: Sequence[DatasetItem]
+) -> tuple[dict[str, float | None], dict[str, float]]:
+    # リクエストをベンチマークごとのフローとしてスケジューラに登録し、ベンチマーク間で公平に処理する
+    current_flow.set(benchmark_name)
+    logging.info(f"Evaluating benchmark: {benchmark_name}")
+    return await evaluator.aevaluate(data)
+
+
+async def evaluate_all(
+    evaluators: Mapping[str, BaseEvaluator], raw_outputs: Mapping[str, Sequence[DatasetItem]]
+) -> dict[str, tuple[dict[str, float | None], dict[str, float]]]:
+    # すべてのベンチマークの評価リクエストを同じイベントループで並行に処理する
+    results = await asyncio.gather(
+        *(evaluate(name, evaluator, raw_outputs[name]) for name, evaluator in evaluators.items())
+    )
+    return dict(zip(evaluators, results))
+
+
+def log_results(
+    dashboard: BaseDashboard,
+    client: BaseClient,
+    metadata: dict[str, str],
+    results: dict[str, tuple[dict[str, float | None], dict[str, float]]],
+):
+    all_scores, all_error_rates = {}, {}
+    for benchmark_name, (scores, error_rates) in results.items():
+        if client.cache is not None:
+            cache_hits = client.cache.flow_hits[benchmark_name]
+            cache_misses = client.cache.flow_misses[benchmark_name]
+            cache_hit_rate = cache_hits / (cache_hits + cache_misses) * 100 if cache_hits + cache_misses else 0.0
+            logging.info(
+                f"Cache hit rate of {benchmark_name}: {cache_hit_rate:.2f}% ({cache_hits} hits, {cache_misses} misses)"
+            )
+            error_rates[f"{benchmark_name}:cache_hit(%)"] = cache_hit_rate
+        if client.prompt_cache:
+            usage = client.get_usage().get(benchmark_name, Counter())
+            input_tokens, cached_tokens = usage["input_tokens"], usage["cached_tokens"]
+            prompt_cache_hit_rate = cached_tokens / input_tokens * 100 if input_tokens else 0.0
+            logging.info(
+                f"Prompt cache hit rate of {benchmark_name}: {prompt_cache_hit_rate:.2f}% "
+                f"({cached_tokens} of {input_tokens} input tokens)"
+            )
+            error_rates[f"{benchmark_name}:prompt_cache_hit(%)"] = prompt_cache_hit_rate
+        all_scores.update(scores)
+        all_error_rates.update(error_rates)
+
+    for name, history in client.get_concurrency_history().items():
+        logging.info(f"Concurrency limit of {name}: {history[-1][1]}")
+
+    metrics = list(all_scores.keys())
+    columns = ["generation_model", "evaluation_model"] + metrics
+    row = [metadata["model_name"], client.model_name] + [all_scores[metric] for metric in metrics]
+    dashboard.log_table("score_table", columns=columns, data=[row])
+
+    header = list(all_error_rates.keys())
+    columns = ["generation_model", "evaluation_model"] + header
+    row = [metadata["model_name"], client.model_name] + [all_error_rates[key] for key in header]
+    dashboard.log_table("evaluate_error_rate_table", columns=columns, data=[row])
+
+    concurrency_history = client.get_concurrency_history()
+    if len(concurrency_history) > 0:
+        dashboard.log_table(
+            "concurrency_table",
+            columns=["endpoint", "elapsed(s)", "concurrency"],
+            data=[
+                [name, elapsed, limit] for name, history in concurrency_history.items() for elapsed, limit in history
+            ],
+        )
+
+    client.telemetry.log("evaluate", dashboard)
+
+
 @hydra.main(config_path="./config", config_name="evaluate")
 def main(cfg: DictConfig):
     logging.info("Loading metadata")
@@ -50,31 +135,38 @@ def main(cfg: DictConfig):
     logging.info(f"Loading client: {cfg.client.model_name}")
     client = load_client(**cfg.client)
 
-    all_scores, all_error_rates = {}, {}
-    for benchmark_name, data in raw_outputs.items():
-        logging.info(f"Evaluating benchmark: {benchmark_name}")
+    evaluators: dict[str, BaseEvaluator] = {}
+    checkpoints: list[Checkpoint] = []
+    for benchmark_name in raw_outputs:
         benchmark_cfg = cfg.benchmark[benchmark_name]
-        evaluator = load_evaluator(client, dashboard, metadata=metadata, **benchmark_cfg)
-        scores, error_rates = evaluator(data)
-        all_scores.update(scores)
-        all_error_rates.update(error_rates)
 
-    metrics = list(all_scores.keys())
-    columns = ["generation_model", "evaluation_model"] + metrics
-    row = [metadata["model_name"], cfg.client.model_name] + [all_scores[metric] for metric in metrics]
-    dashboard.log_table("score_table", columns=columns, data=[row])
+        checkpoint = None
+        if cfg.output.dir is not None:
+            checkpoint_path = os.path.join(cfg.output.dir, "checkpoint", f"{benchmark_name}.jsonl")
+            checkpoint = Checkpoint(checkpoint_path, resume=cfg.output.resume)
+            checkpoints.append(checkpoint)
 
-    header = list(all_error_rates.keys())
-    columns = ["generation_model", "evaluation_model"] + header
-    row = [metadata["model_name"], cfg.client.model_name] + [all_error_rates[key] for key in header]
-    dashboard.log_table("evaluate_error_rate_table", columns=columns, data=[row])
+        evaluators[benchmark_name] = load_evaluator(
+            client, dashboard, metadata=metadata, checkpoint=checkpoint, **benchmark_cfg
+        )
+
+    results = client.run_until_complete(evaluate_all(evaluators, raw_outputs))
+
+    log_results(dashboard, client, metadata, results)
 
     if cfg.output.dir is not None:
         logging.info(f"Saving evaluation results to {cfg.output.dir}")
         output_dir = hydra.utils.to_absolute_path(cfg.output.dir)
-        dashboard.save_json(output_dir)
+        dashboard.save(output_dir, table_format=cfg.output.table_format)
+        client.telemetry.save_prometheus(
+            os.path.join(output_dir, "metrics.prom"), labels={"stage": "evaluate", "model": client.model_name}
+        )
+
+    for checkpoint in checkpoints:
+        checkpoint.remove()
 
     dashboard.close()
+    client.close()
 
 
 if __name__ == "__main__":
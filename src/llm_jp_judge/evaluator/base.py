@@ -1,11 +1,25 @@
+import asyncio
 import json
 import logging
 import re
 from collections.abc import MutableMapping, Sequence
+from dataclasses import dataclass
+from typing import Any, Generic, TypeVar
 
 from ..client.base import BaseClient
 from ..dashboard.base import BaseDashboard
 from ..dataset import DatasetItem, DatasetItemForEvaluation
+from ..utils.checkpoint import Checkpoint
+
+
+T = TypeVar("T", bound=DatasetItemForEvaluation)
+
+PACKED_INSTRUCTION = (
+    "以下の{num_items}件の評価対象について、それぞれ独立に評価してください。"
+    "評価対象ごとに「### 評価対象{{番号}}」という見出しを記述し、その後に上記の形式で評価結果を記述してください。"
+)
+PACKED_HEADING = "### 評価対象{index}"
+PACKED_HEADING_PATTERN = re.compile(r"^#+\s*評価対象\s*(\d+)", re.MULTILINE)
 
 
 class BaseScoreExtractor:
@@ -21,7 +35,106 @@ class BaseScoreExtractor:
         return m.group(1)
 
 
+def get_prompt_prefix(template: str) -> str:
+    """Return the static part of a prompt template, i.e. the text before the first placeholder.
+
+    Works for both `str.format` and Jinja templates. The prefix is shared by all the judge prompts built from
+    the template, so it can be cached by the provider.
+    """
+    return template.partition("{")[0]
+
+
+def get_rubric(prompt_prefix: str) -> str:
+    """Return the prompt prefix up to its last blank line, leaving out the heading of the first placeholder."""
+    return prompt_prefix.rpartition("\n\n")[0]
+
+
+def pack_prompts(prompts: Sequence[str], rubric: str) -> str:
+    """Build one judge prompt for several items whose prompts start with `rubric`.
+
+    The rubric is written once, followed by an instruction to judge each item and one section per item.
+    """
+    sections = []
+    for index, prompt in enumerate(prompts, start=1):
+        if len(rubric) > 0 and prompt.startswith(rubric):
+            prompt = prompt[len(rubric) :]
+        sections.append(f"{PACKED_HEADING.format(index=index)}\n{prompt.strip()}")
+
+    instruction = PACKED_INSTRUCTION.format(num_items=len(prompts))
+    return "\n\n".join([rubric, instruction, *sections]).lstrip()
+
+
+def scale_max_tokens(sampling_params: MutableMapping | None, num_items: int) -> dict[str, Any]:
+    # まとめた件数分の評価結果を出力できるよう、最大トークン数を件数倍にする
+    sampling_params = dict(sampling_params or {})
+    for key in ["max_tokens", "max_completion_tokens"]:
+        if sampling_params.get(key) is not None:
+            sampling_params[key] *= num_items
+    return sampling_params
+
+
+class PackedScoreExtractor(BaseScoreExtractor):
+    """Extracts the scores of a packed judge prompt, written in one section per item.
+
+    Returns the patterns of the items whose scores could be extracted, keyed by their index in the pack.
+    Raises only if the score of the last item is missing, so that a streamed response is not stopped before
+    the judge reaches the last item. The other items without a score are judged again one by one.
+    """
+
+    def __init__(self, score_extractor: BaseScoreExtractor, num_items: int):
+        super().__init__(score_extractor.regex)
+        self.score_extractor = score_extractor
+        self.num_items = num_items
+
+    def split(self, text: str) -> dict[int, str]:
+        matches = list(PACKED_HEADING_PATTERN.finditer(text))
+        sections = {}
+        for i, m in enumerate(matches):
+            index = int(m.group(1)) - 1
+            end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+            if 0 <= index < self.num_items and index not in sections:
+                sections[index] = text[m.end() : end].strip()
+        return sections
+
+    def extract(self, text: str) -> dict[int, Any]:
+        patterns = {}
+        for index, section in self.split(text).items():
+            try:
+                patterns[index] = self.score_extractor(section)
+            except Exception:
+                continue
+        return patterns
+
+    def __call__(self, text: str) -> dict[int, Any]:  # type: ignore[override]
+        patterns = self.extract(text)
+        if self.num_items - 1 not in patterns:
+            raise ValueError("No score found for the last packed item")
+        return patterns
+
+
+@dataclass
+class JudgeRequest(Generic[T]):
+    """Evaluation items judged with the same score extractor, system prompt and sampling parameters.
+
+    `order` is the position of the request among those of the evaluator, used to keep the raw outputs in
+    the same order when the requests are built item by item. `prompt_prefix` is the static part of the
+    first prompt (e.g. the rubric), marked as cacheable when prompt caching is enabled on the client.
+    """
+
+    data: list[T]
+    score_extractor: BaseScoreExtractor | None = None
+    system_prompt: str | None = None
+    sampling_params: MutableMapping | None = None
+    order: int = 0
+    prompt_prefix: str | None = None
+
+
 class BaseEvaluator:
+    # 複数の応答をまとめた評価に対応するか。まとめる際の指示は日本語で記述されており、スコアは見出しごとに
+    # 抽出されるため、日本語の評価プロンプトで`[[3]]`のように区切られた形式のスコアを出力するものに限る
+    packable = False
+    pack_size = 1
+
     def __init__(
         self,
         client: BaseClient,
@@ -32,11 +145,15 @@ class BaseEvaluator:
         use_reference: bool = False,
         system_prompt: str | None = None,
         sampling_params: MutableMapping | None = None,
+        checkpoint: Checkpoint | None = None,
+        pack_size: int = 1,
     ):
         if metadata is None:
             metadata = {}
         if sampling_params is None:
             sampling_params = {}
+        if pack_size > 1 and not self.packable:
+            raise ValueError(f"Packing is not supported for {name}: pack_size={pack_size}")
 
         self.client = client
         self.dashboard = dashboard
@@ -46,6 +163,124 @@ class BaseEvaluator:
         self.use_reference = use_reference
         self.system_prompt = system_prompt
         self.sampling_params = sampling_params
+        self.checkpoint = checkpoint
+        self.pack_size = pack_size
+
+    async def request(
+        self,
+        data: Sequence[T],
+        score_extractor: BaseScoreExtractor | None = None,
+        system_prompt: str | None = None,
+        sampling_params: MutableMapping | None = None,
+        prompt_prefix: str | None = None,
+    ) -> Sequence[T]:
+        if self.checkpoint is None:
+            data = await self.client.acall(
+                data,
+                score_extractor=score_extractor,
+                system_prompt=system_prompt,
+                sampling_params=sampling_params,
+                prompt_prefix=prompt_prefix,
+            )
+        else:
+            pending_data = self.checkpoint.restore(data, require_pattern=score_extractor is not None)
+            await self.client.acall(
+                pending_data,
+                score_extractor=score_extractor,
+                system_prompt=system_prompt,
+                sampling_params=sampling_params,
+                callback=self.checkpoint.append,
+                prompt_prefix=prompt_prefix,
+            )
+
+        return data
+
+    async def send(self, judge_request: JudgeRequest[T]) -> Sequence[T]:
+        if self.pack_size > 1 and judge_request.score_extractor is not None and judge_request.prompt_prefix:
+            return await self.send_packed(judge_request)
+
+        return await self.request(
+            judge_request.data,
+            score_extractor=judge_request.score_extractor,
+            system_prompt=judge_request.system_prompt,
+            sampling_params=judge_request.sampling_params,
+            prompt_prefix=judge_request.prompt_prefix,
+        )
+
+    async def send_packed(self, judge_request: JudgeRequest[T]) -> Sequence[T]:
+        """Judge `pack_size` items per request, then judge one by one the items whose scores were not extracted."""
+        assert judge_request.score_extractor is not None and judge_request.prompt_prefix is not None
+
+        data = judge_request.data
+        if self.checkpoint is not None:
+            pending = self.checkpoint.restore(data, require_pattern=True)
+        else:
+            pending = list(data)
+
+        single_turn = [d for d in pending if len(d.prompt) == 1]
+        packs = [single_turn[i : i + self.pack_size] for i in range(0, len(single_turn), self.pack_size)]
+        packs = [pack for pack in packs if len(pack) > 1]
+        packed_ids = {id(d) for pack in packs for d in pack}
+        retry = [d for d in pending if id(d) not in packed_ids]
+
+        # 評価対象の件数ごとに抽出器が異なるため、件数ごとにまとめて送信する
+        rubric = get_rubric(judge_request.prompt_prefix)
+        packed_data: dict[int, list[DatasetItemForEvaluation]] = {}
+        for pack in packs:
+            prompt = pack_prompts([d.prompt[0] for d in pack], rubric)
+            packed = DatasetItemForEvaluation.model_construct(
+                ID=f"packed:{pack[0].ID}", prompt=[prompt], metric=pack[0].metric
+            )
+            packed_data.setdefault(len(pack), []).append(packed)
+
+        extractors = {size: PackedScoreExtractor(judge_request.score_extractor, size) for size in packed_data}
+        await asyncio.gather(
+            *(
+                self.client.acall(
+                    items,
+                    score_extractor=extractors[size],
+                    system_prompt=judge_request.system_prompt,
+                    sampling_params=scale_max_tokens(judge_request.sampling_params, size),
+                    prompt_prefix=rubric or None,
+                )
+                for size, items in packed_data.items()
+            )
+        )
+
+        packed_items = {size: iter(items) for size, items in packed_data.items()}
+        for pack in packs:
+            packed = next(packed_items[len(pack)])
+            response = packed.response[0] if len(packed.response) > 0 else None
+            sections = extractors[len(pack)].split(response) if response is not None else {}
+            patterns = extractors[len(pack)].extract(response) if response is not None else {}
+            for index, d in enumerate(pack):
+                if index not in patterns:
+                    retry.append(d)
+                    continue
+
+                d.response = [sections[index]]
+                d.pattern = [patterns[index]]
+                d.error_messages = [list(packed.error_messages[0])]
+                d.time_to_first_token = list(packed.time_to_first_token)
+                # まとめたリクエストの使用量は、各項目に均等に割り当てる
+                d.usage = [
+                    {key: round(value / len(pack)) for key, value in usage.items()} if usage is not None else None
+                    for usage in packed.usage
+                ]
+                if self.checkpoint is not None:
+                    self.checkpoint.append(d)
+
+        if len(retry) > 0:
+            logging.info(f"Judging {len(retry)} items individually")
+            await self.request(
+                retry,
+                score_extractor=judge_request.score_extractor,
+                system_prompt=judge_request.system_prompt,
+                sampling_params=judge_request.sampling_params,
+                prompt_prefix=judge_request.prompt_prefix,
+            )
+
+        return data
 
     def log_raw_outputs(self, raw_outputs: Sequence[DatasetItemForEvaluation]):
         if self.dashboard is None:
@@ -84,7 +319,27 @@ class BaseEvaluator:
         logging.info(f"API error rate: {api_error_rate:.2f}%")
         logging.info(f"Pattern match error rate: {regex_match_error_rate:.2f}%")
 
+        ttfts = [ttft for d in raw_outputs for ttft in d.time_to_first_token if ttft is not None]
+        if len(ttfts) > 0:
+            logging.info(f"Mean time to first token: {sum(ttfts) / len(ttfts):.2f}s")
+
         return api_error_rate, regex_match_error_rate
 
-    def __call__(self, responses: Sequence[DatasetItem]) -> tuple[dict[str, float | None], dict[str, float]]:
+    def build_requests(self, responses: Sequence[DatasetItem]) -> list[JudgeRequest]:
         raise NotImplementedError
+
+    def build_turn_requests(self, response: DatasetItem, turn: int) -> list[JudgeRequest]:
+        """Build the requests that can be sent once `turn` of `response` has been generated."""
+        if turn < len(response.prompt) - 1:
+            return []
+        return self.build_requests([response])
+
+    def aggregate(self, raw_outputs: Sequence[DatasetItemForEvaluation]) -> tuple[dict, dict[str, float]]:
+        raise NotImplementedError
+
+    async def aevaluate(self, responses: Sequence[DatasetItem]) -> tuple[dict[str, float | None], dict[str, float]]:
+        results = await asyncio.gather(*(self.send(r) for r in self.build_requests(responses)))
+        return self.aggregate([raw_output for raw_outputs in results for raw_output in raw_outputs])
+
+    def __call__(self, responses: Sequence[DatasetItem]) -> tuple[dict[str, float | None], dict[str, float]]:
+        return self.client.run_until_complete(self.aevaluate(responses))
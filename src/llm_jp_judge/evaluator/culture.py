@@ -3,16 +3,18 @@ from collections import defaultdict
 from collections.abc import Sequence
 
 from ..dataset.culture import CultureDatasetItem, CultureDatasetItemForEvaluation
-from .base import BaseEvaluator, BaseScoreExtractor
+from .base import BaseEvaluator, BaseScoreExtractor, JudgeRequest, get_prompt_prefix
 
 
 class CultureEvaluator(BaseEvaluator):
+    packable = True
+
     def __init__(self, *args, api_error_score: int | None = None, empty_response_score: int | None = None, **kwargs):
         self.api_error_score = api_error_score
         self.empty_response_score = empty_response_score
         super().__init__(*args, **kwargs)
 
-    def __call__(self, responses: Sequence[CultureDatasetItem]) -> tuple[dict[str, float | None], dict[str, float]]:  # type: ignore[override]
+    def build_requests(self, responses: Sequence[CultureDatasetItem]) -> list[JudgeRequest]:  # type: ignore[override]
         data: list[CultureDatasetItemForEvaluation] = []
         for res in responses:
             prompt = self.prompt_template["prompt_template"].format(
@@ -20,7 +22,7 @@ class CultureEvaluator(BaseEvaluator):
                 reference=res.reference,
                 response=res.response,
             )
-            d = CultureDatasetItemForEvaluation(
+            d = CultureDatasetItemForEvaluation.model_construct(
                 ID=res.ID,
                 prompt=[prompt],
                 reference=res.reference,
@@ -32,13 +34,19 @@ class CultureEvaluator(BaseEvaluator):
             data.append(d)
 
         score_extractor = BaseScoreExtractor(regex=self.prompt_template["regex"])
-        raw_outputs = self.client(
-            data,
-            score_extractor=score_extractor,
-            system_prompt=self.system_prompt,
-            sampling_params=self.sampling_params,
-        )
+        return [
+            JudgeRequest(
+                data,
+                score_extractor=score_extractor,
+                system_prompt=self.system_prompt,
+                sampling_params=self.sampling_params,
+                prompt_prefix=get_prompt_prefix(self.prompt_template["prompt_template"]),
+            )
+        ]
 
+    def aggregate(  # type: ignore[override]
+        self, raw_outputs: Sequence[CultureDatasetItemForEvaluation]
+    ) -> tuple[dict[str, float | None], dict[str, float]]:
         scores = defaultdict(list)
         for raw_output in raw_outputs:
             metric = raw_output.metric
@@ -7,8 +7,9 @@ from typing import MutableMapping, cast
 from ..client.base import BaseClient
 from ..dashboard.base import BaseDashboard
 from ..dataset.mt_bench import MTBenchDatasetItem, MTBenchDatasetItemForEvaluation
+from ..utils.checkpoint import Checkpoint
 from ..utils.data import load_jsonl
-from .base import BaseEvaluator, BaseScoreExtractor
+from .base import BaseEvaluator, BaseScoreExtractor, JudgeRequest, get_prompt_prefix
 
 
 class MTBenchEvaluator(BaseEvaluator):
@@ -22,6 +23,7 @@ class MTBenchEvaluator(BaseEvaluator):
         mode: str = "single",
         sampling_params: MutableMapping | None = None,
         reference: MutableMapping | None = None,
+        checkpoint: Checkpoint | None = None,
         **kwargs,
     ):
         if metadata is None:
@@ -53,6 +55,7 @@ class MTBenchEvaluator(BaseEvaluator):
             self.reference_categories = reference["categories"]
 
         self.sampling_params = sampling_params
+        self.checkpoint = checkpoint
 
     def conv_to_query(
         self, response: MTBenchDatasetItem, use_reference: bool = False, multi_turn: bool = False
@@ -89,7 +92,7 @@ class MTBenchEvaluator(BaseEvaluator):
         prompt = prompt_template.format(**kwargs)
         system_prompt = self.prompt_template[metric]["system_prompt"]
 
-        query = MTBenchDatasetItemForEvaluation(
+        query = MTBenchDatasetItemForEvaluation.model_construct(
             ID=response.ID,
             prompt=[prompt],
             category=response.category,
@@ -182,14 +185,14 @@ class MTBenchEvaluator(BaseEvaluator):
         ]
         self.dashboard.log_table(f"{self.name}_raw_output_table", columns=columns, data=data)
 
-    def evaluate(
+    def build_request(
         self,
         responses: Sequence[MTBenchDatasetItem],
         use_reference: bool = False,
         multi_turn: bool = False,
-    ) -> Sequence[MTBenchDatasetItemForEvaluation]:
+    ) -> JudgeRequest | None:
         if len(responses) == 0:
-            return []
+            return None
 
         queries: list[MTBenchDatasetItemForEvaluation] = []
         for response in responses:
@@ -199,27 +202,40 @@ class MTBenchEvaluator(BaseEvaluator):
         metric = queries[-1].metric
         assert metric is not None
         score_extractor = BaseScoreExtractor(regex=self.prompt_template[metric]["regex"])
-        client_responses = self.client(
+        return JudgeRequest(
             queries,
             score_extractor=score_extractor,
             system_prompt=self.prompt_template[metric]["system_prompt"],
             sampling_params=self.sampling_params,
+            order=int(multi_turn) * 2 + int(use_reference),
+            prompt_prefix=get_prompt_prefix(self.prompt_template[metric]["prompt_template"]),
         )
-        return client_responses
 
-    def __call__(self, responses: Sequence[MTBenchDatasetItem]) -> tuple[dict[str, float], dict[str, float]]:  # type: ignore[override]
+    def build_requests(self, responses: Sequence[MTBenchDatasetItem]) -> list[JudgeRequest]:  # type: ignore[override]
         questions_ref = [r for r in responses if r.category in self.reference_categories]
         questions = [r for r in responses if r.category not in self.reference_categories]
 
-        raw_outputs: list[MTBenchDatasetItemForEvaluation] = []
-        # Single-turn evaluation
-        raw_outputs += self.evaluate(questions, use_reference=False, multi_turn=False)
-        raw_outputs += self.evaluate(questions_ref, use_reference=True, multi_turn=False)
-
-        # Multi-turn evaluation
-        raw_outputs += self.evaluate(questions, use_reference=False, multi_turn=True)
-        raw_outputs += self.evaluate(questions_ref, use_reference=True, multi_turn=True)
-
+        # Single-turn and multi-turn evaluation, with and without reference
+        requests = [
+            self.build_request(questions, use_reference=False, multi_turn=False),
+            self.build_request(questions_ref, use_reference=True, multi_turn=False),
+            self.build_request(questions, use_reference=False, multi_turn=True),
+            self.build_request(questions_ref, use_reference=True, multi_turn=True),
+        ]
+        return [request for request in requests if request is not None]
+
+    def build_turn_requests(  # type: ignore[override]
+        self, response: MTBenchDatasetItem, turn: int
+    ) -> list[JudgeRequest]:
+        # 1ターン目の評価は、2ターン目の生成を待たずに開始できる
+        use_reference = response.category in self.reference_categories
+        request = self.build_request([response], use_reference=use_reference, multi_turn=turn > 0)
+        assert request is not None
+        return [request]
+
+    def aggregate(  # type: ignore[override]
+        self, raw_outputs: Sequence[MTBenchDatasetItemForEvaluation]
+    ) -> tuple[dict[str, float], dict[str, float]]:
         self.log_raw_outputs(raw_outputs)
 
         error_rates = {}
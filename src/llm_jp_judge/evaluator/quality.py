@@ -5,7 +5,7 @@ from collections import defaultdict
 from collections.abc import Sequence
 
 from ..dataset.quality import QualityDatasetItem, QualityDatasetItemForEvaluation
-from .base import BaseEvaluator, BaseScoreExtractor
+from .base import BaseEvaluator, BaseScoreExtractor, JudgeRequest, get_prompt_prefix
 
 
 class QualityScoreExtractor(BaseScoreExtractor):
@@ -27,6 +27,8 @@ class QualityScoreExtractor(BaseScoreExtractor):
 
 
 class QualityEvaluator(BaseEvaluator):
+    packable = True
+
     def log_raw_outputs(self, raw_outputs: Sequence[QualityDatasetItemForEvaluation]):  # type: ignore[override]
         if self.dashboard is None:
             return
@@ -60,10 +62,10 @@ class QualityEvaluator(BaseEvaluator):
             )
         self.dashboard.log_table(f"{self.name}_raw_output_table", columns=header, data=table)
 
-    def __call__(self, responses: Sequence[QualityDatasetItem]) -> tuple[dict[str, float | None], dict[str, float]]:  # type: ignore[override]
+    def build_requests(self, responses: Sequence[QualityDatasetItem]) -> list[JudgeRequest]:  # type: ignore[override]
         data: list[QualityDatasetItemForEvaluation] = []
         for res in responses:
-            d = QualityDatasetItemForEvaluation(
+            d = QualityDatasetItemForEvaluation.model_construct(
                 ID=res.ID,
                 prompt=[self.prompt_template["prompt_template"].format(question=res.prompt, response=res.response)],
                 text=res.text,
@@ -74,13 +76,19 @@ class QualityEvaluator(BaseEvaluator):
             data.append(d)
 
         score_extractor = QualityScoreExtractor(self.prompt_template["regex"], self.prompt_template["metrics"])
-        raw_outputs = self.client(
-            data,
-            score_extractor=score_extractor,
-            system_prompt=self.system_prompt,
-            sampling_params=self.sampling_params,
-        )
+        return [
+            JudgeRequest(
+                data,
+                score_extractor=score_extractor,
+                system_prompt=self.system_prompt,
+                sampling_params=self.sampling_params,
+                prompt_prefix=get_prompt_prefix(self.prompt_template["prompt_template"]),
+            )
+        ]
 
+    def aggregate(  # type: ignore[override]
+        self, raw_outputs: Sequence[QualityDatasetItemForEvaluation]
+    ) -> tuple[dict[str, float | None], dict[str, float]]:
         scores = defaultdict(list)
         for raw_output in raw_outputs:
             if raw_output.pattern[0] is None:
@@ -3,15 +3,17 @@ from collections import defaultdict
 from collections.abc import Sequence
 
 from ..dataset.safety import SafetyDatasetItem, SafetyDatasetItemForEvaluation
-from .base import BaseEvaluator, BaseScoreExtractor
+from .base import BaseEvaluator, BaseScoreExtractor, JudgeRequest, get_prompt_prefix
 
 
 class SafetyEvaluator(BaseEvaluator):
+    packable = True
+
     def __init__(self, *args, api_error_score: int | None = None, **kwargs):
         self.api_error_score = api_error_score
         super().__init__(*args, **kwargs)
 
-    def __call__(self, responses: Sequence[SafetyDatasetItem]) -> tuple[dict[str, float | None], dict[str, float]]:  # type: ignore[override]
+    def build_requests(self, responses: Sequence[SafetyDatasetItem]) -> list[JudgeRequest]:  # type: ignore[override]
         data: list[SafetyDatasetItemForEvaluation] = []
         for res in responses:
             if self.use_reference:
@@ -23,7 +25,7 @@ class SafetyEvaluator(BaseEvaluator):
                     question=res.prompt, response=res.response
                 )
 
-            d = SafetyDatasetItemForEvaluation(
+            d = SafetyDatasetItemForEvaluation.model_construct(
                 ID=res.ID,
                 prompt=[prompt],
                 text=res.text,
@@ -36,13 +38,20 @@ class SafetyEvaluator(BaseEvaluator):
             data.append(d)
 
         score_extractor = BaseScoreExtractor(regex=self.prompt_template["regex"])
-        raw_outputs = self.client(
-            data,
-            score_extractor=score_extractor,
-            system_prompt=self.system_prompt,
-            sampling_params=self.sampling_params,
-        )
+        template_key = "prompt_template_with_ref" if self.use_reference else "prompt_template_wo_ref"
+        return [
+            JudgeRequest(
+                data,
+                score_extractor=score_extractor,
+                system_prompt=self.system_prompt,
+                sampling_params=self.sampling_params,
+                prompt_prefix=get_prompt_prefix(self.prompt_template[template_key]),
+            )
+        ]
 
+    def aggregate(  # type: ignore[override]
+        self, raw_outputs: Sequence[SafetyDatasetItemForEvaluation]
+    ) -> tuple[dict[str, float | None], dict[str, float]]:
         scores = defaultdict(list)
         for raw_output in raw_outputs:
             metric = raw_output.metric
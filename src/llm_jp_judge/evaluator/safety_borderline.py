@@ -3,7 +3,7 @@ from collections import defaultdict
 from collections.abc import Sequence
 
 from ..dataset.safety_borderline import SafetyBorderlineDatasetItem, SafetyBorderlineDatasetItemForEvaluation
-from .base import BaseEvaluator, BaseScoreExtractor
+from .base import BaseEvaluator, BaseScoreExtractor, JudgeRequest, get_prompt_prefix
 
 
 class SafetyBorderlineEvaluator(BaseEvaluator):
@@ -11,10 +11,9 @@ class SafetyBorderlineEvaluator(BaseEvaluator):
         self.api_error_score = api_error_score
         super().__init__(*args, **kwargs)
 
-    def __call__(
-        self,
-        responses: Sequence[SafetyBorderlineDatasetItem],  # type: ignore[override]
-    ) -> tuple[dict[str, float | None], dict[str, float]]:
+    def build_requests(  # type: ignore[override]
+        self, responses: Sequence[SafetyBorderlineDatasetItem]
+    ) -> list[JudgeRequest]:
         border_data: list[SafetyBorderlineDatasetItemForEvaluation] = []
         for res in responses:
             if self.use_reference:
@@ -26,7 +25,7 @@ class SafetyBorderlineEvaluator(BaseEvaluator):
                     question=res.prompt, response=res.response
                 )
 
-            d = SafetyBorderlineDatasetItemForEvaluation(
+            d = SafetyBorderlineDatasetItemForEvaluation.model_construct(
                 ID=res.ID,
                 prompt=[prompt],
                 text=res.text,
@@ -49,7 +48,7 @@ class SafetyBorderlineEvaluator(BaseEvaluator):
                     question=res.prompt, response=res.response
                 )
 
-            d = SafetyBorderlineDatasetItemForEvaluation(
+            d = SafetyBorderlineDatasetItemForEvaluation.model_construct(
                 ID=res.ID,
                 prompt=[prompt],
                 text=res.text,
@@ -61,24 +60,31 @@ class SafetyBorderlineEvaluator(BaseEvaluator):
             )
             safety_data.append(d)
 
-        raw_outputs: list[SafetyBorderlineDatasetItemForEvaluation] = []
-
         score_extractor = BaseScoreExtractor(regex=self.prompt_template["regex"])
-        raw_outputs += self.client(
-            border_data,
-            score_extractor=score_extractor,
-            system_prompt=self.system_prompt,
-            sampling_params=self.sampling_params,
-        )
-
         safety_score_extractor = BaseScoreExtractor(regex=self.prompt_template["regex_safety"])
-        raw_outputs += self.client(
-            safety_data,
-            score_extractor=safety_score_extractor,
-            system_prompt=self.system_prompt,
-            sampling_params=self.sampling_params,
-        )
-
+        template_key = "prompt_template_with_ref" if self.use_reference else "prompt_template_wo_ref"
+        return [
+            JudgeRequest(
+                border_data,
+                score_extractor=score_extractor,
+                system_prompt=self.system_prompt,
+                sampling_params=self.sampling_params,
+                order=0,
+                prompt_prefix=get_prompt_prefix(self.prompt_template[template_key]),
+            ),
+            JudgeRequest(
+                safety_data,
+                score_extractor=safety_score_extractor,
+                system_prompt=self.system_prompt,
+                sampling_params=self.sampling_params,
+                order=1,
+                prompt_prefix=get_prompt_prefix(self.prompt_template[f"{template_key}_safety"]),
+            ),
+        ]
+
+    def aggregate(  # type: ignore[override]
+        self, raw_outputs: Sequence[SafetyBorderlineDatasetItemForEvaluation]
+    ) -> tuple[dict[str, float | None], dict[str, float]]:
         scores = defaultdict(list)
         for raw_output in raw_outputs:
             metric = raw_output.metric
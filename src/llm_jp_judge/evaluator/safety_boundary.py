@@ -6,7 +6,7 @@ from jinja2 import Template
 
 from ..dataset.safety_boundary import SafetyBoundaryDatasetItem, SafetyBoundaryDatasetItemForEvaluation
 from ..utils.data import load_file
-from .base import BaseEvaluator, BaseScoreExtractor
+from .base import BaseEvaluator, BaseScoreExtractor, JudgeRequest, get_prompt_prefix
 
 
 class SafetyBoundaryEvaluator(BaseEvaluator):
@@ -26,10 +26,9 @@ class SafetyBoundaryEvaluator(BaseEvaluator):
         self.prompt = load_file(self.prompt_template["path"])
         assert isinstance(self.prompt, str)
 
-    def __call__(
-        self,
-        responses: Sequence[SafetyBoundaryDatasetItem],  # type: ignore[override]
-    ) -> tuple[dict[str, float | None], dict[str, float]]:
+    def build_requests(  # type: ignore[override]
+        self, responses: Sequence[SafetyBoundaryDatasetItem]
+    ) -> list[JudgeRequest]:
         data: list[SafetyBoundaryDatasetItemForEvaluation] = []
         for res in responses:
             template = Template(self.prompt)
@@ -41,7 +40,7 @@ class SafetyBoundaryEvaluator(BaseEvaluator):
                 ng_aspect=res.ng_aspect,
             )
 
-            d = SafetyBoundaryDatasetItemForEvaluation(
+            d = SafetyBoundaryDatasetItemForEvaluation.model_construct(
                 ID=res.ID,
                 prompt=[prompt],
                 text=res.text,
@@ -57,13 +56,19 @@ class SafetyBoundaryEvaluator(BaseEvaluator):
             data.append(d)
 
         score_extractor = BaseScoreExtractor(regex=self.prompt_template["regex"])
-        raw_outputs = self.client(
-            data,
-            score_extractor=score_extractor,
-            system_prompt=self.system_prompt,
-            sampling_params=self.sampling_params,
-        )
+        return [
+            JudgeRequest(
+                data,
+                score_extractor=score_extractor,
+                system_prompt=self.system_prompt,
+                sampling_params=self.sampling_params,
+                prompt_prefix=get_prompt_prefix(self.prompt),
+            )
+        ]
 
+    def aggregate(  # type: ignore[override]
+        self, raw_outputs: Sequence[SafetyBoundaryDatasetItemForEvaluation]
+    ) -> tuple[dict[str, float | None], dict[str, float]]:
         scores = defaultdict(list)
         safe_scores = defaultdict(list)
         unsafe_scores = defaultdict(list)
@@ -1,83 +1,119 @@
+import asyncio
 import logging
 import os
-from collections import defaultdict
-from typing import Sequence
+from collections.abc import Callable, Iterator, Sequence
+from typing import Any
 
 import hydra
 from omegaconf import DictConfig, OmegaConf
 
 from .client import load_client
 from .client.base import BaseClient
+from .client.scheduler import current_flow
 from .dataset import DatasetItem
 from .dataset.mt_bench import MTBenchDatasetItem
 from .dataset.utils import load_dataset
-from .utils.data import save_json, save_jsonl
+from .utils.checkpoint import Checkpoint
+from .utils.data import save_json, save_jsonl, save_parquet
 
 
-def generate(cfg: DictConfig, client: BaseClient, benchmark_cfg: DictConfig):
-    output_dir = hydra.utils.to_absolute_path(cfg.output.dir)
+OUTPUT_FORMATS = ["jsonl", "parquet"]
+
+
+async def generate(
+    cfg: DictConfig,
+    client: BaseClient,
+    benchmark_cfg: DictConfig,
+    output_dir: str | None = None,
+    callback: Callable[[DatasetItem], Any] | None = None,
+    turn_callback: Callable[[DatasetItem, int], Any] | None = None,
+) -> Sequence[DatasetItem] | None:
+    """Generate responses for a benchmark and save them to `{output_dir}/{name}.{output.format}`.
+
+    `callback` is called with every completed item, including those restored from the checkpoint, and
+    `turn_callback` with every item whose turn has been generated. Returns None if the output exists.
+    """
+    # リクエストをベンチマークごとのフローとしてスケジューラに登録し、ベンチマーク間で公平に処理する
+    current_flow.set(benchmark_cfg.name)
+
+    output_dir = hydra.utils.to_absolute_path(output_dir or cfg.output.dir)
     os.makedirs(output_dir, exist_ok=True)
-    output_path = os.path.join(output_dir, f"{benchmark_cfg.name}.jsonl")
+    output_format = cfg.output.format
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Invalid output format: {output_format}")
+    output_path = os.path.join(output_dir, f"{benchmark_cfg.name}.{output_format}")
 
     if not cfg.output.overwrite and os.path.exists(output_path):
         logging.info(f"Skipping generate for {benchmark_cfg.name} as output exists")
-        return
+        return None
 
-    logging.info(f"Loading dataset: {benchmark_cfg.name}")
-    data = load_dataset(benchmark_cfg.name, benchmark_cfg.dataset.path, benchmark_cfg.dataset.size)
+    checkpoint_path = os.path.join(output_dir, "checkpoint", f"{benchmark_cfg.name}.jsonl")
+    checkpoint = Checkpoint(checkpoint_path, resume=cfg.output.resume)
 
-    responses: Sequence[DatasetItem]
+    sampling_params = OmegaConf.to_container(benchmark_cfg.sampling_params, resolve=True)
+    assert isinstance(sampling_params, dict)
+    category_sampling_params: dict | None = None
     if (
         "category_sampling_params" in benchmark_cfg
     ):  # データカテゴリー毎にサンプリングパラメータを設定する場合: MT-Bench用
-        category_sampling_params = OmegaConf.to_container(benchmark_cfg.category_sampling_params, resolve=True)
-        assert isinstance(category_sampling_params, dict)
-
-        categorized_data: dict[str, list[DatasetItem]] = defaultdict(list)
-        for i, d in enumerate(data):
-            assert isinstance(d, MTBenchDatasetItem)
-            d.original_index = i
-            categorized_data[d.category].append(d)
-
-        responses = []
-        for category, category_data in categorized_data.items():
-            sampling_params = OmegaConf.to_container(benchmark_cfg.sampling_params, resolve=True)
-            assert isinstance(sampling_params, dict)
-            sampling_params.update(category_sampling_params.get(category, {}))
-
-            logging.info(f"Running generate on {len(category_data)} samples in category: {category}")
-            responses += client(
-                category_data,
-                system_prompt=benchmark_cfg.system_prompt,
-                sampling_params=sampling_params,
-            )
-
-        def sort_key(x: DatasetItem) -> int:
-            assert x.original_index is not None
-            return x.original_index
-
-        responses = sorted(responses, key=sort_key)
-        for res in responses:
-            res.original_index = None
+        params = OmegaConf.to_container(benchmark_cfg.category_sampling_params, resolve=True)
+        assert isinstance(params, dict)
+        category_sampling_params = params
+
+    data: list[DatasetItem] = []
+
+    def load_pending() -> Iterator[DatasetItem]:
+        # データセットを読み込みながら、チェックポイントにない項目を順に送信する
+        for d in load_dataset(benchmark_cfg.name, benchmark_cfg.dataset.path, benchmark_cfg.dataset.size):
+            if category_sampling_params is not None:
+                # カテゴリーごとのパラメータを各項目に持たせ、すべてのカテゴリーを一度に生成する
+                assert isinstance(d, MTBenchDatasetItem)
+                d.sampling_params = category_sampling_params.get(d.category)
+
+            data.append(d)
+            if checkpoint.restore_item(d):
+                if callback is not None:
+                    callback(d)
+                continue
+            yield d
+
+    def on_complete(d: DatasetItem):
+        checkpoint.append(d)
+        if callback is not None:
+            callback(d)
+
+    logging.info(f"Running generate on benchmark: {benchmark_cfg.name}")
+    pending_data = await client.acall(
+        load_pending(),
+        system_prompt=benchmark_cfg.system_prompt,
+        sampling_params=sampling_params,
+        callback=on_complete,
+        turn_callback=turn_callback,
+    )
+    if len(pending_data) < len(data):
+        logging.info(f"Restored {len(data) - len(pending_data)} items of {benchmark_cfg.name} from checkpoint")
+
+    success = [all(response_text is not None for response_text in res.response) for res in data]
+    success_rate = sum(success) / len(success) * 100
+    logging.info(f"Inference success rate of {benchmark_cfg.name}: {success_rate:.2f}%")
 
+    logging.info(f"Saving responses to {output_path}")
+    if output_format == "parquet":
+        save_parquet(output_path, data, exclude={"original_index", "sampling_params"})
     else:
-        logging.info(f"Running generate on {len(data)} samples")
-        responses = client(
-            data,
-            system_prompt=benchmark_cfg.system_prompt,
-            sampling_params=benchmark_cfg.sampling_params,
-        )
+        save_jsonl(output_path, data, exclude={"original_index", "sampling_params"})
+    checkpoint.remove()
 
-    success = [all(response_text is not None for response_text in res.response) for res in responses]
-    success_rate = sum(success) / len(success) * 100
-    logging.info(f"Inference success rate: {success_rate:.2f}%")
+    return data
 
-    logging.info(f"Saving responses to {output_path}")
-    save_jsonl(output_path, (res.model_dump(exclude={"original_index"}) for res in responses))
 
+async def generate_all(cfg: DictConfig, client: BaseClient, benchmark_cfgs: Sequence[DictConfig]):
+    # すべてのベンチマークの生成リクエストを同じイベントループで並行に処理する
+    await asyncio.gather(*(generate(cfg, client, benchmark_cfg) for benchmark_cfg in benchmark_cfgs))
 
-def save_metadata(cfg: DictConfig):
-    output_dir = hydra.utils.to_absolute_path(cfg.output.dir)
+
+def save_metadata(cfg: DictConfig, output_dir: str | None = None):
+    output_dir = hydra.utils.to_absolute_path(output_dir or cfg.output.dir)
     os.makedirs(output_dir, exist_ok=True)
     output_path = os.path.join(output_dir, "metadata.json")
 
@@ -98,15 +134,28 @@ def main(cfg: DictConfig):
     logging.info(f"Loading client: {cfg.client.model_name}")
     client = load_client(**cfg.client)
 
-    for benchmark_cfg in cfg.benchmark.values():
-        if not benchmark_cfg.dataset.path:
-            continue
+    benchmark_cfgs = [benchmark_cfg for benchmark_cfg in cfg.benchmark.values() if benchmark_cfg.dataset.path]
+    client.run_until_complete(generate_all(cfg, client, benchmark_cfgs))
 
-        logging.info(f"Running generate on benchmark: {benchmark_cfg.name}")
-        generate(cfg, client, benchmark_cfg)
+    for name, history in client.get_concurrency_history().items():
+        logging.info(f"Concurrency limit of {name}: {history[-1][1]}")
+
+    output_dir = hydra.utils.to_absolute_path(cfg.output.dir)
+    client.telemetry.log("generate")
+    client.telemetry.save_prometheus(
+        os.path.join(output_dir, "metrics.prom"), labels={"stage": "generate", "model": client.model_name}
+    )
+    throughput = client.telemetry.throughput()
+    if len(throughput) > 0:
+        save_json(
+            os.path.join(output_dir, "throughput_table.json"),
+            [{"benchmark": flow, **values} for flow, values in throughput.items()],
+        )
 
     save_metadata(cfg)
 
+    client.close()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,277 @@
+import asyncio
+import json
+import logging
+import math
+import random
+import re
+import time
+from collections import Counter
+from collections.abc import Mapping, Sequence
+from typing import Any, cast
+
+import hydra
+from omegaconf import DictConfig, OmegaConf
+
+from .client.scheduler import estimate_tokens
+
+
+LATENCY_DISTRIBUTIONS = ["constant", "uniform", "normal", "exponential", "lognormal"]
+DEFAULT_RESPONSE = "[[{score}]]"
+STATUS_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    502: "Bad Gateway",
+    503: "Service Unavailable",
+}
+
+
+class MockServer:
+    """OpenAI-compatible chat-completions server returning canned responses, for offline load tests.
+
+    Every request waits for a latency drawn from `latency_distribution` (the time to the first token), and
+    the response is then sent at `tokens_per_second` (streamed if requested). Rate limits (429), timeouts
+    (the connection is dropped after `timeout_seconds`) and bad requests (400) are injected at the given
+    rates. The response is the `content` of the first of `responses` whose `pattern` matches the system
+    message or the last user message, where `{score}` is replaced by a random score in `score_range`.
+    """
+
+    def __init__(
+        self,
+        latency_distribution: str = "constant",
+        latency_mean: float = 0.5,
+        latency_std: float = 0.0,
+        tokens_per_second: float | None = None,
+        rate_limit_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        bad_request_rate: float = 0.0,
+        retry_after: float = 1.0,
+        timeout_seconds: float = 30.0,
+        responses: Sequence[Mapping[str, str | None]] = (),
+        score_range: Sequence[int] = (1, 3),
+        reasoning_length: int = 0,
+        seed: int | None = None,
+    ):
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Invalid latency distribution: {latency_distribution}")
+
+        self.latency_distribution = latency_distribution
+        self.latency_mean = latency_mean
+        self.latency_std = latency_std
+        self.tokens_per_second = tokens_per_second
+        self.rate_limit_rate = rate_limit_rate
+        self.timeout_rate = timeout_rate
+        self.bad_request_rate = bad_request_rate
+        self.retry_after = retry_after
+        self.timeout_seconds = timeout_seconds
+        self.responses: list[tuple[re.Pattern[str] | None, str]] = []
+        for r in responses:
+            pattern = r.get("pattern")
+            self.responses.append((re.compile(pattern) if pattern else None, r.get("content") or ""))
+        self.score_range = score_range
+        self.reasoning_length = reasoning_length
+        self.random = random.Random(seed)
+
+        self.stats: Counter[str] = Counter()
+        self.in_flight = 0
+
+    def sample_latency(self) -> float:
+        mean, std = self.latency_mean, self.latency_std
+        if self.latency_distribution == "uniform":
+            width = std * math.sqrt(3)
+            latency = self.random.uniform(mean - width, mean + width)
+        elif self.latency_distribution == "normal":
+            latency = self.random.gauss(mean, std)
+        elif self.latency_distribution == "exponential":
+            latency = self.random.expovariate(1 / mean) if mean > 0 else 0.0
+        elif self.latency_distribution == "lognormal" and mean > 0:
+            sigma2 = math.log(1 + (std / mean) ** 2)
+            latency = self.random.lognormvariate(math.log(mean) - sigma2 / 2, math.sqrt(sigma2))
+        else:
+            latency = mean
+        return max(latency, 0.0)
+
+    def get_text(self, messages: Sequence[Mapping[str, Any]], role: str) -> str:
+        text = next((m["content"] for m in reversed(messages) if m.get("role") == role), "")
+        if not isinstance(text, str):
+            # 内容がブロックのリストで与えられた場合は結合する
+            text = "".join(block.get("text", "") for block in text)
+        return text
+
+    def get_content(self, messages: Sequence[Mapping[str, Any]]) -> str:
+        # マルチターンの評価などでは評価の指示がシステムプロンプトに含まれるため、両方を照合する
+        prompt = self.get_text(messages, "system") + "\n" + self.get_text(messages, "user")
+
+        content = DEFAULT_RESPONSE
+        for pattern, response in self.responses:
+            if pattern is None or pattern.search(prompt):
+                content = response
+                break
+
+        # スコアが応答の末尾に出力される場合を模擬するため、評価理由を先頭に付加する
+        reasoning = "評価理由。" * (self.reasoning_length // 5)
+        score = self.random.randint(self.score_range[0], self.score_range[1])
+        return reasoning + content.replace("{score}", str(score))
+
+    def get_usage(self, messages: Sequence[Mapping[str, Any]], content: str) -> dict[str, Any]:
+        prompt_tokens = estimate_tokens([m.get("content") for m in messages if isinstance(m.get("content"), str)])
+        completion_tokens = estimate_tokens([content])
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        }
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.stats["connections"] += 1
+        try:
+            while True:
+                header = await reader.readuntil(b"\r\n\r\n")
+                lines = header.decode("latin-1").split("\r\n")
+                method, path, _ = lines[0].split(" ", 2)
+                length = 0
+                for line in lines[1:]:
+                    if line.lower().startswith("content-length:"):
+                        length = int(line.split(":", 1)[1])
+                body = await reader.readexactly(length)
+
+                if method == "GET" and path.startswith("/stats"):
+                    await self.send_json(writer, 200, {**self.stats, "in_flight": self.in_flight})
+                elif method == "POST" and path.split("?")[0].endswith("/chat/completions"):
+                    if not await self.handle_chat_completions(writer, json.loads(body)):
+                        break
+                else:
+                    await self.send_json(writer, 404, {"error": {"message": f"Not found: {path}"}})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_chat_completions(self, writer: asyncio.StreamWriter, request: dict[str, Any]) -> bool:
+        """Answer a chat-completions request. Returns False if the connection has to be dropped."""
+        self.stats["requests"] += 1
+        self.in_flight += 1
+        self.stats["peak_concurrency"] = max(self.stats["peak_concurrency"], self.in_flight)
+        try:
+            r = self.random.random()
+            if r < self.rate_limit_rate:
+                self.stats["rate_limit_errors"] += 1
+                headers = {
+                    "retry-after": f"{self.retry_after:g}",
+                    "x-ratelimit-remaining-requests": "0",
+                    "x-ratelimit-reset-requests": f"{self.retry_after:g}s",
+                }
+                error: dict[str, Any] = {
+                    "message": "Rate limit exceeded",
+                    "type": "requests",
+                    "code": "rate_limit_exceeded",
+                }
+                await self.send_json(writer, 429, {"error": error}, headers=headers)
+                return True
+            r -= self.rate_limit_rate
+            if r < self.timeout_rate:
+                self.stats["timeout_errors"] += 1
+                await asyncio.sleep(self.timeout_seconds)
+                return False
+            r -= self.timeout_rate
+            if r < self.bad_request_rate:
+                self.stats["bad_request_errors"] += 1
+                error = {"message": "Injected bad request", "type": "invalid_request_error", "code": None}
+                await self.send_json(writer, 400, {"error": error})
+                return True
+
+            await asyncio.sleep(self.sample_latency())
+            messages = request.get("messages", [])
+            content = self.get_content(messages)
+            usage = self.get_usage(messages, content)
+            if request.get("stream", False):
+                include_usage = (request.get("stream_options") or {}).get("include_usage", False)
+                await self.send_stream(writer, request.get("model", "mock"), content, usage if include_usage else None)
+            else:
+                if self.tokens_per_second:
+                    await asyncio.sleep(usage["completion_tokens"] / self.tokens_per_second)
+                completion = {
+                    "id": f"chatcmpl-mock-{self.stats['requests']}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "mock"),
+                    "choices": [
+                        {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                    ],
+                    "usage": usage,
+                }
+                await self.send_json(writer, 200, completion)
+            self.stats["completed"] += 1
+            return True
+        finally:
+            self.in_flight -= 1
+
+    async def send_json(
+        self,
+        writer: asyncio.StreamWriter,
+        status: int,
+        body: Mapping[str, Any],
+        headers: Mapping[str, str] | None = None,
+    ):
+        data = json.dumps(body, ensure_ascii=False).encode()
+        head = f"HTTP/1.1 {status} {STATUS_REASONS.get(status, '')}\r\nContent-Type: application/json\r\n"
+        for key, value in (headers or {}).items():
+            head += f"{key}: {value}\r\n"
+        writer.write(f"{head}Content-Length: {len(data)}\r\n\r\n".encode() + data)
+        await writer.drain()
+
+    async def send_stream(
+        self, writer: asyncio.StreamWriter, model: str, content: str, usage: dict[str, Any] | None = None
+    ):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+
+        def event(choices: list[dict[str, Any]], usage: dict[str, Any] | None = None) -> bytes:
+            chunk = {
+                "id": f"chatcmpl-mock-{self.stats['requests']}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": choices,
+                "usage": usage,
+            }
+            data = f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode()
+            return f"{len(data):x}\r\n".encode() + data + b"\r\n"
+
+        # 4文字ずつチャンクとして送信し、各チャンクの推定トークン数に応じて tokens_per_second の速度になるよう待機する
+        pieces = [content[i : i + 4] for i in range(0, len(content), 4)] or [""]
+        for i, piece in enumerate(pieces):
+            finish_reason = "stop" if i == len(pieces) - 1 else None
+            writer.write(event([{"index": 0, "delta": {"content": piece}, "finish_reason": finish_reason}]))
+            await writer.drain()
+            if self.tokens_per_second:
+                await asyncio.sleep(estimate_tokens([piece]) / self.tokens_per_second)
+        if usage is not None:
+            writer.write(event([], usage=usage))
+        done = b"data: [DONE]\n\n"
+        writer.write(f"{len(done):x}\r\n".encode() + done + b"\r\n0\r\n\r\n")
+        await writer.drain()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> asyncio.Server:
+        return await asyncio.start_server(self.handle, host, port, backlog=4096)
+
+
+async def serve(server: MockServer, host: str, port: int):
+    async with await server.start(host, port) as s:
+        logging.info(f"Mock server listening on http://{host}:{s.sockets[0].getsockname()[1]}/v1")
+        await s.serve_forever()
+
+
+@hydra.main(config_path="./config", config_name="mock_server")
+def main(cfg: DictConfig):
+    kwargs = cast(dict[str, Any], OmegaConf.to_container(cfg.server, resolve=True))
+    try:
+        asyncio.run(serve(MockServer(**kwargs), cfg.host, cfg.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import os
+from collections.abc import Sequence
+
+import hydra
+from omegaconf import DictConfig
+
+from .client import load_client
+from .client.base import BaseClient
+from .dashboard import load_dashboard
+from .dataset import DatasetItem, DatasetItemForEvaluation
+from .dataset.utils import load_raw_output
+from .evaluate import log_results
+from .evaluator import load_evaluator
+from .evaluator.base import BaseEvaluator, JudgeRequest
+from .generate import generate, save_metadata
+from .utils.checkpoint import Checkpoint
+
+
+class BenchmarkPipeline:
+    """Sends the judge requests of a benchmark as soon as the items are generated.
+
+    Requests are built per item, or per turn when the evaluator supports it (e.g. MT-Bench judges turn 1
+    while turn 2 is still being generated), and sent in the background. The raw outputs are put back in
+    the order of `BaseEvaluator.build_requests` before aggregating, so that the scores and dashboard tables
+    are the same as those of `evaluate`.
+    """
+
+    def __init__(self, evaluator: BaseEvaluator):
+        self.evaluator = evaluator
+        self.tasks: list[asyncio.Task[tuple[int, int, Sequence[DatasetItemForEvaluation]]]] = []
+        self.submitted_turns: dict[int, int] = {}
+
+    def submit_turn(self, d: DatasetItem, turn: int):
+        submitted = self.submitted_turns.get(id(d), 0)
+        for t in range(submitted, turn + 1):
+            for judge_request in self.evaluator.build_turn_requests(d, t):
+                self.tasks.append(asyncio.ensure_future(self.send(judge_request, d)))
+        self.submitted_turns[id(d)] = max(submitted, turn + 1)
+
+    def submit(self, d: DatasetItem):
+        self.submit_turn(d, len(d.prompt) - 1)
+
+    async def send(
+        self, judge_request: JudgeRequest, d: DatasetItem
+    ) -> tuple[int, int, Sequence[DatasetItemForEvaluation]]:
+        return judge_request.order, id(d), await self.evaluator.send(judge_request)
+
+    async def aggregate(self, data: Sequence[DatasetItem]) -> tuple[dict[str, float | None], dict[str, float]]:
+        results = await asyncio.gather(*self.tasks)
+
+        positions = {id(d): i for i, d in enumerate(data)}
+        results = sorted(results, key=lambda result: (result[0], positions[result[1]]))
+        return self.evaluator.aggregate([raw_output for _, _, raw_outputs in results for raw_output in raw_outputs])
+
+
+async def run_benchmark(
+    cfg: DictConfig, client: BaseClient, benchmark_cfg: DictConfig, evaluator: BaseEvaluator, generation_dir: str
+) -> tuple[dict[str, float | None], dict[str, float]]:
+    pipeline = BenchmarkPipeline(evaluator)
+    data = await generate(
+        cfg,
+        client,
+        benchmark_cfg,
+        output_dir=generation_dir,
+        callback=pipeline.submit,
+        turn_callback=pipeline.submit_turn,
+    )
+    if data is None:
+        # 生成結果が既に存在する場合は、それを評価する
+        output_path = os.path.join(generation_dir, f"{benchmark_cfg.name}.{cfg.output.format}")
+        data = list(load_raw_output(benchmark_cfg.name, output_path))
+        for d in data:
+            pipeline.submit(d)
+
+    logging.info(f"Waiting for the evaluation of benchmark: {benchmark_cfg.name}")
+    return await pipeline.aggregate(data)
+
+
+async def run(
+    cfg: DictConfig,
+    client: BaseClient,
+    judge: BaseClient,
+    evaluators: dict[str, BaseEvaluator],
+    generation_dir: str,
+) -> dict[str, tuple[dict[str, float | None], dict[str, float]]]:
+    results = await asyncio.gather(
+        *(
+            run_benchmark(cfg, client, cfg.benchmark[name], evaluator, generation_dir)
+            for name, evaluator in evaluators.items()
+        )
+    )
+    # 評価用クライアントは生成用クライアントのイベントループで使用したため、ここで接続を閉じる
+    await judge.aclose()
+    return dict(zip(evaluators, results))
+
+
+@hydra.main(config_path="./config", config_name="pipeline")
+def main(cfg: DictConfig):
+    benchmark_names = [name for name, benchmark_cfg in cfg.benchmark.items() if benchmark_cfg.dataset.path]
+    if len(benchmark_names) == 0:
+        logging.error("Must specify at least one dataset.path")
+        return
+
+    output_dir = hydra.utils.to_absolute_path(cfg.output.dir)
+    generation_dir = os.path.join(output_dir, "generation")
+    evaluation_dir = os.path.join(output_dir, "evaluation")
+    save_metadata(cfg, generation_dir)
+    metadata = {"model_name": cfg.client.model_name}
+
+    logging.info("Loading dashboard")
+    dashboard = load_dashboard(cfg, **cfg.get("dashboard", {}))
+
+    logging.info(f"Loading client: {cfg.client.model_name}")
+    client = load_client(**cfg.client)
+
+    logging.info(f"Loading judge client: {cfg.judge.model_name}")
+    judge = load_client(**cfg.judge)
+
+    evaluators: dict[str, BaseEvaluator] = {}
+    checkpoints: list[Checkpoint] = []
+    for name in benchmark_names:
+        checkpoint_path = os.path.join(evaluation_dir, "checkpoint", f"{name}.jsonl")
+        checkpoint = Checkpoint(checkpoint_path, resume=cfg.output.resume)
+        checkpoints.append(checkpoint)
+
+        evaluators[name] = load_evaluator(
+            judge, dashboard, metadata=metadata, checkpoint=checkpoint, **cfg.judge_benchmark[name]
+        )
+
+    # 生成と評価のリクエストを同じイベントループで並行に処理する
+    results = client.run_until_complete(run(cfg, client, judge, evaluators, generation_dir))
+
+    log_results(dashboard, judge, metadata, results)
+    client.telemetry.log("generate", dashboard)
+
+    logging.info(f"Saving evaluation results to {evaluation_dir}")
+    dashboard.save(evaluation_dir, table_format=cfg.output.table_format)
+    client.telemetry.save_prometheus(
+        os.path.join(generation_dir, "metrics.prom"), labels={"stage": "generate", "model": client.model_name}
+    )
+    judge.telemetry.save_prometheus(
+        os.path.join(evaluation_dir, "metrics.prom"), labels={"stage": "evaluate", "model": judge.model_name}
+    )
+
+    for checkpoint in checkpoints:
+        checkpoint.remove()
+
+    dashboard.close()
+    judge.close()
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
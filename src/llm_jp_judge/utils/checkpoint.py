@@ -0,0 +1,109 @@
+import logging
+import os
+from collections.abc import Sequence
+from typing import Any, TypeVar
+
+import hydra
+
+from ..dataset import DatasetItem
+from .data import codec, encode_jsonl
+
+
+T = TypeVar("T", bound=DatasetItem)
+
+
+class Checkpoint:
+    """Append-only journal of completed items used to resume interrupted runs.
+
+    Each completed item is written to the journal as soon as it finishes. When resuming, items whose
+    journal entry holds a response for every turn (and a pattern, if a score extractor is used) are
+    restored and only the missing or failed items are dispatched again.
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        self.path = hydra.utils.to_absolute_path(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self.records: dict[str, dict[str, Any]] = {}
+        if os.path.exists(self.path):
+            if resume:
+                self.records = self.load()
+                logging.info(f"Loaded {len(self.records)} completed items from checkpoint: {self.path}")
+            else:
+                logging.warning(f"Overwriting existing checkpoint: {self.path} (set output.resume=true to resume)")
+                os.remove(self.path)
+
+        self.file = open(self.path, "ab")
+
+    def load(self) -> dict[str, dict[str, Any]]:
+        records = {}
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    record = codec.loads(line)
+                except codec.decode_error:
+                    # The last line may be truncated if the process was killed while writing it
+                    continue
+                # Keys are encoded again so that checkpoints written with another codec can be resumed
+                records[self.encode_key(codec.loads(record["key"]))] = record["item"]
+        return records
+
+    @staticmethod
+    def encode_key(key: list[Any]) -> str:
+        return codec.dumps(key).decode()
+
+    @classmethod
+    def get_key(cls, d: DatasetItem) -> str:
+        return cls.encode_key([d.ID, getattr(d, "metric", None)])
+
+    @staticmethod
+    def is_completed(record: dict[str, Any], require_pattern: bool = False) -> bool:
+        if len(record["response"]) == 0 or any(response is None for response in record["response"]):
+            return False
+        if require_pattern and any(pattern is None for pattern in record["pattern"]):
+            return False
+        return True
+
+    def restore_item(self, d: DatasetItem, require_pattern: bool = False) -> bool:
+        """Restore the outputs of `d` from the checkpoint. Returns False if it has to be dispatched again."""
+        record = self.records.get(self.get_key(d))
+        if record is None or not self.is_completed(record, require_pattern=require_pattern):
+            return False
+
+        d.response = record["response"]
+        d.pattern = record["pattern"]
+        d.error_messages = record["error_messages"]
+        d.time_to_first_token = record.get("time_to_first_token", [])
+        d.usage = record.get("usage", [])
+        return True
+
+    def restore(self, data: Sequence[T], require_pattern: bool = False) -> list[T]:
+        pending = [d for d in data if not self.restore_item(d, require_pattern=require_pattern)]
+        if len(pending) < len(data):
+            logging.info(f"Restored {len(data) - len(pending)} items from checkpoint, {len(pending)} remaining")
+        return pending
+
+    def append(self, d: DatasetItem):
+        record = {
+            "key": self.get_key(d),
+            "item": {
+                "response": d.response,
+                "pattern": d.pattern,
+                "error_messages": d.error_messages,
+                "time_to_first_token": d.time_to_first_token,
+                "usage": d.usage,
+            },
+        }
+        self.file.write(encode_jsonl(record))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+        checkpoint_dir = os.path.dirname(self.path)
+        if len(os.listdir(checkpoint_dir)) == 0:
+            os.rmdir(checkpoint_dir)
@@ -1,39 +1,292 @@
+import csv
 import json
 import os
-from collections.abc import Iterable
+import re
+from collections.abc import Callable, Iterable, Iterator, Mapping, Sequence
 from typing import Any
 
 import hydra
+from pydantic import BaseModel
 
 
-def load_json(path: str) -> Any:
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Buffer size of JSONL files, so that many lines are written to and read from the disk at once
+BUFFER_SIZE = 1 << 20
+# Key of the Parquet schema metadata listing the columns stored as JSON strings
+PARQUET_JSON_COLUMNS_KEY = b"llm_jp_judge.json_columns"
+
+
+class JSONCodec:
+    """Encodes and decodes JSON. This base class uses the standard library `json`."""
+
+    name = "json"
+    # Exception raised when decoding invalid JSON
+    decode_error: type[Exception] = json.JSONDecodeError
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode()
+
+    def loads(self, data: bytes | str) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(JSONCodec):
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+
+        self.orjson = orjson
+        self.option = orjson.OPT_NON_STR_KEYS
+        self.decode_error = orjson.JSONDecodeError
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.orjson.dumps(obj, option=self.option)
+
+    def loads(self, data: bytes | str) -> Any:
+        return self.orjson.loads(data)
+
+
+class MsgspecCodec(JSONCodec):
+    name = "msgspec"
+
+    def __init__(self):
+        import msgspec
+
+        self.encoder = msgspec.json.Encoder()
+        self.decoder = msgspec.json.Decoder()
+        self.decode_error = msgspec.DecodeError
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.encoder.encode(obj)
+
+    def loads(self, data: bytes | str) -> Any:
+        return self.decoder.decode(data)
+
+
+# In order of preference when the codec is selected automatically
+CODECS: dict[str, type[JSONCodec]] = {"orjson": OrjsonCodec, "msgspec": MsgspecCodec, "json": JSONCodec}
+
+
+def load_codec(name: str = "auto") -> JSONCodec:
+    """Load a JSON codec by name, or the first installed one of orjson, msgspec and json for `auto`."""
+    if name != "auto":
+        if name not in CODECS:
+            raise ValueError(f"Invalid JSON codec: {name}")
+        return CODECS[name]()
+
+    for codec_class in CODECS.values():
+        try:
+            return codec_class()
+        except ImportError:
+            continue
+    return JSONCodec()
+
+
+codec = load_codec(os.environ.get("LLM_JP_JUDGE_JSON_CODEC", "auto"))
+
+
+def encode_jsonl(d: Any, exclude: set[str] | None = None, codec: JSONCodec = codec) -> bytes:
+    """Encode a record as a line of JSONL. Pydantic models are serialized to bytes directly, without a dict."""
+    if isinstance(d, BaseModel):
+        return d.__pydantic_serializer__.to_json(d, exclude=exclude) + b"\n"
+    return codec.dumps(d) + b"\n"
+
+
+def load_json(path: str, codec: JSONCodec = codec) -> Any:
     path = hydra.utils.to_absolute_path(path)
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    with open(path, "rb") as f:
+        data = codec.loads(f.read())
     return data
 
 
-def load_jsonl(path: str) -> list[Any]:
+def load_jsonl(path: str, codec: JSONCodec = codec) -> list[Any]:
+    return list(iter_jsonl(path, codec=codec))
+
+
+def iter_jsonl(path: str, codec: JSONCodec = codec) -> Iterator[Any]:
+    """Yield the records of a JSONL file one by one."""
+    path = hydra.utils.to_absolute_path(path)
+    with open(path, "rb", buffering=BUFFER_SIZE) as f:
+        for line in f:
+            if line.strip():
+                yield codec.loads(line)
+
+
+def iter_json_array(path: str, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """Yield the elements of a JSON array file one by one, reading the file in chunks.
+
+    Unlike `json.load`, the file is read only up to the elements that are consumed, so that taking the first
+    few elements of a large dataset does not parse all of it.
+    """
+    decoder = json.JSONDecoder()
     path = hydra.utils.to_absolute_path(path)
-    os.makedirs(os.path.dirname(path), exist_ok=True)
     with open(path, "r", encoding="utf-8") as f:
-        data = [json.loads(line) for line in f]
-    return data
+        buffer, pos = "", 0
+        state = "start"  # start: before "[", first: after "[", value: after ",", separator: after a value
+        while True:
+            pos = WHITESPACE.match(buffer, pos).end()  # type: ignore[union-attr]
+            if pos >= len(buffer):
+                buffer, pos = f.read(chunk_size), 0
+                if len(buffer) == 0:
+                    raise json.JSONDecodeError("Unterminated JSON array", "", 0)
+                continue
+
+            c = buffer[pos]
+            if state == "start":
+                if c != "[":
+                    raise json.JSONDecodeError("Expecting '['", buffer, pos)
+                pos, state = pos + 1, "first"
+            elif c == "]" and state in ["first", "separator"]:
+                return
+            elif state == "separator":
+                if c != ",":
+                    raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+                pos, state = pos + 1, "value"
+            else:
+                while True:
+                    try:
+                        value, end = decoder.raw_decode(buffer, pos)
+                        # 数値などはチャンクの末尾で途切れている可能性があるため、後続の文字がある場合のみ確定する
+                        if end < len(buffer):
+                            break
+                    except json.JSONDecodeError:
+                        pass
+                    chunk = f.read(chunk_size)
+                    if len(chunk) == 0:
+                        value, end = decoder.raw_decode(buffer, pos)
+                        break
+                    buffer, pos = buffer[pos:] + chunk, 0
+                yield value
+                pos, state = end, "separator"
+
+
+def iter_csv(path: str) -> Iterator[dict[str, str]]:
+    path = hydra.utils.to_absolute_path(path)
+    with open(path, "r", encoding="utf-8") as f:
+        yield from csv.DictReader(f)
+
+
+def is_arrow_dataset(path: str) -> bool:
+    """Whether `path` is a dataset saved with `save_to_disk` of Hugging Face `datasets`, or an Arrow file."""
+    path = hydra.utils.to_absolute_path(path)
+    if path.endswith(".arrow"):
+        return True
+    return any(os.path.isfile(os.path.join(path, name)) for name in ["state.json", "dataset_dict.json"])
+
+
+def iter_arrow_dataset(path: str, batch_size: int = 1000) -> Iterator[dict[str, Any]]:
+    """Yield the rows of a local Hugging Face dataset one by one.
+
+    The Arrow table is memory-mapped instead of being read into memory, and only the current batch of rows is
+    converted to dicts, so that the dataset is neither parsed nor held in memory twice.
+    """
+    import datasets
+
+    path = hydra.utils.to_absolute_path(path)
+    if path.endswith(".arrow"):
+        dataset = datasets.Dataset.from_file(path)
+    else:
+        dataset = datasets.load_from_disk(path)
+
+    if isinstance(dataset, datasets.DatasetDict):
+        if len(dataset) != 1:
+            raise ValueError(f"Dataset at {path} has multiple splits, specify one of: {', '.join(dataset)}")
+        dataset = next(iter(dataset.values()))
+
+    for batch in dataset.iter(batch_size=batch_size):
+        for values in zip(*batch.values()):
+            yield dict(zip(batch.keys(), values))
+
+
+def iter_dataset(path: str, reader: Callable[[str], Iterator[Any]]) -> Iterator[Any]:
+    """Yield the records of a local Hugging Face dataset if `path` is one, or those read by `reader` otherwise."""
+    if is_arrow_dataset(path):
+        return iter_arrow_dataset(path)
+    return reader(path)
 
 
-def save_json(path: str, data: Any):
+def save_json(path: str, data: Any, codec: JSONCodec = codec):
     path = hydra.utils.to_absolute_path(path)
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False)
+    with open(path, "wb") as f:
+        f.write(codec.dumps(data))
 
 
-def save_jsonl(path: str, data: Iterable[Any]):
+def save_jsonl(path: str, data: Iterable[Any], exclude: set[str] | None = None, codec: JSONCodec = codec):
+    """Save records (dicts or pydantic models, excluding the `exclude` fields of the latter) as JSONL."""
     path = hydra.utils.to_absolute_path(path)
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        for d in data:
-            f.write(json.dumps(d, ensure_ascii=False) + "\n")
+    with open(path, "wb", buffering=BUFFER_SIZE) as f:
+        f.writelines(encode_jsonl(d, exclude=exclude, codec=codec) for d in data)
+
+
+def contains_mapping(value: Any) -> bool:
+    if isinstance(value, Mapping):
+        return True
+    if isinstance(value, (list, tuple)):
+        return any(contains_mapping(v) for v in value)
+    return False
+
+
+def save_parquet(path: str, data: Iterable[Any], exclude: set[str] | None = None, codec: JSONCodec = codec):
+    """Save records (dicts or pydantic models, excluding the `exclude` fields of the latter) as a Parquet file.
+
+    Each field is stored as a column, so that a subset of the fields can be read without parsing the others.
+    Columns holding mappings (whose keys vary between records, e.g. usage) or values of mixed types (e.g. IDs
+    that are numbers in some records and strings in others) are stored as JSON strings, decoded by `iter_parquet`.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows = [d.model_dump(exclude=exclude) if isinstance(d, BaseModel) else d for d in data]
+    names = list(dict.fromkeys(key for row in rows for key in row))
+
+    arrays, json_columns = [], []
+    for name in names:
+        values = [row.get(name) for row in rows]
+        if not any(contains_mapping(value) for value in values):
+            try:
+                arrays.append(pa.array(values))
+                continue
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                pass
+        arrays.append(pa.array([codec.dumps(value).decode() for value in values], type=pa.string()))
+        json_columns.append(name)
+
+    table = pa.Table.from_arrays(arrays, names=names, metadata={PARQUET_JSON_COLUMNS_KEY: codec.dumps(json_columns)})
+    path = hydra.utils.to_absolute_path(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(table, path, compression="zstd")
+
+
+def iter_parquet(
+    path: str, columns: Sequence[str] | None = None, batch_size: int = 1 << 16, codec: JSONCodec = codec
+) -> Iterator[dict[str, Any]]:
+    """Yield the records of a Parquet file one by one, reading only the given `columns` if specified."""
+    import pyarrow.parquet as pq
+
+    path = hydra.utils.to_absolute_path(path)
+    parquet_file = pq.ParquetFile(path)
+    metadata = parquet_file.schema_arrow.metadata or {}
+    json_columns = set(codec.loads(metadata.get(PARQUET_JSON_COLUMNS_KEY, b"[]")))
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        decoded_columns = json_columns.intersection(batch.schema.names)
+        for row in batch.to_pylist():
+            for name in decoded_columns:
+                row[name] = codec.loads(row[name])
+            yield row
+
+
+def load_parquet(path: str, columns: Sequence[str] | None = None, codec: JSONCodec = codec) -> list[dict[str, Any]]:
+    return list(iter_parquet(path, columns=columns, codec=codec))
+
+
+def iter_records(path: str) -> Iterator[Any]:
+    """Yield the records of a Parquet file, or of a JSONL file for any other extension."""
+    if path.endswith(".parquet"):
+        return iter_parquet(path)
+    return iter_jsonl(path)
 
 
 def load_file(path: str) -> Any:
@@ -0,0 +1,58 @@
+import asyncio
+import json
+from pathlib import Path
+
+from src.llm_jp_judge.client.batch import LocalBatch, LocalBatchService
+from src.llm_jp_judge.dataset import DatasetItem
+
+
+class FailingBatchService(LocalBatchService):
+    """Local batch service failing to submit any batch containing the prompt `fail`."""
+
+    async def submit(self, path: str) -> str:
+        with open(path, encoding="utf-8") as f:
+            requests = [json.loads(line) for line in f]
+        if any(request["body"]["messages"][-1]["content"] == "fail" for request in requests):
+            raise RuntimeError("Injected submission error")
+        return await super().submit(path)
+
+
+def make_client(tmp_path: Path, **kwargs) -> LocalBatch:
+    return LocalBatch(batch_dir=str(tmp_path), max_batch_size=1, max_retries=0, **kwargs)
+
+
+def make_data(prompts: list[str]) -> list[DatasetItem]:
+    return [DatasetItem(ID=i, prompt=[prompt]) for i, prompt in enumerate(prompts)]
+
+
+def test_batch_returns_responses_in_order(tmp_path: Path):
+    client = make_client(tmp_path)
+    data = asyncio.run(client.process_data(make_data(["a", "b", "c"])))
+
+    assert [d.response for d in data] == [["a"], ["b"], ["c"]]
+    assert all(d.error_messages == [[]] for d in data)
+    # 結果の取得後は入出力ファイルが削除される
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_failed_chunk_does_not_abort_other_chunks(tmp_path: Path):
+    client = make_client(tmp_path)
+    client.batch_service = FailingBatchService(client.batch_dir, lambda body: body["messages"][-1]["content"])
+    data = asyncio.run(client.process_data(make_data(["a", "fail", "c"])))
+
+    assert [d.response for d in data] == [["a"], [None], ["c"]]
+    assert data[0].error_messages == [[]]
+    assert data[1].error_messages == [["RuntimeError: Injected submission error"]]
+    assert data[2].error_messages == [[]]
+
+
+def test_batch_uses_response_cache(tmp_path: Path):
+    cache = {"path": str(tmp_path / "cache.sqlite")}
+    asyncio.run(make_client(tmp_path, response="cached", cache=cache).process_data(make_data(["a"])))
+
+    # 再生モードではキャッシュされた応答のみを返し、キャッシュにないリクエストはエラーとする
+    client = make_client(tmp_path, response="fresh", cache={**cache, "mode": "replay"})
+    data = asyncio.run(client.process_data(make_data(["a", "b"])))
+
+    assert [d.response for d in data] == [["cached"], [None]]
+    assert data[1].error_messages[0][0].startswith("Cache miss in replay mode")
@@ -0,0 +1,58 @@
+import asyncio
+
+from omegaconf import DictConfig, OmegaConf
+
+from src.llm_jp_judge.client.remote import OpenAI
+from src.llm_jp_judge.dashboard.base import BaseDashboard
+from src.llm_jp_judge.dataset.mt_bench import MTBenchDatasetItem
+from src.llm_jp_judge.evaluator.mt_bench import MTBenchEvaluator
+from src.llm_jp_judge.mock_server import MockServer
+
+
+CONFIG_DIR = "src/llm_jp_judge/config"
+
+
+async def evaluate_mt_bench(server: MockServer) -> tuple[dict[str, float | None], dict[str, float]]:
+    prompt_template = OmegaConf.load(f"{CONFIG_DIR}/benchmark/prompt/evaluate/mt_bench_en_prompt_v0.yaml")
+    assert isinstance(prompt_template, DictConfig)
+    data = [
+        MTBenchDatasetItem(ID=81, category="writing", prompt=["質問1", "質問2"], response=["回答1", "回答2"]),
+        MTBenchDatasetItem(ID=101, category="reasoning", prompt=["質問1", "質問2"], response=["回答1", "回答2"]),
+    ]
+
+    async with await server.start() as s:
+        client = OpenAI(
+            model_name="mock",
+            api_key="mock",
+            base_url=f"http://127.0.0.1:{s.sockets[0].getsockname()[1]}/v1",
+            async_request_interval=0,
+        )
+        evaluator = MTBenchEvaluator(
+            client,
+            BaseDashboard(),
+            prompt_template=prompt_template,
+            name="mt_bench_en",
+            reference={
+                "path": "src/llm_jp_judge/data/mt_bench_en/reference_answer/gpt-4-v0.jsonl",
+                "categories": ["math", "reasoning", "coding"],
+            },
+        )
+        try:
+            return await evaluator.aevaluate(data)
+        finally:
+            await client.aclose()
+
+
+def test_mt_bench_evaluation_with_mock_server():
+    # 既定の応答規則を使い、シングルターン・マルチターンの評価プロンプトのどちらにも [[rating]] 形式で応答させる
+    server_cfg = OmegaConf.to_container(OmegaConf.load(f"{CONFIG_DIR}/mock_server.yaml").server)
+    assert isinstance(server_cfg, dict)
+    server_cfg.update(latency_mean=0.0, latency_std=0.0, seed=0)
+    server = MockServer(**server_cfg)
+
+    scores, error_rates = asyncio.run(evaluate_mt_bench(server))
+
+    # 2項目 x 2ターンの評価リクエストが送信され、すべてのスコアが抽出される
+    assert server.stats["requests"] == 4
+    assert scores["mt_bench_en"] is not None and 1 <= scores["mt_bench_en"] <= 3
+    assert error_rates == {"mt_bench_en:api(%)": 0.0, "mt_bench_en:pattern_match(%)": 0.0}
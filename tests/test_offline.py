@@ -0,0 +1,42 @@
+import asyncio
+from collections import Counter
+from typing import Any
+
+from src.llm_jp_judge.client.offline import VLLM, FakeEngine
+from src.llm_jp_judge.dataset import DatasetItem
+
+
+class CountingEngine(FakeEngine):
+    """Fake engine reporting the number of characters of the conversation and of the response as tokens."""
+
+    def chat(
+        self, messages: list[list[dict[str, Any]]], sampling_params: list[dict[str, Any]]
+    ) -> list[tuple[str, int, int, int]]:
+        results = []
+        for (text, _, _, _), m in zip(super().chat(messages, sampling_params), messages):
+            results.append((text, sum(len(message["content"]) for message in m), len(text), 1))
+        return results
+
+
+def test_vllm_keeps_order_and_records_usage():
+    client = VLLM(fake=True, max_batch_size=2)
+    client.engine = CountingEngine()
+    data = [
+        DatasetItem(ID=0, prompt=["a", "bb"]),
+        DatasetItem(ID=1, prompt=["ccc"]),
+        DatasetItem(ID=2, prompt=["dddd", "eeeee"]),
+    ]
+
+    data = list(asyncio.run(client.process_data(data)))
+
+    # 応答は複数のチャンクに分かれても、項目とターンの順序どおりに対応する
+    assert [d.ID for d in data] == [0, 1, 2]
+    assert [d.response for d in data] == [["a", "bb"], ["ccc"], ["dddd", "eeeee"]]
+    assert all(messages == [] for d in data for messages in d.error_messages)
+
+    # 2ターン目の入力には、1ターン目の入力と応答が含まれる
+    assert data[0].usage == [
+        {"input_tokens": 1, "output_tokens": 1, "reasoning_tokens": 0, "cached_tokens": 1, "cache_creation_tokens": 0},
+        {"input_tokens": 4, "output_tokens": 2, "reasoning_tokens": 0, "cached_tokens": 1, "cache_creation_tokens": 0},
+    ]
+    assert client.get_usage()[None] == Counter(input_tokens=1 + 4 + 3 + 4 + 13, output_tokens=15, cached_tokens=5)
@@ -0,0 +1,43 @@
+import asyncio
+from typing import Any
+
+from src.llm_jp_judge.client.pool import PooledClient
+from src.llm_jp_judge.mock_server import MockServer
+
+
+class FailingServer(MockServer):
+    """Mock server answering every chat-completions request with a 500."""
+
+    async def handle_chat_completions(self, writer: asyncio.StreamWriter, request: dict[str, Any]) -> bool:
+        self.stats["requests"] += 1
+        await self.send_json(writer, 500, {"error": {"message": "Injected server error", "type": "server_error"}})
+        return True
+
+
+async def request_through_pool(failing: MockServer, healthy: MockServer) -> str | None:
+    async with await failing.start() as f, await healthy.start() as h:
+        client = PooledClient(
+            endpoints=[
+                # 最初の試行が失敗するエンドポイントに送られるよう、重みを大きくする
+                {"base_url": f"http://127.0.0.1:{f.sockets[0].getsockname()[1]}/v1", "api_key": "mock", "weight": 1e6},
+                {"base_url": f"http://127.0.0.1:{h.sockets[0].getsockname()[1]}/v1", "api_key": "mock"},
+            ],
+            model_name="mock",
+            async_request_interval=0,
+        )
+        try:
+            return await client.async_request(["ping"], [])
+        finally:
+            await client.aclose()
+
+
+def test_server_error_fails_over_to_another_endpoint():
+    failing = FailingServer()
+    healthy = MockServer(latency_mean=0.0, responses=[{"pattern": None, "content": "pong"}])
+
+    result = asyncio.run(request_through_pool(failing, healthy))
+
+    assert result == "pong"
+    # SDKが同じエンドポイントに再試行せず、1回の 5xx で次の試行が別のエンドポイントに送られる
+    assert failing.stats["requests"] == 1
+    assert healthy.stats["requests"] == 1